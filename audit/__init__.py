@@ -0,0 +1,107 @@
+# audit/__init__.py
+import logging
+import threading
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from config import AUDIT_BATCH_SIZE, AUDIT_FLUSH_SECONDS, AUDIT_MAX_BUFFER
+
+logger = logging.getLogger(__name__)
+
+# Duplicate key: the event was written by an earlier attempt of a partly failed batch
+DUPLICATE_KEY = 11000
+
+class AuditLogger:
+    """PHI access events buffered in process and written with insert_many.
+    
+    record() only appends to a list, so a page view costs no database write.
+    A background thread flushes the buffer once batch_size events are waiting
+    or every flush_seconds, whichever comes first; close() stops it and writes
+    what is left, and is registered to run at interpreter exit.
+    """
+
+    def __init__(self, repository, batch_size=AUDIT_BATCH_SIZE, flush_seconds=AUDIT_FLUSH_SECONDS,
+                 max_buffer=AUDIT_MAX_BUFFER):
+        self.repository = repository
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.stats = {"recorded": 0, "written": 0, "flushes": 0, "failures": 0, "dropped": 0}
+        self._buffer = []
+        self._lock = threading.Lock()
+        # One flush at a time, so a failed batch is put back ahead of newer events
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="audit-log-flusher", daemon=True)
+        self._thread.start()
+
+    def record(self, action, actor_id, patient_id, actor_type=None, **details):
+        """Queue one access by actor_id to patient_id's information"""
+        event = {
+            "at": datetime.utcnow(),
+            "meta": {"patient_id": patient_id, "actor_id": actor_id},
+            "actor_type": actor_type,
+            "action": action,
+            **details
+        }
+        with self._lock:
+            self._buffer.append(event)
+            self.stats["recorded"] += 1
+            full = len(self._buffer) >= self.batch_size
+        if self._stopping.is_set():
+            # Recorded during shutdown: nothing is left to flush it later
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        """Write every buffered event now; return how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+            try:
+                self.repository.insert_many(events)
+                failed = []
+            except BulkWriteError as e:
+                failed = [events[error["index"]] for error in e.details.get("writeErrors", [])
+                          if error.get("code") != DUPLICATE_KEY]
+                if failed:
+                    logger.warning("Audit log flush wrote %d of %d events", len(events) - len(failed), len(events))
+            except Exception:
+                logger.exception("Audit log flush failed; keeping %d events for the next one", len(events))
+                failed = events
+            
+            with self._lock:
+                self.stats["flushes"] += 1
+                self.stats["written"] += len(events) - len(failed)
+                if failed:
+                    self.stats["failures"] += 1
+                    self._buffer[:0] = failed
+                    # An outage must not grow the buffer without bound: the oldest events go first
+                    overflow = len(self._buffer) - self.max_buffer
+                    if overflow > 0:
+                        del self._buffer[:overflow]
+                        self.stats["dropped"] += overflow
+                        logger.error("Audit log buffer full; dropped %d events", overflow)
+            return len(events) - len(failed)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def close(self, timeout=10):
+        """Stop the flusher thread and write the remaining events"""
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self.flush()
@@ -0,0 +1,110 @@
+# benchmarks/assignment_simulation.py
+"""
+Queue balance across doctors: patient-picked doctor vs "any available" assignment.
+
+Simulates a day of consultation requests for one specialization. In the
+"before" mode patients pick a named doctor, skewed towards the first listed
+doctors the way a selectbox is. In the "after" mode every request is
+assigned with claim_least_loaded_doctor(). Doctors complete pending work at
+the same rate in both modes. The variance of the pending queue length across
+doctors is sampled after every tick.
+
+Runs against the in-memory engine by default; set MEDICONSULT_STORAGE=mongo
+(and MONGODB_URI) to run against a real mongod.
+
+Usage:
+    python benchmarks/assignment_simulation.py --doctors 8 --ticks 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("MONGODB_DATABASE", "mediconsult_bench")
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+sys.path.insert(0, APP_DIR)
+
+from config import STORAGE_BACKEND
+from database import create_database, UserRepository, ConsultationRepository
+
+SPECIALIZATION = "General Physician"
+
+
+def seed(users, doctors):
+    return [
+        users.create({
+            "name": f"Sim Doctor {i}",
+            "email": f"sim-doctor-{i}@mediconsult.com",
+            "user_type": "doctor",
+            "specialization": SPECIALIZATION,
+            "is_available": True,
+            "pending_count": 0
+        })
+        for i in range(doctors)
+    ]
+
+
+def simulate(assign_any, doctors, ticks, arrivals, completions, seed_value):
+    db = create_database(STORAGE_BACKEND, f"mediconsult_bench_assign_{int(assign_any)}")
+    users, consultations = UserRepository(db), ConsultationRepository(db)
+    users.ensure_indexes()
+    consultations.ensure_indexes()
+    doctor_ids = seed(users, doctors)
+    rng = random.Random(seed_value)
+    # Zipf-like preference for the doctors listed first
+    weights = [1 / (rank + 1) for rank in range(doctors)]
+
+    variances = []
+    try:
+        for _ in range(ticks):
+            for _ in range(rng.randint(0, arrivals * 2)):
+                data = {"patient_id": rng.random(), "status": "pending", "created_at": datetime.utcnow()}
+                if assign_any:
+                    doctor = users.claim_least_loaded_doctor(SPECIALIZATION)
+                    consultations.create({**data, "doctor_id": doctor["_id"]}, pending_claimed=True)
+                else:
+                    consultations.create({**data, "doctor_id": rng.choices(doctor_ids, weights)[0]})
+
+            for doctor_id in doctor_ids:
+                pending = consultations.list_for_doctor(doctor_id, status="pending", projection={"_id": 1})
+                for consult in pending[-completions:]:
+                    consultations.update(consult["_id"], {"status": "completed"})
+
+            queues = [users.get_by_id(doctor_id, {"pending_count": 1})["pending_count"] for doctor_id in doctor_ids]
+            variances.append(statistics.pvariance(queues))
+
+        recount = consultations.pending_counts_by_doctor()
+        drift = sum(abs(recount.get(doctor_id, 0) - queue) for doctor_id, queue in zip(doctor_ids, queues))
+    finally:
+        db.drop_collection("users")
+        db.drop_collection("consultations")
+    return variances, queues, drift
+
+
+def report(label, variances, queues, drift):
+    print(f"{label:<32} mean variance {statistics.mean(variances):8.2f}   "
+          f"max variance {max(variances):8.2f}   final queues {queues}   counter drift {drift}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--doctors", type=int, default=8, help="doctors in the specialization")
+    parser.add_argument("--ticks", type=int, default=500, help="simulated time steps")
+    parser.add_argument("--arrivals", type=int, default=7, help="mean new requests per tick")
+    parser.add_argument("--completions", type=int, default=1, help="consultations each doctor completes per tick")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    options = (args.doctors, args.ticks, args.arrivals, args.completions, args.seed)
+    print(f"{args.doctors} doctors, {args.ticks} ticks, ~{args.arrivals} requests and "
+          f"{args.completions} completion(s) per doctor per tick ({STORAGE_BACKEND} storage)")
+    report("before: patient picks doctor", *simulate(False, *options))
+    report("after: any available doctor", *simulate(True, *options))
+
+
+if __name__ == "__main__":
+    main()
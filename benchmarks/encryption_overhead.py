@@ -0,0 +1,136 @@
+# benchmarks/encryption_overhead.py
+"""
+Latency of consultation list views with field encryption, against plaintext.
+
+Seeds the same consultations into two databases, one written through a
+repository without a cipher and one through a FieldCipher, then times the
+reads behind the app's list views with their own projections: each patient's
+history, the doctor's pending queue and the doctor's overview. Only projected
+fields are decrypted, so these should cost about what plaintext does. Opening
+a consultation, which decrypts all four fields, is timed too but is not a
+list view. Data keys are cached as in a running server; the first read after
+the cache is cleared is reported separately. Exits non-zero when a list view
+is more than --budget slower than plaintext.
+
+Runs against the in-memory engine by default; set MEDICONSULT_STORAGE=mongo
+(and MONGODB_URI) to measure against a real mongod.
+
+Usage:
+    python benchmarks/encryption_overhead.py --patients 50 --per-patient 20
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("MONGODB_DATABASE", "mediconsult_bench")
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+sys.path.insert(0, APP_DIR)
+
+from bson import ObjectId
+
+from config import DATABASE_NAME
+from database import create_database, ConsultationRepository
+from encryption import FieldCipher, generate_master_key
+from utils import CONSULTATION_SUMMARY_PROJECTION
+
+
+def seed(repository, patient_ids, per_patient, doctor_id):
+    start = datetime.utcnow() - timedelta(days=per_patient)
+    for patient_id in patient_ids:
+        for i in range(per_patient):
+            repository.collection.insert_one(repository.encrypt_fields(patient_id, {
+                "patient_id": patient_id, "doctor_id": doctor_id, "doctor_name": "Bench Doctor",
+                "symptoms": f"Intermittent chest tightness on exertion for {i + 1} weeks, worse on stairs. " * 3,
+                "diagnosis": "Stable angina, to be confirmed by exercise ECG",
+                "prescription": "Aspirin 75mg OD; GTN spray PRN; atorvastatin 80mg ON",
+                "consultation_notes": "Discussed red flags and when to call an ambulance. Review in 2 weeks.",
+                "allergies": ["penicillin"], "medical_history": ["hypertension"],
+                "status": "pending" if i % 4 == 0 else "completed",
+                "created_at": start + timedelta(days=i), "updated_at": start + timedelta(days=i)
+            }))
+    for index in ([("patient_id", 1), ("created_at", -1)], [("doctor_id", 1), ("status", 1)]):
+        repository.collection.create_index(index)
+
+
+def views(repository, patient_ids, doctor_id):
+    """{view: read}, as the dashboards query them"""
+    return {
+        "patient histories": lambda: [repository.find({"patient_id": patient_id}, CONSULTATION_SUMMARY_PROJECTION)
+                                      for patient_id in patient_ids],
+        "doctor pending queue": lambda: repository.list_for_doctor(doctor_id, "pending",
+                                                                   projection={"_id": 1, "patient_id": 1}),
+        "doctor overview": lambda: repository.find({"doctor_id": doctor_id}, CONSULTATION_SUMMARY_PROJECTION),
+        "open each patient's latest": lambda: [
+            repository.get(repository.find({"patient_id": patient_id}, {"_id": 1})[0]["_id"])
+            for patient_id in patient_ids]
+    }
+
+# Decrypts every clinical field of the consultations it opens: reported, not held to the budget
+DETAIL_VIEW = "open each patient's latest"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--per-patient", type=int, default=20, help="consultations per patient")
+    parser.add_argument("--rounds", type=int, default=30, help="timed rounds per view")
+    parser.add_argument("--budget", type=float, default=0.10, help="allowed slowdown of a list view")
+    args = parser.parse_args()
+    
+    plain_db = create_database(name=f"{DATABASE_NAME}_plain")
+    encrypted_db = create_database(name=f"{DATABASE_NAME}_encrypted")
+    plain = ConsultationRepository(plain_db)
+    cipher = FieldCipher(encrypted_db, master_key=generate_master_key())
+    encrypted = ConsultationRepository(encrypted_db, cipher)
+    doctor_id = ObjectId()
+    patient_ids = [ObjectId() for _ in range(args.patients)]
+    try:
+        for repository in (plain, encrypted):
+            seed(repository, patient_ids, args.per_patient, doctor_id)
+        reads = {"plain": views(plain, patient_ids, doctor_id), "encrypted": views(encrypted, patient_ids, doctor_id)}
+        results = {label: {view: [] for view in reads[label]} for label in reads}
+        gc.collect()
+        gc.disable()
+        for round_number in range(args.rounds):
+            # Each view is timed back to back in both, in alternating order, so load drift hits both alike
+            labels = ["plain", "encrypted"][::1 if round_number % 2 else -1]
+            for view in reads["plain"]:
+                for label in labels:
+                    started = time.perf_counter()
+                    reads[label][view]()
+                    results[label][view].append(time.perf_counter() - started)
+        gc.enable()
+        cipher.cache.clear()
+        started = time.perf_counter()
+        encrypted.list_for_patient(patient_ids[0])
+        cold = time.perf_counter() - started
+    finally:
+        for database in (plain_db, encrypted_db):
+            for name in ("consultations", "data_keys"):
+                database.drop_collection(name)
+    
+    print(f"{args.patients} patients x {args.per_patient} consultations "
+          f"({os.environ['MEDICONSULT_STORAGE']} storage), median of {args.rounds} rounds")
+    over_budget = []
+    for view in results["plain"]:
+        before = statistics.median(results["plain"][view])
+        after = statistics.median(results["encrypted"][view])
+        overhead = after / before - 1
+        print(f"{view:<34} plaintext {before * 1000:8.2f} ms   encrypted {after * 1000:8.2f} ms   "
+              f"{overhead:+7.1%}")
+        if overhead > args.budget and view != DETAIL_VIEW:
+            over_budget.append(view)
+    print(f"\none patient's full documents with an empty key cache: {cold * 1000:.2f} ms")
+    print(f"data key cache: {cipher.cache.stats}")
+    if over_budget:
+        raise SystemExit(f"Over the {args.budget:.0%} budget: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    main()
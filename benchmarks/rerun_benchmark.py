@@ -0,0 +1,135 @@
+# benchmarks/rerun_benchmark.py
+"""
+Rerun cost of the doctor dashboard: full script rerun vs fragment-scoped submit.
+
+"before" is simulated: the pre-fragment app is not kept, so it replays what
+every form submit used to cost as a full run of main() (CSS, header, sidebar
+and every query in the view) with cache_resource cleared first, because
+setup_database() used to run, and hash the seed passwords, on every rerun.
+"full rerun" is measured as the app is now: a full run of main() with warm
+caches. "after" submits one opened consultation's response form, which
+reruns only that consultation's fragment plus the pending counter.
+
+Runs against the in-memory engine by default; set MEDICONSULT_STORAGE=mongo
+(and MONGODB_URI) to measure against a real mongod.
+
+Usage:
+    python benchmarks/rerun_benchmark.py --pending 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(APP_DIR, "mediconsult_app.py")
+
+# Keep benchmark data out of the application database
+os.environ.setdefault("MONGODB_DATABASE", "mediconsult_bench")
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+sys.path.insert(0, APP_DIR)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from database import db
+
+
+def seed(db, pending):
+    db.users.delete_many({})
+    db.consultations.delete_many({})
+    doctor_id = db.users.insert_one({
+        "name": "Bench Doctor",
+        "email": "bench-doctor@mediconsult.com",
+        "user_type": "doctor",
+        "specialization": "General Physician"
+    }).inserted_id
+    patient_id = db.users.insert_one({
+        "name": "Bench Patient",
+        "email": "bench-patient@mediconsult.com",
+        "user_type": "patient"
+    }).inserted_id
+    db.consultations.insert_many([
+        {
+            "patient_id": patient_id,
+            "doctor_id": doctor_id,
+            "symptoms": f"Benchmark symptoms #{i}",
+            "status": "pending",
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        for i in range(pending)
+    ])
+    return doctor_id
+
+
+def logged_in_app(doctor_id):
+    at = AppTest.from_file(APP_FILE, default_timeout=120)
+    at.session_state.logged_in = True
+    at.session_state.user_id = doctor_id
+    at.session_state.user_type = "doctor"
+    at.session_state.user_name = "Bench Doctor"
+    return at.run()
+
+
+def time_full_reruns(at, rounds, cold_setup=False):
+    timings = []
+    for _ in range(rounds):
+        if cold_setup:
+            # Simulates setup_database() running (and hashing passwords) on every rerun
+            st.cache_resource.clear()
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def time_fragment_submits(at, doctor_id, rounds):
+    timings = []
+    for i in range(rounds):
+        # Untimed full run with the next pending consultation opened, so its form is in the element tree
+        consult_id = db.consultations.find_one({"doctor_id": doctor_id, "status": "pending"}, {"_id": 1})["_id"]
+        at.session_state[f"response_{consult_id}"] = True
+        at.run()
+        at.text_area(key=f"diagnosis_{consult_id}").input(f"Diagnosis {i}")
+        submit = next(b for b in at.button if b.label == "Complete Consultation")
+        start = time.perf_counter()
+        submit.click().run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    print(f"{label:<32} median {statistics.median(timings) * 1000:8.1f} ms   "
+          f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1] * 1000:8.1f} ms   n={len(timings)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pending", type=int, default=50, help="pending consultations to seed")
+    parser.add_argument("--rounds", type=int, default=20, help="reruns measured per mode")
+    args = parser.parse_args()
+
+    doctor_id = seed(db, max(args.pending, args.rounds))
+
+    try:
+        at = logged_in_app(doctor_id)
+        before = time_full_reruns(at, args.rounds, cold_setup=True)
+        full = time_full_reruns(at, args.rounds)
+        after = time_fragment_submits(at, doctor_id, args.rounds)
+    finally:
+        db.drop_collection("users")
+        db.drop_collection("consultations")
+
+    print(f"Doctor dashboard with {max(args.pending, args.rounds)} pending consultations "
+          f"({os.environ['MEDICONSULT_STORAGE']} storage)")
+    report("before (simulated): cold rerun", before)
+    report("full rerun of main()", full)
+    report("after: fragment-scoped submit", after)
+    print(f"speedup vs simulated before: {statistics.median(before) / statistics.median(after):.1f}x   "
+          f"vs full rerun: {statistics.median(full) / statistics.median(after):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
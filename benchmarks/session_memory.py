@@ -0,0 +1,100 @@
+# benchmarks/session_memory.py
+"""
+Bytes of session state held per session, for sizing pods by sessions per GiB.
+
+Drives the app script with Streamlit's AppTest for a patient who picked a
+doctor and a doctor with a queue of pending consultations, then reports each
+session's state with metrics.session_report(), the same accounting served by
+GET /sessions on the health port of a running server. For comparison it also
+prints what the state would hold with the full doctor document in
+selected_doctor, as sessions stored it before.
+
+Runs against the in-memory engine by default; set MEDICONSULT_STORAGE=mongo
+(and MONGODB_URI) to run against a real mongod.
+
+Usage:
+    python benchmarks/session_memory.py --pending 20
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("MONGODB_DATABASE", "mediconsult_bench")
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+sys.path.insert(0, APP_DIR)
+
+from streamlit.testing.v1 import AppTest
+from streamlit.runtime.stats import safe_sizeof
+
+from database import users, consultations
+from metrics import session_report
+from utils import hash_password
+
+APP_FILE = os.path.join(APP_DIR, "mediconsult_app.py")
+
+
+def seed(pending):
+    doctor_id = users.create({
+        "name": "Bench Doctor", "email": f"bench-doctor-{datetime.utcnow().timestamp()}@mediconsult.com",
+        "password": hash_password("bench"), "user_type": "doctor", "specialization": "Cardiologist",
+        "qualifications": "MD Cardiology, 10 years experience", "consultation_fee": 100,
+        "available_hours": "Mon-Fri 9AM-5PM", "phone": "+1234567891", "is_available": True,
+        "created_at": datetime.utcnow()
+    })
+    patient_id = users.create({
+        "name": "Bench Patient", "email": f"bench-patient-{datetime.utcnow().timestamp()}@mediconsult.com",
+        "password": hash_password("bench"), "user_type": "patient", "created_at": datetime.utcnow()
+    })
+    for i in range(pending):
+        consultations.create({
+            "patient_id": patient_id, "patient_name": "Bench Patient",
+            "doctor_id": doctor_id, "doctor_name": "Bench Doctor",
+            "symptoms": f"Recurring chest pain after exercise, episode {i}. " * 5,
+            "medical_history": ["hypertension"], "allergies": ["penicillin"],
+            "status": "pending", "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+        })
+    return doctor_id, patient_id
+
+
+def logged_in(user_id, user_type, name):
+    at = AppTest.from_file(APP_FILE, default_timeout=60)
+    at.session_state.logged_in = True
+    at.session_state.user_id = user_id
+    at.session_state.user_type = user_type
+    at.session_state.user_name = name
+    return at.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pending", type=int, default=20, help="pending consultations for the doctor")
+    args = parser.parse_args()
+    
+    doctor_id, patient_id = seed(args.pending)
+    
+    patient = logged_in(patient_id, "patient", "Bench Patient")
+    next(b for b in patient.button if b.key == f"book_{doctor_id}").click().run()
+    doctor = logged_in(doctor_id, "doctor", "Bench Doctor")
+    for at in (patient, doctor):
+        if at.exception:
+            raise SystemExit(at.exception[0].value)
+    
+    # AppTest wraps the SafeSessionState a server session would hold
+    report = session_report({"patient": patient.session_state._state, "doctor": doctor.session_state._state})
+    for session in report["by_session"]:
+        print(f"{session['session']:<8} {session['bytes']:>8} bytes in {session['keys']} keys")
+        for key, size in session["largest"].items():
+            print(f"           {size:>8}  {key}")
+    print(f"\nmean {report['mean_bytes']} bytes/session -> {report['sessions_per_gib']:,} sessions per GiB "
+          f"of session state")
+    
+    doctor_document = users.get_by_id(doctor_id)
+    print(f"\nselected_doctor as a full document: {safe_sizeof(doctor_document)} bytes "
+          f"(selected_doctor_id: {safe_sizeof(doctor_id)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# benchmarks/startup_benchmark.py
+"""
+Cold-start cost of the app script, measured with `python -X importtime`.
+
+Each round imports mediconsult_app in a fresh interpreter. "script" is the
+cost on top of streamlit and pymongo, which the server process has already
+loaded when the first session runs the script; "process" is the whole
+import from an empty interpreter. The slowest app-owned and third-party
+modules are listed, and warm_up() is timed once at the end.
+
+Runs against the in-memory engine by default; set MEDICONSULT_STORAGE=mongo
+(and MONGODB_URI) to include the real connection in the warm-up.
+
+Usage:
+    python benchmarks/startup_benchmark.py --rounds 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+os.environ.setdefault("MONGODB_DATABASE", "mediconsult_bench")
+
+
+def import_times(preload=()):
+    """{module: (self_us, cumulative_us)} for one `import mediconsult_app`"""
+    statement = "; ".join([*(f"import {module}" for module in preload), "import mediconsult_app"])
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=APP_DIR, capture_output=True, text=True, check=True
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def report(label, timings):
+    print(f"{label:<36} median {statistics.median(timings) / 1000:8.1f} ms   "
+          f"min {min(timings) / 1000:8.1f} ms   n={len(timings)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    args = parser.parse_args()
+
+    script = [import_times(("streamlit", "pymongo"))["mediconsult_app"][1] for _ in range(args.rounds)]
+    runs = [import_times() for _ in range(args.rounds)]
+    process = [times["mediconsult_app"][1] for times in runs]
+
+    print(f"Importing mediconsult_app ({os.environ['MEDICONSULT_STORAGE']} storage)")
+    report("script (streamlit, pymongo loaded)", script)
+    report("process (empty interpreter)", process)
+
+    print("\nSlowest modules by self time (last round):")
+    for module, (self_us, _) in sorted(runs[-1].items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {module}")
+
+    sys.path.insert(0, APP_DIR)
+    from startup import warm_up
+    start = time.perf_counter()
+    warm_up()
+    print(f"\nwarm_up(): {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,122 @@ load_dotenv()
 
 # MongoDB Configuration
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-DATABASE_NAME = "mediconsult"
+DATABASE_NAME = os.getenv("MONGODB_DATABASE", "mediconsult")
+# Connections the pool opens up front and keeps open, so requests after a scale-up do not wait on handshakes
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "5"))
+# Fail fast while Mongo is unreachable instead of holding script threads for pymongo's 30s default
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "2000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "10000"))
+# After this many consecutive connection failures database calls fail immediately, until
+# DB_BREAKER_RESET_SECONDS have passed (or a heartbeat succeeds); then a single trial call is
+# let through while the others keep failing fast
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+DB_BREAKER_RESET_SECONDS = float(os.getenv("DB_BREAKER_RESET_SECONDS", "10"))
+
+# Health endpoints (/readyz, /livez) served next to Streamlit by serve.py
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8502"))
+HEALTH_PING_BUDGET_MS = int(os.getenv("HEALTH_PING_BUDGET_MS", "250"))
+# A full script run taking longer than this means the script runner is wedged
+HEALTH_MAX_RUN_SECONDS = int(os.getenv("HEALTH_MAX_RUN_SECONDS", "120"))
+# Per-session diagnostics (/sessions), bound to 127.0.0.1 only
+DIAGNOSTICS_PORT = int(os.getenv("DIAGNOSTICS_PORT", "8503"))
+
+# Storage backend: "mongo" for MongoDB, "memory" for the in-process engine (tests, benchmarks)
+STORAGE_BACKEND = os.getenv("MEDICONSULT_STORAGE", "mongo")
 
 # Collections
 USERS_COLLECTION = "users"
 CONSULTATIONS_COLLECTION = "consultations"
 LAB_REPORTS_COLLECTION = "lab_reports"
+LAB_REQUESTS_COLLECTION = "lab_requests"
+OUTBOX_COLLECTION = "outbox"
+SESSIONS_COLLECTION = "sessions"
+PATIENT_RECORDS_COLLECTION = "patient_records"
+AUDIT_LOG_COLLECTION = "audit_log"
+DATA_KEYS_COLLECTION = "data_keys"
+CACHE_GENERATIONS_COLLECTION = "cache_generations"
 
 # User Types
 USER_TYPE_PATIENT = "patient"
 USER_TYPE_DOCTOR = "doctor"
 USER_TYPE_ADMIN = "admin"
+USER_TYPE_LAB = "lab"
+
+# Appointment scheduling
+SLOT_MINUTES = 30
+BOOKING_HORIZON_DAYS = 7
+
+# Patient record summaries: diagnoses kept, and how long a prescription counts as active
+RECORD_RECENT_DIAGNOSES = 5
+RECORD_PRESCRIPTION_ACTIVE_DAYS = 90
+
+# Lab request lifecycle, in order, and how many outstanding requests the lab queue shows at once
+LAB_REQUEST_STATUSES = ("requested", "collected", "resulted")
+LAB_QUEUE_PAGE_SIZE = 50
+
+# Synonyms for allergies and medical history, normalized to canonical terms on write
+VOCABULARY_FILE = os.getenv("VOCABULARY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            "vocabulary", "clinical_terms.json"))
+
+# Drug classes, synonyms, allergen conflicts and drug interactions for the prescription check
+INTERACTIONS_FILE = os.getenv("INTERACTIONS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "interactions", "drug_allergy.json"))
+
+# Red-flag phrases, age bands and re-consultation points for the triage score of new consultations
+TRIAGE_FILE = os.getenv("TRIAGE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                    "triage", "red_flags.json"))
+# Queue head start per score point: a score of 50 is seen as if it had waited 5 hours longer
+TRIAGE_MINUTES_PER_POINT = float(os.getenv("TRIAGE_MINUTES_PER_POINT", "6"))
+
+# Documents read and rewritten per round trip by data migrations (python -m migrations.run)
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "500"))
+
+# Query results cached across sessions until a write bumps their scope's generation: "shared"
+# keeps the counters in cache_generations for every replica, "local" in this process (one replica)
+CACHE_GENERATIONS = os.getenv("CACHE_GENERATIONS", "shared")
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "5000"))
+
+# User profiles (no password) cached per process by _id; a replica only drops its own copy
+# on a profile update, so other replicas may serve the old profile for up to USER_CACHE_SECONDS
+USER_CACHE_SECONDS = int(os.getenv("USER_CACHE_SECONDS", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# Session checkpoints: a session idle this long must log in again on its next connection
+SESSION_TTL_MINUTES = int(os.getenv("SESSION_TTL_MINUTES", "30"))
+
+# Field encryption: the master key file (base64, 256 bits) wrapping each patient's data key,
+# and how long and how many unwrapped data keys are kept in memory
+ENCRYPTION_KEY_FILE = os.getenv("ENCRYPTION_KEY_FILE", "keys/master.key")
+DATA_KEY_CACHE_SECONDS = int(os.getenv("DATA_KEY_CACHE_SECONDS", "300"))
+DATA_KEY_CACHE_SIZE = int(os.getenv("DATA_KEY_CACHE_SIZE", "10000"))
+
+# PHI access audit log: events are buffered in process and written with insert_many once
+# AUDIT_BATCH_SIZE are waiting or every AUDIT_FLUSH_SECONDS, and on shutdown
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+# Events kept while the database is unreachable; older ones are dropped beyond this
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", "10000"))
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", str(6 * 365)))
+# Size of the capped collection used instead of a time-series one on servers before MongoDB 5.0
+AUDIT_CAPPED_BYTES = int(os.getenv("AUDIT_CAPPED_BYTES", str(1024 ** 3)))
+AUDIT_PAGE_SIZE = 200
+
+# Background tasks (shared pools per server process)
+TASK_THREADS = int(os.getenv("TASK_THREADS", "4"))
+TASK_PROCESSES = int(os.getenv("TASK_PROCESSES", "2"))
+TASK_QUEUE_LIMIT = int(os.getenv("TASK_QUEUE_LIMIT", "32"))
+
+# Notifications (delivered by the worker: python -m notifications.worker)
+NOTIFICATION_TRANSPORT = os.getenv("NOTIFICATION_TRANSPORT", "debug")
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+SMTP_SENDER = os.getenv("SMTP_SENDER", "no-reply@mediconsult.com")
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "100"))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "8"))
+NOTIFICATION_BACKOFF_SECONDS = 30
+NOTIFICATION_BACKOFF_MAX_SECONDS = 3600
 
 # Specializations
 SPECIALIZATIONS = [
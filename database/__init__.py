@@ -0,0 +1,42 @@
+# database/__init__.py
+from database.connection import db, create_database
+from database.repositories import (UserRepository, ConsultationRepository, LabReportRepository,
+                                   OutboxRepository, SessionRepository, PatientRecordRepository,
+                                   LabRequestRepository, AuditLogRepository)
+from database.generations import LocalGenerations, SharedGenerations
+from encryption import FieldCipher, KeyCache, generate_master_key
+from config import USER_TYPE_DOCTOR, STORAGE_BACKEND, CACHE_GENERATIONS, USER_CACHE_SECONDS, USER_CACHE_SIZE
+
+# Repositories bound to the configured backend (MEDICONSULT_STORAGE=mongo|memory)
+# Bumped by repository writes to invalidate cached query results (utils.generational)
+generations = SharedGenerations(db) if CACHE_GENERATIONS == "shared" else LocalGenerations()
+users = UserRepository(db, generations, KeyCache(USER_CACHE_SECONDS, USER_CACHE_SIZE))
+# Clinical text is encrypted under per-patient data keys; the in-memory engine's data
+# ends with the process, so its master key is a throwaway one instead of the key file
+cipher = FieldCipher(db, master_key=generate_master_key() if STORAGE_BACKEND == "memory" else None)
+consultations = ConsultationRepository(db, cipher, generations)
+lab_reports = LabReportRepository(db)
+outbox = OutboxRepository(db)
+sessions = SessionRepository(db)
+audit_log = AuditLogRepository(db)
+patient_records = consultations.records
+lab_requests = consultations.lab_requests
+
+def ensure_indexes():
+    # patient_records is only read by _id
+    for repository in (users, consultations, lab_reports, lab_requests, outbox, sessions, audit_log):
+        repository.ensure_indexes()
+
+def reconcile_pending_counts():
+    """Reset every doctor's pending_count from the consultations it summarises"""
+    counts = consultations.pending_counts_by_doctor()
+    for doctor in users.list_by_type(USER_TYPE_DOCTOR, {"_id": 1}):
+        users.set_pending_count(doctor["_id"], counts.get(doctor["_id"], 0))
+
+def rebuild_patient_records(patient_ids=None):
+    """Recompute patient records from their consultations (all patients by default); return how many"""
+    if patient_ids is None:
+        patient_ids = consultations.collection.distinct("patient_id")
+    for patient_id in patient_ids:
+        patient_records.rebuild(patient_id, consultations.find({"patient_id": patient_id}, newest_first=False))
+    return len(patient_ids)
@@ -0,0 +1,251 @@
+# database/connection.py
+import threading
+import time
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.command_cursor import CommandCursor
+from pymongo.cursor import Cursor
+from pymongo.errors import ConnectionFailure, PyMongoError
+from pymongo.monitoring import ConnectionPoolListener, ServerHeartbeatListener
+from config import (MONGODB_URI, DATABASE_NAME, STORAGE_BACKEND, MONGODB_MIN_POOL_SIZE,
+                    MONGODB_SERVER_SELECTION_TIMEOUT_MS, MONGODB_CONNECT_TIMEOUT_MS, MONGODB_SOCKET_TIMEOUT_MS,
+                    DB_BREAKER_FAILURES, DB_BREAKER_RESET_SECONDS)
+from database.memory import MemoryDatabase
+
+class PoolMonitor(ConnectionPoolListener):
+    """Connection pool state from pymongo's CMAP events, for the readiness check"""
+
+    def __init__(self):
+        self.ready = {}
+        self.checked_out = 0
+        self.check_out_failures = 0
+        self._lock = threading.Lock()
+
+    def pool_created(self, event):
+        self.ready[event.address] = False
+
+    def pool_ready(self, event):
+        self.ready[event.address] = True
+
+    def pool_cleared(self, event):
+        # The server went away or errored; the pool refills once it is reachable again
+        self.ready[event.address] = False
+
+    def pool_closed(self, event):
+        self.ready.pop(event.address, None)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.check_out_failures += 1
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def available(self, max_pool_size):
+        """True when some server's pool is ready and not every connection is checked out"""
+        return any(self.ready.values()) and self.checked_out < max_pool_size
+
+pool_monitor = PoolMonitor()
+
+# =============================================
+# CIRCUIT BREAKER
+# =============================================
+
+class DatabaseUnavailable(ConnectionFailure):
+    """Raised without a round trip while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Stop calling Mongo after repeated connection failures, so a restart does not pile up script threads.
+    
+    Closed: calls go through. After threshold consecutive ConnectionFailures it
+    opens and calls raise DatabaseUnavailable at once. Once reset_seconds have
+    passed, or a server heartbeat succeeds, it is half open: a single trial call
+    goes through while the others still fail fast; its success closes the
+    breaker and its failure reopens it. A trial that never reports back (a
+    lazy call, an unrelated exception) is released, or expires after
+    reset_seconds.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold=DB_BREAKER_FAILURES, reset_seconds=DB_BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        opened_at = self.opened_at
+        if opened_at is None:
+            return self.CLOSED
+        if self.clock() - opened_at >= self.reset_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def check(self):
+        """Raise DatabaseUnavailable unless a call may go through; return True if it is the half-open trial"""
+        if self.opened_at is None:
+            return False
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return False
+            if state == self.OPEN:
+                raise DatabaseUnavailable("Database unavailable (circuit breaker open)")
+            now = self.clock()
+            if self.trial_started is not None and now - self.trial_started < self.reset_seconds:
+                raise DatabaseUnavailable("Database unavailable (circuit breaker trial call in progress)")
+            self.trial_started = now
+            return True
+
+    def end_trial(self):
+        """The trial call made no round trip, so it proves nothing: let the next call try"""
+        with self._lock:
+            self.trial_started = None
+
+    def record_success(self):
+        if self.failures or self.opened_at is not None:
+            with self._lock:
+                self.failures = 0
+                self.opened_at = None
+                self.trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_started = None
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+
+    def server_available(self):
+        """A heartbeat reached the server: let calls probe now instead of waiting out reset_seconds"""
+        with self._lock:
+            if self.opened_at is not None:
+                self.opened_at = min(self.opened_at, self.clock() - self.reset_seconds)
+
+class BreakerHeartbeatListener(ServerHeartbeatListener):
+    """Feeds pymongo's background server monitoring to the breaker, so it recovers as soon as Mongo is back"""
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.breaker.server_available()
+
+    def failed(self, event):
+        pass
+
+breaker = CircuitBreaker()
+
+class _Guarded:
+    """Runs the methods of the wrapped pymongo object through the breaker"""
+
+    def __init__(self, target, breaker):
+        self._target = target
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if isinstance(attribute, Collection):
+            # db.users; a Collection is callable only to raise a helpful TypeError
+            return GuardedCollection(attribute, self._breaker)
+        if not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: self._call(attribute, *args, **kwargs)
+
+    def _call(self, fn, *args, **kwargs):
+        trial = self._breaker.check()
+        try:
+            result = fn(*args, **kwargs)
+        except ConnectionFailure:
+            self._breaker.record_failure()
+            raise
+        except (PyMongoError, StopIteration):
+            # The server answered: with an error (a duplicate key...) or the end of a cursor
+            self._breaker.record_success()
+            raise
+        except BaseException:
+            if trial:
+                self._breaker.end_trial()
+            raise
+        # find(), sort(), get_collection() and the like are built without a round trip;
+        # only fetching from them tells whether the server is reachable
+        if isinstance(result, (Collection, Cursor)) and trial:
+            self._breaker.end_trial()
+        if isinstance(result, Collection):
+            return GuardedCollection(result, self._breaker)
+        if isinstance(result, Cursor):
+            return GuardedCursor(result, self._breaker)
+        self._breaker.record_success()
+        if isinstance(result, CommandCursor):
+            return GuardedCursor(result, self._breaker)
+        return result
+
+class GuardedCollection(_Guarded):
+    pass
+
+class GuardedCursor(_Guarded):
+    """Cursors fetch lazily, so each step of iteration goes through the breaker too"""
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._call(next, self._target)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._target.close()
+
+class GuardedDatabase(_Guarded):
+    """A pymongo Database whose calls, and those of its collections and cursors, go through a CircuitBreaker"""
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+def create_database(backend=STORAGE_BACKEND, name=DATABASE_NAME, uri=MONGODB_URI):
+    """Return a Database handle for the given storage backend"""
+    if backend == "memory":
+        return MemoryDatabase(name)
+    if backend == "mongo":
+        client = MongoClient(
+            uri,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+            # Retried once on another connection after a primary step-down or network blip
+            retryWrites=True,
+            retryReads=True,
+            event_listeners=[pool_monitor, BreakerHeartbeatListener(breaker)]
+        )
+        return GuardedDatabase(client[name], breaker)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+db = create_database()
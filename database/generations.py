@@ -0,0 +1,56 @@
+# database/generations.py
+import threading
+from config import CACHE_GENERATIONS_COLLECTION
+
+# A scope names a set of cached query results; writes that change any of them bump its
+# generation, and cached results are keyed by the generation they were read at
+
+def doctor_scope(doctor_id):
+    """Consultations of one doctor: the pending queue, its count, the overview and patient history"""
+    return f"doctor:{doctor_id}"
+
+def patient_scope(patient_id):
+    """Consultations of one patient: their history and follow-up choices"""
+    return f"patient:{patient_id}"
+
+# Doctors listed in the directory
+DIRECTORY_SCOPE = "directory"
+
+# Part of every generation; bumped after writes that bypass the repositories (migrations)
+ALL_SCOPES = "*"
+
+class LocalGenerations:
+    """Generation counters held in this process; only correct when a single replica serves writes"""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, scope):
+        with self._lock:
+            return (self._counters.get(ALL_SCOPES, 0), self._counters.get(scope, 0))
+
+    def bump(self, *scopes):
+        with self._lock:
+            for scope in scopes:
+                self._counters[scope] = self._counters.get(scope, 0) + 1
+
+    def bump_all(self):
+        self.bump(ALL_SCOPES)
+
+class SharedGenerations(LocalGenerations):
+    """Generation counters in the cache_generations collection, so a write on one replica
+    invalidates the caches of all of them. Reading a generation is one _id lookup.
+    """
+
+    def __init__(self, db):
+        self.collection = db.get_collection(CACHE_GENERATIONS_COLLECTION)
+
+    def get(self, scope):
+        counters = {document["_id"]: document["generation"]
+                    for document in self.collection.find({"_id": {"$in": [ALL_SCOPES, scope]}})}
+        return (counters.get(ALL_SCOPES, 0), counters.get(scope, 0))
+
+    def bump(self, *scopes):
+        for scope in scopes:
+            self.collection.update_one({"_id": scope}, {"$inc": {"generation": 1}}, upsert=True)
@@ -0,0 +1,731 @@
+# database/memory.py
+"""
+In-process storage engine with the subset of the pymongo collection API the
+repositories use. Documents live in dicts keyed by _id and every create_index
+call builds a hash index on the leading field, so equality lookups on indexed
+fields never scan the collection. Intended for unit tests and benchmarks.
+"""
+import copy
+import re
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument, InsertOne, UpdateMany, DeleteOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, CollectionInvalid, OperationFailure, BulkWriteError
+from pymongo.results import (InsertOneResult, InsertManyResult, UpdateResult,
+                             DeleteResult, BulkWriteResult)
+
+_MISSING = object()
+
+# Shared between copies: deepcopy would rebuild bytes subclasses such as bson Binary through __reduce__
+_IMMUTABLE = (str, bytes, int, float, type(None), datetime, ObjectId)
+
+def _copy(value):
+    """Deep copy of a document or value; like deepcopy, but immutable leaves are not copied"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    if isinstance(value, _IMMUTABLE):
+        return value
+    return copy.deepcopy(value)
+
+# =============================================
+# QUERY MATCHING
+# =============================================
+
+def _resolve(doc, path):
+    """Return every value reachable at a dotted path, descending into arrays"""
+    values = [doc]
+    for part in path.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    next_values.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    next_values.append(value[int(part)])
+                else:
+                    next_values.extend(item[part] for item in value
+                                       if isinstance(item, dict) and part in item)
+        values = next_values
+    return values
+
+def _candidates(values):
+    """Values to compare against, with array elements expanded (multikey semantics)"""
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+def _comparable(a, b):
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool)
+    numeric = (int, float)
+    if isinstance(a, numeric) and isinstance(b, numeric):
+        return True
+    return type(a) is type(b)
+
+def _compare(values, op, arg):
+    for value in _candidates(values):
+        if not _comparable(value, arg):
+            continue
+        if op == "$gt" and value > arg:
+            return True
+        if op == "$gte" and value >= arg:
+            return True
+        if op == "$lt" and value < arg:
+            return True
+        if op == "$lte" and value <= arg:
+            return True
+    return False
+
+def _equals(values, expected):
+    if not values:
+        return expected is None
+    return any(value == expected for value in _candidates(values))
+
+def _match_condition(values, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+        for op, arg in condition.items():
+            if op == "$eq":
+                matched = _equals(values, arg)
+            elif op == "$ne":
+                matched = not _equals(values, arg)
+            elif op == "$in":
+                matched = any(_equals(values, item) for item in arg)
+            elif op == "$nin":
+                matched = not any(_equals(values, item) for item in arg)
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                matched = _compare(values, op, arg)
+            elif op == "$exists":
+                matched = bool(values) == bool(arg)
+            elif op == "$all":
+                matched = all(_equals(values, item) for item in arg)
+            elif op == "$size":
+                matched = any(isinstance(value, list) and len(value) == arg for value in values)
+            elif op == "$regex":
+                pattern = re.compile(arg, re.IGNORECASE if 'i' in condition.get("$options", "") else 0)
+                matched = any(isinstance(value, str) and pattern.search(value)
+                              for value in _candidates(values))
+            elif op == "$options":
+                matched = True
+            elif op == "$elemMatch":
+                matched = any(isinstance(item, dict) and match_query(item, arg)
+                              for value in values if isinstance(value, list) for item in value)
+            elif op == "$not":
+                matched = not _match_condition(values, arg)
+            else:
+                raise NotImplementedError(f"Query operator {op} is not supported in memory")
+            if not matched:
+                return False
+        return True
+    return _equals(values, condition)
+
+def match_query(doc, query):
+    """Evaluate a MongoDB-style filter against a document"""
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(match_query(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(match_query(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(match_query(doc, sub) for sub in condition):
+                return False
+        elif not _match_condition(_resolve(doc, key), condition):
+            return False
+    return True
+
+# =============================================
+# UPDATES AND PROJECTIONS
+# =============================================
+
+def _parent(doc, path, create=True):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if part not in doc or not isinstance(doc[part], dict):
+            if not create:
+                return None, parts[-1]
+            doc[part] = {}
+        doc = doc[part]
+    return doc, parts[-1]
+
+def _each(arg):
+    if isinstance(arg, dict) and "$each" in arg:
+        return list(arg["$each"])
+    return [arg]
+
+def apply_update(doc, update, inserting=False):
+    """Apply update operators in place; return True if the document changed"""
+    before = _copy(doc)
+    if not any(key.startswith('$') for key in update):
+        replacement = dict(update)
+        replacement["_id"] = doc["_id"]
+        doc.clear()
+        doc.update(replacement)
+        return doc != before
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, arg in fields.items():
+            if op == "$unset":
+                parent, field = _parent(doc, path, create=False)
+                if parent is not None:
+                    parent.pop(field, None)
+                continue
+            parent, field = _parent(doc, path)
+            if op in ("$set", "$setOnInsert"):
+                parent[field] = _copy(arg)
+            elif op == "$inc":
+                parent[field] = parent.get(field, 0) + arg
+            elif op == "$min":
+                if field not in parent or arg < parent[field]:
+                    parent[field] = arg
+            elif op == "$max":
+                if field not in parent or arg > parent[field]:
+                    parent[field] = arg
+            elif op == "$push":
+                items = parent.setdefault(field, [])
+                items.extend(_copy(_each(arg)))
+                if isinstance(arg, dict) and "$slice" in arg:
+                    limit = arg["$slice"]
+                    parent[field] = items[limit:] if limit < 0 else items[:limit]
+            elif op == "$addToSet":
+                items = parent.setdefault(field, [])
+                for item in _each(arg):
+                    if item not in items:
+                        items.append(_copy(item))
+            elif op == "$pull":
+                if isinstance(parent.get(field), list):
+                    if isinstance(arg, dict):
+                        parent[field] = [item for item in parent[field]
+                                         if not (isinstance(item, dict) and match_query(item, arg))]
+                    else:
+                        parent[field] = [item for item in parent[field] if item != arg]
+            elif op == "$currentDate":
+                parent[field] = datetime.utcnow()
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported in memory")
+    return doc != before
+
+def apply_projection(doc, projection):
+    if not projection:
+        return _copy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    # {"_id": 1} alone is an inclusion projection too
+    if all(fields.values()) and (fields or include_id):
+        result = {}
+        for path in fields:
+            values = _resolve(doc, path)
+            if values:
+                parent, field = _parent(result, path)
+                parent[field] = _copy(values[0])
+    else:
+        result = _copy(doc)
+        for path in fields:
+            parent, field = _parent(result, path, create=False)
+            if parent is not None:
+                parent.pop(field, None)
+    if include_id and "_id" in doc:
+        result["_id"] = doc["_id"]
+    else:
+        result.pop("_id", None)
+    return result
+
+_TYPE_ORDER = {type(None): 0, int: 1, float: 1, str: 2, dict: 3, list: 4, ObjectId: 5,
+               bool: 6, datetime: 7}
+
+def _sort_key(value):
+    value = value[0] if value else None
+    if isinstance(value, list):
+        value = min(value, key=_sort_key_scalar) if value else None
+    return _sort_key_scalar(value)
+
+def _sort_key_scalar(value):
+    rank = _TYPE_ORDER.get(type(value), 8)
+    if isinstance(value, (dict, list)) or rank == 8:
+        return (rank, str(value))
+    return (rank, value if value is not None else 0)
+
+def _normalize_keys(keys, direction=None):
+    if isinstance(keys, str):
+        return [(keys, direction if direction is not None else ASCENDING)]
+    return [(key, value) for key, value in keys]
+
+# =============================================
+# INDEXES
+# =============================================
+
+class _Index:
+    def __init__(self, name, keys, unique=False, sparse=False, partial_filter=None,
+                 expire_after_seconds=None):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self.unique = unique
+        self.sparse = sparse
+        self.partial_filter = partial_filter
+        self.expire_after_seconds = expire_after_seconds
+        self.by_leading = {}
+        self.by_key = {}
+
+    def _covers(self, doc):
+        if self.partial_filter and not match_query(doc, self.partial_filter):
+            return False
+        if self.sparse and not any(_resolve(doc, field) for field in self.fields):
+            return False
+        return True
+
+    def _covers_equality(self, condition):
+        """Sparse/partial indexes only answer equality on a non-null value of a field they require"""
+        if isinstance(condition, dict) or condition is None:
+            return False
+        if self.partial_filter:
+            return self.partial_filter == {self.fields[0]: {"$exists": True}}
+        return True
+
+    def _leading_values(self, doc):
+        values = _resolve(doc, self.fields[0])
+        if not values:
+            return [None]
+        expanded = []
+        for value in values:
+            expanded.extend(value if isinstance(value, list) and value else [value])
+        return [_hashable(value) for value in expanded]
+
+    def _unique_key(self, doc):
+        return tuple(_hashable(_resolve(doc, field)[0] if _resolve(doc, field) else None)
+                     for field in self.fields)
+
+    def check(self, doc, ignore_id=None):
+        if not self.unique or not self._covers(doc):
+            return
+        owner = self.by_key.get(self._unique_key(doc))
+        if owner is not None and owner != ignore_id:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error index: {self.name} dup key: {self._unique_key(doc)}", 11000
+            )
+
+    def add(self, doc):
+        if not self._covers(doc):
+            return
+        for value in self._leading_values(doc):
+            self.by_leading.setdefault(value, set()).add(doc["_id"])
+        if self.unique:
+            self.by_key[self._unique_key(doc)] = doc["_id"]
+
+    def remove(self, doc):
+        for value in self._leading_values(doc):
+            ids = self.by_leading.get(value)
+            if ids:
+                ids.discard(doc["_id"])
+                if not ids:
+                    del self.by_leading[value]
+        if self.unique and self.by_key.get(self._unique_key(doc)) == doc["_id"]:
+            del self.by_key[self._unique_key(doc)]
+
+    def lookup(self, query):
+        """Candidate ids for a query constraining the leading field, or None"""
+        condition = query.get(self.fields[0], _MISSING)
+        if condition is _MISSING:
+            return None
+        if condition == {"$exists": True} and len(self.fields) == 1 and (
+                self.sparse or self.partial_filter == {self.fields[0]: {"$exists": True}}):
+            # Every document a sparse/partial index covers has the field
+            return set().union(*self.by_leading.values())
+        if (self.partial_filter or self.sparse) and not self._covers_equality(condition):
+            return None
+        if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+            if set(condition) == {"$in"}:
+                ids = set()
+                for value in condition["$in"]:
+                    ids |= self.by_leading.get(_hashable(value), set())
+                return ids
+            if set(condition) == {"$eq"}:
+                condition = condition["$eq"]
+            else:
+                return None
+        if isinstance(condition, (dict, list)):
+            return None
+        return self.by_leading.get(_hashable(condition), set())
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+# =============================================
+# COLLECTION, CURSOR AND DATABASE
+# =============================================
+
+class MemoryCursor:
+    def __init__(self, documents, projection=None):
+        self._documents = documents
+        self._projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_keys(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _results(self):
+        documents = self._documents
+        if self._sort:
+            for field, direction in reversed(self._sort):
+                documents = sorted(documents, key=lambda doc: _sort_key(_resolve(doc, field)),
+                                   reverse=direction < 0)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [apply_projection(doc, self._projection) for doc in documents]
+
+    def __iter__(self):
+        return iter(self._results())
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._documents = {}
+        self._indexes = {"_id_": _Index("_id_", [("_id", ASCENDING)], unique=True)}
+        self._lock = threading.RLock()
+        self._options = {}
+
+    def options(self):
+        return dict(self._options)
+
+    # ----- indexes -----
+    def create_index(self, keys, unique=False, name=None, sparse=False,
+                     partialFilterExpression=None, expireAfterSeconds=None, **kwargs):
+        keys = _normalize_keys(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        with self._lock:
+            if name in self._indexes:
+                return name
+            index = _Index(name, keys, unique=unique, sparse=sparse,
+                           partial_filter=partialFilterExpression,
+                           expire_after_seconds=expireAfterSeconds)
+            for doc in self._documents.values():
+                index.check(doc, ignore_id=doc["_id"])
+                index.add(doc)
+            self._indexes[name] = index
+        return name
+
+    def index_information(self):
+        return {
+            name: {"key": index.keys, "unique": index.unique}
+            for name, index in self._indexes.items()
+        }
+
+    def drop_index(self, name):
+        with self._lock:
+            if name == "_id_" or name not in self._indexes:
+                raise OperationFailure(f"index not found with name [{name}]")
+            del self._indexes[name]
+
+    def drop_indexes(self):
+        with self._lock:
+            self._indexes = {"_id_": self._indexes["_id_"]}
+
+    # ----- reads -----
+    def _lookup(self, query):
+        """Candidate ids from the most selective index answering query, or None"""
+        candidates = None
+        for index in self._indexes.values():
+            ids = index.lookup(query)
+            if ids is not None and (candidates is None or len(ids) < len(candidates)):
+                candidates = ids
+        return candidates
+
+    def _scan(self, query):
+        """Documents matching query, narrowed through the most selective index"""
+        self._expire()
+        query = query or {}
+        candidates = self._lookup(query)
+        if candidates is None and "$or" in query:
+            # Like MongoDB's OR plan: a union of index lookups when every clause has one
+            clauses = [self._lookup(clause) for clause in query["$or"]]
+            if all(ids is not None for ids in clauses):
+                candidates = set().union(*clauses)
+        if candidates is None:
+            documents = list(self._documents.values())
+        else:
+            documents = [self._documents[doc_id] for doc_id in candidates if doc_id in self._documents]
+            # Preserve insertion order like a collection scan would
+            documents.sort(key=lambda doc: self._order[doc["_id"]])
+        return [doc for doc in documents if match_query(doc, query)]
+
+    @property
+    def _order(self):
+        return self.database._insertion_order
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0):
+        with self._lock:
+            cursor = MemoryCursor(self._scan(filter), projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, sort=None):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for doc in self.find(filter, projection, sort=sort).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, filter, limit=0):
+        with self._lock:
+            count = len(self._scan(filter))
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self):
+        return len(self._documents)
+
+    def distinct(self, key, filter=None):
+        values = []
+        with self._lock:
+            for doc in self._scan(filter):
+                for value in _candidates(_resolve(doc, key)):
+                    if not isinstance(value, list) and value not in values:
+                        values.append(value)
+        return values
+
+    # ----- writes -----
+    def _add(self, doc):
+        for index in self._indexes.values():
+            index.check(doc)
+        for index in self._indexes.values():
+            index.add(doc)
+        self._documents[doc["_id"]] = doc
+        self.database._insertion_order[doc["_id"]] = next(self.database._sequence)
+
+    def insert_one(self, document):
+        with self._lock:
+            document.setdefault("_id", ObjectId())
+            self._add(_copy(document))
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents, ordered=True):
+        inserted_ids = []
+        with self._lock:
+            for document in documents:
+                document.setdefault("_id", ObjectId())
+                self._add(_copy(document))
+                inserted_ids.append(document["_id"])
+        return InsertManyResult(inserted_ids, True)
+
+    def _replace_indexed(self, old, new):
+        for index in self._indexes.values():
+            index.check(new, ignore_id=old["_id"])
+        for index in self._indexes.values():
+            index.remove(old)
+            index.add(new)
+        self._documents[new["_id"]] = new
+
+    def _update(self, filter, update, upsert, multi, sort=None):
+        matched = self._scan(filter)
+        if sort:
+            matched = list(MemoryCursor(matched).sort(sort)._results())
+            matched = [self._documents[doc["_id"]] for doc in matched]
+        if not multi:
+            matched = matched[:1]
+        modified = 0
+        for doc in matched:
+            updated = _copy(doc)
+            if apply_update(updated, update):
+                self._replace_indexed(doc, updated)
+                modified += 1
+        raw_result = {"n": len(matched), "nModified": modified}
+        if not matched and upsert:
+            doc = {key: value for key, value in (filter or {}).items()
+                   if not key.startswith('$') and not isinstance(value, dict)}
+            doc.setdefault("_id", ObjectId())
+            apply_update(doc, update, inserting=True)
+            self._add(doc)
+            raw_result = {"n": 1, "nModified": 0, "upserted": doc["_id"]}
+        return raw_result
+
+    def update_one(self, filter, update, upsert=False):
+        with self._lock:
+            return UpdateResult(self._update(filter, update, upsert, multi=False), True)
+
+    def update_many(self, filter, update, upsert=False):
+        with self._lock:
+            return UpdateResult(self._update(filter, update, upsert, multi=True), True)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        with self._lock:
+            return UpdateResult(self._update(filter, replacement, upsert, multi=False), True)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE):
+        with self._lock:
+            existing = self._scan(filter)
+            if sort:
+                existing = [self._documents[doc["_id"]]
+                            for doc in MemoryCursor(existing).sort(sort)._results()]
+            before = _copy(existing[0]) if existing else None
+            raw_result = self._update({"_id": before["_id"]} if before else filter,
+                                      update, upsert, multi=False)
+            if return_document == ReturnDocument.AFTER:
+                doc_id = before["_id"] if before else raw_result.get("upserted")
+                after = self._documents.get(doc_id)
+                return apply_projection(after, projection) if after else None
+        return apply_projection(before, projection) if before else None
+
+    def _delete(self, filter, multi):
+        matched = self._scan(filter)
+        if not multi:
+            matched = matched[:1]
+        for doc in matched:
+            for index in self._indexes.values():
+                index.remove(doc)
+            del self._documents[doc["_id"]]
+            self._order.pop(doc["_id"], None)
+        return {"n": len(matched)}
+
+    def delete_one(self, filter):
+        with self._lock:
+            return DeleteResult(self._delete(filter, multi=False), True)
+
+    def find_one_and_delete(self, filter, projection=None, sort=None):
+        with self._lock:
+            existing = self._scan(filter)
+            if sort:
+                existing = [self._documents[doc["_id"]]
+                            for doc in MemoryCursor(existing).sort(sort)._results()]
+            if not existing:
+                return None
+            before = _copy(existing[0])
+            self._delete({"_id": before["_id"]}, multi=False)
+        return apply_projection(before, projection)
+
+    def delete_many(self, filter):
+        with self._lock:
+            return DeleteResult(self._delete(filter, multi=True), True)
+
+    def bulk_write(self, requests, ordered=True):
+        """Apply pymongo InsertOne/UpdateOne/UpdateMany/ReplaceOne/DeleteOne/DeleteMany requests.
+        
+        Failed requests are reported by index in a BulkWriteError, as by the server;
+        ordered stops at the first failure, unordered carries on with the rest.
+        """
+        raw_result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0,
+                      "upserted": [], "writeErrors": [], "writeConcernErrors": []}
+        with self._lock:
+            for index, request in enumerate(requests):
+                try:
+                    if isinstance(request, InsertOne):
+                        request._doc.setdefault("_id", ObjectId())
+                        self._add(_copy(request._doc))
+                        raw_result["nInserted"] += 1
+                    elif isinstance(request, (DeleteOne, DeleteMany)):
+                        raw_result["nRemoved"] += self._delete(request._filter, isinstance(request, DeleteMany))["n"]
+                    else:
+                        result = self._update(request._filter, request._doc, request._upsert,
+                                              multi=isinstance(request, UpdateMany))
+                        if "upserted" in result:
+                            raw_result["nUpserted"] += 1
+                            raw_result["upserted"].append({"index": index, "_id": result["upserted"]})
+                        else:
+                            raw_result["nMatched"] += result["n"]
+                            raw_result["nModified"] += result["nModified"]
+                except OperationFailure as error:
+                    raw_result["writeErrors"].append({"index": index, "code": error.code, "errmsg": str(error),
+                                                      "op": request})
+                    if ordered:
+                        break
+        if raw_result["writeErrors"]:
+            raise BulkWriteError(raw_result)
+        return BulkWriteResult(raw_result, True)
+
+    def drop(self):
+        with self._lock:
+            self._documents.clear()
+            self.drop_indexes()
+            for index in self._indexes.values():
+                index.by_leading.clear()
+                index.by_key.clear()
+
+    def _expire(self):
+        """Drop documents past a TTL index, as mongod's TTL monitor would"""
+        now = datetime.utcnow()
+        for index in list(self._indexes.values()):
+            if index.expire_after_seconds is None:
+                continue
+            expired = [doc for doc in self._documents.values()
+                       if isinstance(doc.get(index.fields[0]), datetime)
+                       and (now - doc[index.fields[0]]).total_seconds() > index.expire_after_seconds]
+            for doc in expired:
+                for other in self._indexes.values():
+                    other.remove(doc)
+                del self._documents[doc["_id"]]
+
+class MemoryDatabase:
+    """Drop-in stand-in for a pymongo Database backed by process memory"""
+
+    def __init__(self, name="mediconsult"):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._insertion_order = {}
+        self._sequence = iter(range(1, 1 << 62))
+
+    def get_collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def create_collection(self, name, **options):
+        """Create a collection with options (time series, capped); they are recorded, not enforced"""
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None and (collection._options or collection._documents):
+                raise CollectionInvalid(f"collection {name} already exists")
+            if collection is None:
+                collection = self._collections[name] = MemoryCollection(self, name)
+            collection._options = options
+            return collection
+
+    def list_collection_names(self):
+        return [name for name, collection in self._collections.items()
+                if collection._documents or collection._options]
+
+    def drop_collection(self, name):
+        with self._lock:
+            self._collections.pop(name, None)
+
+    def command(self, name, *args, **kwargs):
+        if name == "ping":
+            return {"ok": 1.0}
+        raise NotImplementedError(f"Command {name} is not supported in memory")
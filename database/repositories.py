@@ -0,0 +1,869 @@
+# database/repositories.py
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, CollectionInvalid, OperationFailure, BulkWriteError
+from config import (USERS_COLLECTION, CONSULTATIONS_COLLECTION, LAB_REPORTS_COLLECTION, LAB_REQUESTS_COLLECTION,
+                    LAB_REQUEST_STATUSES, OUTBOX_COLLECTION, AUDIT_LOG_COLLECTION, AUDIT_RETENTION_DAYS,
+                    AUDIT_CAPPED_BYTES, AUDIT_PAGE_SIZE, SESSIONS_COLLECTION, PATIENT_RECORDS_COLLECTION, USER_TYPE_DOCTOR,
+                    RECORD_RECENT_DIAGNOSES, RECORD_PRESCRIPTION_ACTIVE_DAYS)
+from vocabulary import CLINICAL_TERM_FIELDS, normalize_terms, normalize_clinical_fields
+from encryption import ENCRYPTED_FIELDS
+from triage import triage_score, triage_due_at
+from database.generations import DIRECTORY_SCOPE, doctor_scope, patient_scope
+
+# Consultation fields whose change the patient is notified about
+PATIENT_VISIBLE_FIELDS = ("status", "diagnosis", "prescription", "lab_requests", "consultation_notes")
+
+# Read back by ConsultationRepository.update() to maintain pending counts and patient records
+RECORD_FIELDS = ("status", "doctor_id", "patient_id", "doctor_name", "diagnosis", "prescription")
+
+# What get_profile() returns and caches: never the password hash, nor the assignment
+# bookkeeping that changes with every booking
+PROFILE_PROJECTION = {"password": 0, "pending_count": 0, "last_assigned_at": 0}
+
+def returns_encrypted(projection):
+    """False when a projection leaves out every encrypted field, so its results need no decryption pass"""
+    if projection is None:
+        return True
+    fields = {field: value for field, value in projection.items() if field != "_id"}
+    if not fields:
+        # {"_id": 1} returns only _id, {"_id": 0} everything else
+        return not projection.get("_id", 0)
+    inclusive = any(fields.values())
+    return any(fields.get(field, not inclusive) for field in ENCRYPTED_FIELDS)
+
+def outbox_entry(event, recipient, **payload):
+    """Notification embedded in the consultation it is about, so it is written atomically with it.
+    
+    recipient is the role ("patient" or "doctor") resolved against the consultation by the relay.
+    """
+    return {"id": uuid.uuid4().hex, "event": event, "recipient": recipient,
+            "created_at": datetime.utcnow(), **payload}
+
+class UserRepository:
+    """Patients, doctors and admins"""
+
+    def __init__(self, db, generations=None, cache=None):
+        self.collection = db.get_collection(USERS_COLLECTION)
+        self.generations = generations
+        # Profiles by _id (an encryption.KeyCache), shared by every session of the process
+        self.cache = cache
+
+    def ensure_indexes(self):
+        self.collection.create_index("email", unique=True)
+        self.collection.create_index("user_type")
+        self.collection.create_index("specialization")
+        # Least-loaded doctor lookup for "any available <specialization>" bookings
+        self.collection.create_index([
+            ("user_type", ASCENDING),
+            ("specialization", ASCENDING),
+            ("pending_count", ASCENDING),
+            ("last_assigned_at", ASCENDING)
+        ])
+
+    def get_by_id(self, user_id, projection=None):
+        return self.collection.find_one({"_id": user_id}, projection)
+
+    def get_profile(self, user_id):
+        """The user's PROFILE_PROJECTION, from the cache when it holds it"""
+        profile = self.cache.get(user_id) if self.cache is not None else None
+        if profile is None:
+            profile = self.collection.find_one({"_id": user_id}, PROFILE_PROJECTION)
+            if profile is None:
+                return None
+            if self.cache is not None:
+                self.cache.put(user_id, profile)
+        # A copy, so a caller changing it does not change what other sessions are served
+        return dict(profile)
+
+    def get_by_email(self, email):
+        return self.collection.find_one({"email": email})
+
+    def create(self, user_data):
+        """Insert a user and return its _id; raises DuplicateKeyError for a taken email"""
+        user_id = self.collection.insert_one(user_data).inserted_id
+        self._changed(user_id, user_data.get("user_type"))
+        return user_id
+
+    def update_profile(self, user_id, fields):
+        """Set profile fields; returns False when there is no such user"""
+        user = self.collection.find_one_and_update({"_id": user_id}, {"$set": fields},
+                                                   projection={"user_type": 1})
+        if user is None:
+            return False
+        self._changed(user_id, user.get("user_type"))
+        return True
+
+    def _changed(self, user_id, user_type):
+        if self.cache is not None:
+            self.cache.discard(user_id)
+        if self.generations and user_type == USER_TYPE_DOCTOR:
+            self.generations.bump(DIRECTORY_SCOPE)
+
+    def list_by_type(self, user_type, projection=None, **filters):
+        return list(self.collection.find({"user_type": user_type, **filters}, projection))
+
+    def list_doctors(self, specialization=None, projection=None):
+        filters = {"specialization": specialization} if specialization else {}
+        return self.list_by_type(USER_TYPE_DOCTOR, projection, **filters)
+
+    def list_all(self, projection=None):
+        return list(self.collection.find({}, projection))
+
+    def count(self, user_type=None):
+        return self.collection.count_documents({"user_type": user_type} if user_type else {})
+
+    def claim_least_loaded_doctor(self, specialization):
+        """Atomically pick the available doctor with the fewest pending consultations.
+        
+        The doctor's pending_count is incremented as part of the pick, so
+        concurrent requests spread across doctors; pass pending_claimed=True
+        when creating the consultation. Ties go to the least recently assigned.
+        """
+        return self.collection.find_one_and_update(
+            {"user_type": USER_TYPE_DOCTOR, "specialization": specialization, "is_available": {"$ne": False}},
+            {"$inc": {"pending_count": 1}, "$set": {"last_assigned_at": datetime.utcnow()}},
+            sort=[("pending_count", ASCENDING), ("last_assigned_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def set_pending_count(self, doctor_id, pending_count):
+        self.collection.update_one({"_id": doctor_id}, {"$set": {"pending_count": pending_count}})
+
+class PatientRecordRepository:
+    """One summary document per patient (_id = patient_id), maintained on consultation writes.
+    
+    Holds the merged allergies and medical history, the last RECORD_RECENT_DIAGNOSES
+    diagnoses and the prescriptions of the last RECORD_PRESCRIPTION_ACTIVE_DAYS, so a
+    patient overview is one document read however many consultations there are.
+    """
+
+    def __init__(self, db, cipher=None):
+        self.collection = db.get_collection(PATIENT_RECORDS_COLLECTION)
+        # Diagnoses and prescriptions are copied here, so they are encrypted here too
+        self.cipher = cipher
+
+    def _encrypt(self, patient_id, field, value):
+        return self.cipher.encrypt(patient_id, field, value) if self.cipher else value
+
+    def record_consultation(self, consultation):
+        """Merge a new consultation's allergies and history into its patient's record"""
+        self.collection.update_one(
+            {"_id": consultation["patient_id"]},
+            {
+                "$addToSet": {field: {"$each": normalize_terms(consultation.get(field), field)}
+                              for field in CLINICAL_TERM_FIELDS},
+                "$inc": {"consultation_count": 1},
+                "$max": {"last_consultation_at": consultation.get("created_at") or datetime.utcnow()},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            upsert=True
+        )
+
+    def record_completion(self, consultation, now=None):
+        """Add (or replace) a completed consultation's diagnosis and prescription"""
+        now = now or datetime.utcnow()
+        consultation_id = consultation["_id"]
+        cutoff = now - timedelta(days=RECORD_PRESCRIPTION_ACTIVE_DAYS)
+        # Completing the same consultation again replaces its entries instead of repeating them
+        self.collection.update_one(
+            {"_id": consultation["patient_id"]},
+            {"$pull": {
+                "diagnoses": {"consultation_id": consultation_id},
+                "prescriptions": {"$or": [{"consultation_id": consultation_id},
+                                          {"prescribed_at": {"$lt": cutoff}}]}
+            }}
+        )
+        entry = {"consultation_id": consultation_id, "doctor_name": consultation.get("doctor_name")}
+        push = {}
+        if consultation.get("diagnosis"):
+            diagnosis = self._encrypt(consultation["patient_id"], "diagnosis", consultation["diagnosis"])
+            push["diagnoses"] = {"$each": [{**entry, "diagnosis": diagnosis, "diagnosed_at": now}],
+                                 "$slice": -RECORD_RECENT_DIAGNOSES}
+        if consultation.get("prescription"):
+            prescription = self._encrypt(consultation["patient_id"], "prescription", consultation["prescription"])
+            push["prescriptions"] = {"$each": [{**entry, "prescription": prescription, "prescribed_at": now}]}
+        update = {"$set": {"updated_at": now}}
+        if push:
+            update["$push"] = push
+        self.collection.update_one({"_id": consultation["patient_id"]}, update, upsert=True)
+
+    def get(self, patient_id, now=None):
+        """The patient's record, with prescriptions older than the active window left out"""
+        record = self.collection.find_one({"_id": patient_id})
+        if record:
+            cutoff = (now or datetime.utcnow()) - timedelta(days=RECORD_PRESCRIPTION_ACTIVE_DAYS)
+            record["prescriptions"] = [prescription for prescription in record.get("prescriptions", [])
+                                       if prescription["prescribed_at"] >= cutoff]
+            if self.cipher:
+                for entry in record.get("diagnoses", []):
+                    self.cipher.decrypt_fields(entry, ("diagnosis",))
+                for entry in record["prescriptions"]:
+                    self.cipher.decrypt_fields(entry, ("prescription",))
+        return record
+
+    def rebuild(self, patient_id, consultations):
+        """Replace a record with one computed from all of the patient's consultations (oldest first)"""
+        self.collection.delete_one({"_id": patient_id})
+        for consultation in consultations:
+            self.record_consultation(consultation)
+            if consultation.get("status") == "completed":
+                self.record_completion(consultation, now=consultation.get("updated_at") or consultation.get("created_at"))
+
+    def count(self):
+        return self.collection.count_documents({})
+
+class ConsultationRepository:
+    """Consultation requests and the doctor's responses.
+    
+    With a cipher (encryption.FieldCipher), ENCRYPTED_FIELDS are stored
+    encrypted under the patient's data key and decrypted on read, only where a
+    query's projection returned them.
+    """
+
+    def __init__(self, db, cipher=None, generations=None):
+        self.collection = db.get_collection(CONSULTATIONS_COLLECTION)
+        self.users = db.get_collection(USERS_COLLECTION)
+        self.cipher = cipher
+        self.generations = generations
+        self.records = PatientRecordRepository(db, cipher)
+        self.lab_requests = LabRequestRepository(db)
+
+    def ensure_indexes(self):
+        # The doctor's queue in priority order (pending_queue); its prefix serves the per-status lists
+        self.collection.create_index([("doctor_id", ASCENDING), ("status", ASCENDING), ("triage_due_at", ASCENDING)])
+        self.collection.create_index([("patient_id", ASCENDING), ("created_at", DESCENDING)])
+        self.collection.create_index(
+            "idempotency_key",
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$exists": True}}
+        )
+        # One consultation per doctor per appointment slot
+        self.collection.create_index(
+            [("doctor_id", ASCENDING), ("appointment_start", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"appointment_start": {"$exists": True}}
+        )
+        self.collection.create_index("appointment_start", sparse=True)
+        # Consultations with notifications not yet relayed to the outbox collection
+        self.collection.create_index("outbox.id", sparse=True)
+        # Follow-up threads: only follow-ups carry the thread fields
+        self.collection.create_index(
+            [("thread_root_id", ASCENDING), ("created_at", ASCENDING)],
+            partialFilterExpression={"thread_root_id": {"$exists": True}}
+        )
+        self.collection.create_index("parent_consultation_id", sparse=True)
+        # Multikey: "my patients allergic to penicillin" without a scan
+        for field in CLINICAL_TERM_FIELDS:
+            self.collection.create_index([("doctor_id", ASCENDING), (field, ASCENDING)])
+        if self.cipher:
+            self.cipher.ensure_indexes()
+
+    def encrypt_fields(self, patient_id, fields):
+        """fields as stored: clinical text encrypted under the patient's data key"""
+        return self.cipher.encrypt_fields(patient_id, fields) if self.cipher else fields
+
+    def decrypt_fields(self, document):
+        """document (as read from the collection) with its projected clinical text decrypted, in place"""
+        return self.cipher.decrypt_fields(document) if self.cipher else document
+
+    def _changed(self, consultation):
+        """Invalidate cached views of the consultation's doctor and patient"""
+        if self.generations:
+            scopes = [scope(consultation[field]) for field, scope in (("doctor_id", doctor_scope),
+                                                                      ("patient_id", patient_scope))
+                      if consultation.get(field) is not None]
+            self.generations.bump(*scopes)
+
+    def _adjust_pending(self, doctor_id, delta):
+        """Keep the doctor's pending_count in step with their pending consultations"""
+        if doctor_id is not None:
+            self.users.update_one({"_id": doctor_id}, {"$inc": {"pending_count": delta}})
+
+    def with_triage(self, consultation):
+        """consultation with its triage_score and triage_due_at, scored from its plaintext symptoms.
+        
+        The age is the one given on the consultation form (patient_age), else the patient's profile age.
+        Both are stored in the clear (the symptoms are encrypted) so the queue can be indexed on them.
+        """
+        age = consultation.get("patient_age")
+        if age is None and consultation.get("patient_id") is not None:
+            age = (self.users.find_one({"_id": consultation["patient_id"]}, {"age": 1}) or {}).get("age")
+        score = triage_score(consultation.get("symptoms"), age,
+                             re_consultation=consultation.get("parent_consultation_id") is not None)
+        created_at = consultation.get("created_at") or datetime.utcnow()
+        return {**consultation, "created_at": created_at, "triage_score": score,
+                "triage_due_at": triage_due_at(created_at, score)}
+
+    def create(self, consultation_data, pending_claimed=False):
+        """Insert a consultation; pending_claimed means the doctor's counter was already bumped"""
+        consultation_data = normalize_clinical_fields(consultation_data)
+        if "triage_score" not in consultation_data:
+            consultation_data = self.with_triage(consultation_data)
+        if consultation_data.get("doctor_id") is not None:
+            consultation_data = {
+                **consultation_data,
+                "outbox": [outbox_entry("consultation_requested", "doctor")]
+            }
+        try:
+            stored = self.encrypt_fields(consultation_data.get("patient_id"), consultation_data)
+            consultation_id = self.collection.insert_one(stored).inserted_id
+        except DuplicateKeyError:
+            if pending_claimed:
+                self._adjust_pending(consultation_data.get("doctor_id"), -1)
+            raise
+        if consultation_data.get("status") == "pending" and not pending_claimed:
+            self._adjust_pending(consultation_data.get("doctor_id"), 1)
+        if consultation_data.get("patient_id") is not None:
+            self.records.record_consultation(consultation_data)
+        self._changed(consultation_data)
+        return consultation_id
+
+    def create_once(self, consultation_data, idempotency_key, pending_claimed=False):
+        """Insert unless this idempotency key was already used; return (_id, created)"""
+        existing = self.collection.find_one({"idempotency_key": idempotency_key}, {"_id": 1})
+        if existing:
+            if pending_claimed:
+                self._adjust_pending(consultation_data.get("doctor_id"), -1)
+            return existing["_id"], False
+        
+        try:
+            consultation_id = self.create({**consultation_data, "idempotency_key": idempotency_key},
+                                          pending_claimed=pending_claimed)
+        except DuplicateKeyError:
+            # A concurrent submit with the same key won the insert
+            existing = self.collection.find_one({"idempotency_key": idempotency_key}, {"_id": 1})
+            if not existing:
+                # The conflict was on another unique index, e.g. an appointment slot
+                raise
+            return existing["_id"], False
+        return consultation_id, True
+
+    def get(self, consultation_id, projection=None):
+        return self.decrypt_fields(self.collection.find_one({"_id": consultation_id}, projection))
+
+    def create_follow_up(self, parent, consultation_data, idempotency_key):
+        """Insert a follow-up to parent holding only its own text; return (_id, created)"""
+        return self.create_once({
+            **consultation_data,
+            "parent_consultation_id": parent["_id"],
+            "thread_root_id": parent.get("thread_root_id") or parent["_id"]
+        }, idempotency_key)
+
+    def thread(self, root_id, projection=None):
+        """The first consultation of a thread and all its follow-ups, oldest first (one query)"""
+        return self.find({"$or": [{"_id": root_id}, {"thread_root_id": root_id}]}, projection,
+                         newest_first=False)
+
+    def update(self, consultation_id, fields):
+        """$set fields on one consultation; return True if it changed.
+        
+        A change to a field the patient sees queues a notification in the same write,
+        and completing a consultation updates the patient's record.
+        """
+        fields = normalize_clinical_fields(fields)
+        stored = fields
+        current = {}
+        encrypted = [field for field in ENCRYPTED_FIELDS if field in fields] if self.cipher else []
+        if encrypted:
+            # Each encryption gives a new ciphertext, so changes are found on the decrypted current values
+            current = self.collection.find_one({"_id": consultation_id},
+                                               {"patient_id": 1, **{field: 1 for field in encrypted}})
+            if not current:
+                return False
+            stored = self.encrypt_fields(current.get("patient_id"), fields)
+        changed = []
+        for field in PATIENT_VISIBLE_FIELDS:
+            if field not in fields:
+                continue
+            if field not in encrypted:
+                changed.append({field: {"$ne": fields[field]}})
+            elif self.cipher.decrypt(field, current.get(field)) != fields[field]:
+                # Matches while the value is still the one read above
+                changed.append({field: current.get(field)})
+        
+        # The previous values come back from the same atomic operation
+        projection = {field: 1 for field in (*fields, *RECORD_FIELDS)}
+        before = None
+        if changed:
+            before = self.collection.find_one_and_update(
+                {"_id": consultation_id, "$or": changed},
+                {"$set": stored, "$push": {"outbox": outbox_entry("consultation_updated", "patient",
+                                                                  consultation_status=fields.get("status"))}},
+                projection=projection,
+                return_document=ReturnDocument.BEFORE
+            )
+        if before is None:
+            before = self.collection.find_one_and_update(
+                {"_id": consultation_id},
+                {"$set": stored},
+                projection=projection,
+                return_document=ReturnDocument.BEFORE
+            )
+        if not before:
+            return False
+        self.decrypt_fields(before)
+        
+        if "status" in fields:
+            was_pending = before.get("status") == "pending"
+            if was_pending != (fields["status"] == "pending"):
+                self._adjust_pending(before.get("doctor_id"), -1 if was_pending else 1)
+        
+        after = {**before, **fields}
+        outcome_changed = any(before.get(field) != fields[field]
+                              for field in ("status", "diagnosis", "prescription") if field in fields)
+        if outcome_changed and after.get("status") == "completed" and after.get("patient_id") is not None:
+            self.records.record_completion(after)
+        if "lab_requests" in fields:
+            self.lab_requests.sync({**after, "_id": consultation_id}, fields["lab_requests"],
+                                   now=fields.get("updated_at"))
+        changed = any(before.get(field) != value for field, value in fields.items())
+        if changed:
+            self._changed(before)
+            if after.get("doctor_id") != before.get("doctor_id") or after.get("patient_id") != before.get("patient_id"):
+                self._changed(after)
+        return changed
+
+    def bulk_update(self, doctor_id, updates):
+        """Apply {consultation_id: fields} to the doctor's pending consultations in one bulk_write.
+        
+        fields are $set as by update(), except lab_requests, whose tests are added to
+        the consultation's. Returns {consultation_id: outcome}: "updated", "skipped" when
+        the consultation is no longer pending for this doctor, or the server's error.
+        """
+        updates = {consultation_id: normalize_clinical_fields(fields) for consultation_id, fields in updates.items()}
+        outcomes = {consultation_id: "skipped" for consultation_id in updates}
+        pending = {"doctor_id": doctor_id, "status": "pending"}
+        current = {consultation["_id"]: consultation for consultation in self.collection.find(
+            {"_id": {"$in": list(updates)}, **pending}, {field: 1 for field in RECORD_FIELDS})}
+        
+        # Tags the writes of this batch, so a consultation that left the queue after the
+        # read above can be told apart from one that was updated; unset once it has been read
+        batch_id = uuid.uuid4().hex
+        requests, request_ids = [], []
+        for consultation_id, fields in updates.items():
+            if consultation_id not in current:
+                continue
+            fields = dict(fields)
+            tests = _clean_tests(fields.pop("lab_requests", None))
+            update = {"$set": {**self.encrypt_fields(current[consultation_id].get("patient_id"), fields),
+                               "bulk_update_id": batch_id}}
+            if tests:
+                update["$addToSet"] = {"lab_requests": {"$each": tests}}
+            if tests or any(field in fields for field in PATIENT_VISIBLE_FIELDS):
+                update["$push"] = {"outbox": outbox_entry("consultation_updated", "patient",
+                                                          consultation_status=fields.get("status"))}
+            requests.append(UpdateOne({"_id": consultation_id, **pending}, update))
+            request_ids.append(consultation_id)
+        if not requests:
+            return outcomes
+        
+        try:
+            matched = self.collection.bulk_write(requests, ordered=False).matched_count
+        except BulkWriteError as error:
+            for write_error in error.details["writeErrors"]:
+                outcomes[request_ids[write_error["index"]]] = write_error["errmsg"]
+            matched = error.details["nMatched"]
+        applied = [consultation_id for consultation_id in request_ids if outcomes[consultation_id] == "skipped"]
+        tagged = {"_id": {"$in": applied}, "bulk_update_id": batch_id}
+        if matched < len(applied):
+            applied = [consultation["_id"] for consultation in self.collection.find(tagged, {"_id": 1})]
+        if applied:
+            self.collection.update_many(tagged, {"$unset": {"bulk_update_id": ""}})
+        
+        left_queue = 0
+        lab_requests = []
+        for consultation_id in applied:
+            outcomes[consultation_id] = "updated"
+            fields = updates[consultation_id]
+            after = {**current[consultation_id], **fields}
+            left_queue += after.get("status") != "pending"
+            if after.get("status") == "completed" and after.get("patient_id") is not None:
+                self.records.record_completion(after)
+            if fields.get("lab_requests"):
+                lab_requests.append((after, fields["lab_requests"]))
+        if left_queue:
+            self._adjust_pending(doctor_id, -left_queue)
+        self.lab_requests.add_many(lab_requests)
+        if applied and self.generations:
+            self.generations.bump(doctor_scope(doctor_id),
+                                  *{patient_scope(current[consultation_id]["patient_id"]) for consultation_id in applied
+                                    if current[consultation_id].get("patient_id") is not None})
+        return outcomes
+
+    def find(self, query, projection=None, newest_first=True):
+        direction = DESCENDING if newest_first else ASCENDING
+        consultations = list(self.collection.find(query, projection).sort("created_at", direction))
+        if self.cipher and returns_encrypted(projection):
+            self.cipher.decrypt_documents(consultations)
+        return consultations
+
+    def find_by_terms(self, doctor_id, allergies=None, medical_history=None, projection=None):
+        """A doctor's consultations recording all the given allergies and history terms, newest first"""
+        query = {"doctor_id": doctor_id}
+        for field, terms in (("allergies", allergies), ("medical_history", medical_history)):
+            terms = normalize_terms(terms, field)
+            if terms:
+                query[field] = {"$all": terms}
+        return self.find(query, projection)
+
+    def list_for_patient(self, patient_id, projection=None):
+        return self.find({"patient_id": patient_id}, projection)
+
+    def pending_queue(self, doctor_id, projection=None, limit=0):
+        """The doctor's pending consultations, most urgent first after aging (see triage.triage_due_at).
+        
+        Read in (doctor_id, status, triage_due_at) index order, so nothing is
+        sorted in memory and limit stops the scan early.
+        """
+        cursor = self.collection.find({"doctor_id": doctor_id, "status": "pending"}, projection)
+        consultations = list(cursor.sort("triage_due_at", ASCENDING).limit(limit))
+        if self.cipher and returns_encrypted(projection):
+            self.cipher.decrypt_documents(consultations)
+        return consultations
+
+    def list_for_doctor(self, doctor_id, status=None, projection=None):
+        query = {"doctor_id": doctor_id}
+        if status:
+            query["status"] = status
+        return self.find(query, projection)
+
+    def count(self, query=None):
+        return self.collection.count_documents(query or {})
+
+    def pending_counts_by_doctor(self):
+        """Recount pending consultations per doctor from the source documents"""
+        return {
+            doctor_id: self.collection.count_documents({"doctor_id": doctor_id, "status": "pending"})
+            for doctor_id in self.collection.distinct("doctor_id", {"status": "pending"})
+        }
+
+    def list_booked_slots(self, since, until):
+        """Appointment starts (with doctor) booked between since and until"""
+        return list(self.collection.find(
+            {"appointment_start": {"$gte": since, "$lt": until}},
+            {"_id": 0, "doctor_id": 1, "appointment_start": 1}
+        ))
+
+class OutboxRepository:
+    """Notifications queued by consultation writes, drained by the notification worker"""
+
+    def __init__(self, db):
+        self.collection = db.get_collection(OUTBOX_COLLECTION)
+        self.consultations = db.get_collection(CONSULTATIONS_COLLECTION)
+
+    def ensure_indexes(self, retention_days=7):
+        self.collection.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+        self.collection.create_index("sent_at", expireAfterSeconds=retention_days * 86400)
+
+    def relay(self, limit=100):
+        """Move notifications embedded in consultations into the outbox; return how many.
+        
+        Messages keep the embedded entry's id as _id, so relaying the same entry
+        twice (a worker died before the $pull) does not queue it twice.
+        """
+        relayed = 0
+        for consult in self.consultations.find(
+                {"outbox.id": {"$exists": True}},
+                {"outbox": 1, "patient_id": 1, "doctor_id": 1, "patient_name": 1, "doctor_name": 1}
+        ).limit(limit):
+            entries = consult["outbox"]
+            for entry in entries:
+                entry = dict(entry)
+                message = {
+                    "_id": entry.pop("id"),
+                    "recipient_id": consult.get(f"{entry['recipient']}_id"),
+                    "consultation_id": consult["_id"],
+                    "patient_name": consult.get("patient_name"),
+                    "doctor_name": consult.get("doctor_name"),
+                    **entry,
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": entry["created_at"]
+                }
+                try:
+                    self.collection.insert_one(message)
+                    relayed += 1
+                except DuplicateKeyError:
+                    pass
+            self.consultations.update_one(
+                {"_id": consult["_id"]},
+                {"$pull": {"outbox": {"id": {"$in": [entry["id"] for entry in entries]}}}}
+            )
+        return relayed
+
+    def claim(self, batch_size, lease_seconds=300, now=None):
+        """Lease up to batch_size due messages to the caller and return them.
+        
+        Messages whose lease ran out (the worker holding them died) are due again.
+        """
+        now = now or datetime.utcnow()
+        due = {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "lease_until": {"$lte": now}}
+        ]}
+        ids = [doc["_id"] for doc in self.collection.find(due, {"_id": 1})
+               .sort("next_attempt_at", ASCENDING).limit(batch_size)]
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        self.collection.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": "sending", "claimed_by": token,
+                      "lease_until": now + timedelta(seconds=lease_seconds)}}
+        )
+        return list(self.collection.find({"_id": {"$in": ids}, "claimed_by": token}))
+
+    def mark_sent(self, message_ids, now=None):
+        self.collection.update_many(
+            {"_id": {"$in": list(message_ids)}},
+            {"$set": {"status": "sent", "sent_at": now or datetime.utcnow()},
+             "$unset": {"claimed_by": "", "lease_until": ""}}
+        )
+
+    def mark_failed(self, message_ids, error, retry_at=None):
+        """Schedule a retry at retry_at, or give up on the messages when it is None"""
+        fields = {"last_error": str(error)}
+        if retry_at:
+            fields.update(status="pending", next_attempt_at=retry_at)
+        else:
+            fields.update(status="dead")
+        self.collection.update_many(
+            {"_id": {"$in": list(message_ids)}},
+            {"$set": fields, "$inc": {"attempts": 1}, "$unset": {"claimed_by": "", "lease_until": ""}}
+        )
+
+    def count(self, status=None):
+        return self.collection.count_documents({"status": status} if status else {})
+
+# Requests not yet resulted, i.e. still in the lab's queue
+OUTSTANDING_LAB_STATUSES = list(LAB_REQUEST_STATUSES[:-1])
+
+def _clean_tests(tests):
+    """Requested test names, stripped, without blanks or repeats"""
+    return list(dict.fromkeys(test.strip() for test in tests or [] if test and test.strip()))
+
+def _new_lab_request(consultation, now):
+    return {
+        "patient_id": consultation.get("patient_id"),
+        "doctor_id": consultation.get("doctor_id"),
+        "status": LAB_REQUEST_STATUSES[0],
+        "requested_at": now,
+        "updated_at": now
+    }
+
+class LabRequestRepository:
+    """One document per test a doctor requested, moving requested -> collected -> resulted.
+    
+    The consultation keeps its lab_requests strings for the patient's view and
+    notifications; this collection carries the status and is what the lab's
+    queue and "outstanding labs" read, through compound indexes.
+    """
+
+    def __init__(self, db):
+        self.collection = db.get_collection(LAB_REQUESTS_COLLECTION)
+
+    def ensure_indexes(self):
+        # Lab queue: outstanding requests, oldest first
+        self.collection.create_index([("status", ASCENDING), ("requested_at", ASCENDING)])
+        self.collection.create_index([("doctor_id", ASCENDING), ("status", ASCENDING), ("requested_at", ASCENDING)])
+        self.collection.create_index([("patient_id", ASCENDING), ("status", ASCENDING), ("requested_at", ASCENDING)])
+        # One request per test per consultation, so repeated saves of the same list do not duplicate
+        self.collection.create_index([("consultation_id", ASCENDING), ("test", ASCENDING)], unique=True)
+
+    def sync(self, consultation, tests, now=None):
+        """Match a consultation's requests to its lab_requests list.
+        
+        New tests are added as requested; tests dropped from the list are removed
+        unless the lab has already collected them. Returns how many were added.
+        """
+        now = now or datetime.utcnow()
+        tests = _clean_tests(tests)
+        added = 0
+        for test in tests:
+            result = self.collection.update_one(
+                {"consultation_id": consultation["_id"], "test": test},
+                {"$setOnInsert": _new_lab_request(consultation, now)},
+                upsert=True
+            )
+            added += result.upserted_id is not None
+        self.collection.delete_many({"consultation_id": consultation["_id"], "test": {"$nin": tests},
+                                     "status": LAB_REQUEST_STATUSES[0]})
+        return added
+
+    def add_many(self, requests, now=None):
+        """Add the tests of (consultation, tests) pairs in one bulk_write; return how many were new.
+        
+        Unlike sync(), requests already made for a consultation are kept.
+        """
+        now = now or datetime.utcnow()
+        operations = [UpdateOne({"consultation_id": consultation["_id"], "test": test},
+                                {"$setOnInsert": _new_lab_request(consultation, now)}, upsert=True)
+                      for consultation, tests in requests for test in _clean_tests(tests)]
+        if not operations:
+            return 0
+        return self.collection.bulk_write(operations, ordered=False).upserted_count
+
+    def advance(self, request_id, status, now=None, **fields):
+        """Move a request to status from the one before it; return True if it moved.
+        
+        Sets <status>_at; a request already past status is left alone.
+        """
+        previous = LAB_REQUEST_STATUSES[LAB_REQUEST_STATUSES.index(status) - 1]
+        now = now or datetime.utcnow()
+        result = self.collection.update_one(
+            {"_id": request_id, "status": previous},
+            {"$set": {"status": status, f"{status}_at": now, "updated_at": now, **fields}}
+        )
+        return result.modified_count == 1
+
+    def link_report(self, report, report_id):
+        """Result the request a newly uploaded report belongs to; return its _id or None.
+        
+        The report names its request (lab_request_id), or the consultation has a
+        single outstanding request; otherwise the report stays unlinked.
+        """
+        request_id = report.get("lab_request_id")
+        if request_id is None:
+            outstanding = list(self.collection.find(
+                {"consultation_id": report["consultation_id"], "status": {"$in": OUTSTANDING_LAB_STATUSES}},
+                {"_id": 1}
+            ).limit(2))
+            if len(outstanding) != 1:
+                return None
+            request_id = outstanding[0]["_id"]
+        now = report.get("created_at") or datetime.utcnow()
+        self.collection.update_one(
+            {"_id": request_id, "status": {"$in": OUTSTANDING_LAB_STATUSES}},
+            {"$set": {"status": LAB_REQUEST_STATUSES[-1], "resulted_at": now, "updated_at": now}}
+        )
+        self.collection.update_one({"_id": request_id}, {"$addToSet": {"report_ids": report_id}})
+        return request_id
+
+    def get(self, request_id):
+        return self.collection.find_one({"_id": request_id})
+
+    def queue(self, statuses=None, doctor_id=None, limit=0):
+        """Outstanding requests (or those in statuses), oldest first, from the compound indexes"""
+        query = {"status": {"$in": list(statuses or OUTSTANDING_LAB_STATUSES)}}
+        if doctor_id is not None:
+            query["doctor_id"] = doctor_id
+        return list(self.collection.find(query).sort("requested_at", ASCENDING).limit(limit))
+
+    def count_outstanding(self, doctor_id=None):
+        query = {"status": {"$in": OUTSTANDING_LAB_STATUSES}}
+        if doctor_id is not None:
+            query["doctor_id"] = doctor_id
+        return self.collection.count_documents(query)
+
+    def list_for_consultation(self, consultation_id):
+        return list(self.collection.find({"consultation_id": consultation_id}).sort("requested_at", ASCENDING))
+
+class LabReportRepository:
+    """Lab reports uploaded against a consultation"""
+
+    def __init__(self, db):
+        self.collection = db.get_collection(LAB_REPORTS_COLLECTION)
+        self.requests = LabRequestRepository(db)
+
+    def ensure_indexes(self):
+        self.collection.create_index("consultation_id")
+        self.collection.create_index([("patient_id", ASCENDING), ("created_at", DESCENDING)])
+        self.collection.create_index("lab_request_id", sparse=True)
+
+    def create(self, report_data):
+        """Insert a report and result the lab request it answers"""
+        report_id = self.collection.insert_one(report_data).inserted_id
+        if report_data.get("consultation_id") is not None:
+            request_id = self.requests.link_report(report_data, report_id)
+            if request_id is not None and report_data.get("lab_request_id") is None:
+                self.collection.update_one({"_id": report_id}, {"$set": {"lab_request_id": request_id}})
+        return report_id
+
+    def list_for_consultation(self, consultation_id):
+        return list(self.collection.find({"consultation_id": consultation_id}).sort("created_at", DESCENDING))
+
+    def list_for_patient(self, patient_id):
+        return list(self.collection.find({"patient_id": patient_id}).sort("created_at", DESCENDING))
+
+class SessionRepository:
+    """Checkpoints of browser session state, so any replica can resume a session.
+    
+    Documents are keyed by a hash of the client's session token, never the
+    token itself, and expire expires_at after the last checkpoint.
+    """
+
+    def __init__(self, db):
+        self.collection = db.get_collection(SESSIONS_COLLECTION)
+
+    def ensure_indexes(self):
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def save(self, token_hash, state, ttl):
+        now = datetime.utcnow()
+        self.collection.replace_one(
+            {"_id": token_hash},
+            {"_id": token_hash, "state": state, "updated_at": now, "expires_at": now + ttl},
+            upsert=True
+        )
+
+    def load(self, token_hash, now=None):
+        """Checkpointed state, or None once expired (the TTL monitor only runs every minute)"""
+        document = self.collection.find_one({"_id": token_hash, "expires_at": {"$gt": now or datetime.utcnow()}},
+                                            {"state": 1})
+        return document["state"] if document else None
+
+    def take(self, token_hash, now=None):
+        """Checkpointed state, deleted in the same operation, or None once expired.
+        
+        Of concurrent callers with the same token only one gets the state.
+        """
+        document = self.collection.find_one_and_delete(
+            {"_id": token_hash, "expires_at": {"$gt": now or datetime.utcnow()}}, {"state": 1})
+        return document["state"] if document else None
+
+    def delete(self, token_hash):
+        self.collection.delete_one({"_id": token_hash})
+
+class AuditLogRepository:
+    """Who accessed which patient's health information, and when.
+    
+    A time-series collection (timeField "at", metaField "meta" holding the
+    patient and actor), expired after AUDIT_RETENTION_DAYS; written in batches
+    by audit.AuditLogger, never one insert per page view.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.get_collection(AUDIT_LOG_COLLECTION)
+
+    def ensure_indexes(self):
+        if not self.collection.options():
+            try:
+                self.db.create_collection(
+                    AUDIT_LOG_COLLECTION,
+                    timeseries={"timeField": "at", "metaField": "meta", "granularity": "seconds"},
+                    expireAfterSeconds=AUDIT_RETENTION_DAYS * 86400
+                )
+            except CollectionInvalid:
+                pass  # Created by another replica, or an existing plain collection
+            except OperationFailure:
+                # Servers before 5.0 have no time series; a capped collection still needs no cleanup
+                self.db.create_collection(AUDIT_LOG_COLLECTION, capped=True, size=AUDIT_CAPPED_BYTES)
+        # Admin audit queries: one patient's accesses, or one actor's, newest first
+        self.collection.create_index([("meta.patient_id", ASCENDING), ("at", DESCENDING)])
+        self.collection.create_index([("meta.actor_id", ASCENDING), ("at", DESCENDING)])
+
+    def insert_many(self, events):
+        self.collection.insert_many(events, ordered=False)
+
+    def find(self, patient_id=None, actor_id=None, since=None, until=None, limit=AUDIT_PAGE_SIZE):
+        query = {}
+        if patient_id is not None:
+            query["meta.patient_id"] = patient_id
+        if actor_id is not None:
+            query["meta.actor_id"] = actor_id
+        if since is not None or until is not None:
+            query["at"] = {key: value for key, value in (("$gte", since), ("$lt", until)) if value is not None}
+        return list(self.collection.find(query).sort("at", DESCENDING).limit(limit))
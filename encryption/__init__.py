@@ -0,0 +1,226 @@
+# encryption/__init__.py
+import base64
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from bson import ObjectId, Binary
+from bson.binary import USER_DEFINED_SUBTYPE
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from pymongo.errors import DuplicateKeyError
+
+from config import ENCRYPTION_KEY_FILE, DATA_KEYS_COLLECTION, DATA_KEY_CACHE_SECONDS, DATA_KEY_CACHE_SIZE
+
+# Consultation fields holding free clinical text, stored encrypted under the patient's data key
+ENCRYPTED_FIELDS = ("symptoms", "diagnosis", "prescription", "consultation_notes")
+
+# Stored value: version byte, data key _id (12 bytes), nonce (12 bytes), then AES-GCM ciphertext and tag
+FORMAT_VERSION = 1
+NONCE_BYTES = 12
+KEY_END = 13
+NONCE_END = KEY_END + NONCE_BYTES
+
+class DataKeyMissing(Exception):
+    """A value was encrypted under a data key that is not in the data_keys collection"""
+
+class MasterKeyMissing(Exception):
+    """ENCRYPTION_KEY_FILE does not exist; encrypted data cannot be read or written without it"""
+
+def is_encrypted(value):
+    return isinstance(value, Binary) and value.subtype == USER_DEFINED_SUBTYPE and value[0] == FORMAT_VERSION
+
+def generate_master_key():
+    return AESGCM.generate_key(bit_length=256)
+
+def create_master_key(path=ENCRYPTION_KEY_FILE):
+    """Write a new master key (base64, mode 0600) for a new deployment; fails if path exists"""
+    key = generate_master_key()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(base64.b64encode(key) + b"\n")
+    return key
+
+def load_master_key(path=ENCRYPTION_KEY_FILE):
+    """The 256-bit key-encryption key, base64 in a local file.
+    
+    Never created here: a process that made its own key would wrap data keys no
+    other replica (or restarted container) can unwrap. Every replica must read
+    the same file: mount one (a Kubernetes Secret) created with create_master_key().
+    """
+    try:
+        with open(path, "rb") as f:
+            key = base64.b64decode(f.read().strip())
+    except FileNotFoundError:
+        raise MasterKeyMissing(f"No master key at {path}: mount the key this deployment's data is encrypted "
+                               f"under, or create one for a new deployment with create_master_key()") from None
+    if len(key) != 32:
+        raise ValueError(f"{path} does not hold a 256-bit key")
+    return key
+
+class KeyCache:
+    """Values held in memory for at most ttl seconds, least recently used evicted past max_size.
+    
+    Holds unwrapped data keys here and user profiles for UserRepository.
+    """
+
+    def __init__(self, ttl=DATA_KEY_CACHE_SECONDS, max_size=DATA_KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class FieldCipher:
+    """Envelope encryption of clinical text fields with one data key per patient.
+    
+    Data keys are random AES-256 keys stored in data_keys wrapped (AES-GCM)
+    under the master key, and cached unwrapped for DATA_KEY_CACHE_SECONDS, so a
+    list of one patient's consultations costs at most one key read. Each stored
+    value names its data key, so it can be decrypted without its document's
+    patient_id; the field name is bound in as associated data.
+    """
+
+    def __init__(self, db, master_key=None, key_file=ENCRYPTION_KEY_FILE, cache=None):
+        self.keys = db.get_collection(DATA_KEYS_COLLECTION)
+        self.cache = cache if cache is not None else KeyCache()
+        self._master_key = master_key
+        self._key_file = key_file
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.keys.create_index("patient_id", unique=True)
+
+    @property
+    def master(self):
+        # Loaded on first use, so processes that never touch clinical text need no key file
+        if self._master_key is None:
+            with self._lock:
+                if self._master_key is None:
+                    self._master_key = load_master_key(self._key_file)
+        return AESGCM(self._master_key)
+
+    def _unwrap(self, document):
+        wrapped = bytes(document["wrapped_key"])
+        key = self.master.decrypt(wrapped[:NONCE_BYTES], wrapped[NONCE_BYTES:], document["_id"].binary)
+        return AESGCM(key)
+
+    def _patient_key(self, patient_id):
+        """(key _id, AESGCM) of the patient's data key, created on first use"""
+        cached = self.cache.get(("patient", patient_id))
+        if cached:
+            return cached
+        document = self.keys.find_one({"patient_id": patient_id})
+        if document is None:
+            key_id = ObjectId()
+            key = AESGCM.generate_key(bit_length=256)
+            nonce = os.urandom(NONCE_BYTES)
+            try:
+                self.keys.insert_one({
+                    "_id": key_id,
+                    "patient_id": patient_id,
+                    "wrapped_key": Binary(nonce + self.master.encrypt(nonce, key, key_id.binary)),
+                    "created_at": datetime.utcnow()
+                })
+                document = {"_id": key_id}
+                aead = AESGCM(key)
+            except DuplicateKeyError:
+                # Created concurrently by another session or replica
+                document = self.keys.find_one({"patient_id": patient_id})
+                aead = self._unwrap(document)
+        else:
+            aead = self._unwrap(document)
+        entry = (document["_id"], aead)
+        self.cache.put(("patient", patient_id), entry)
+        self.cache.put(document["_id"].binary, aead)
+        return entry
+
+    def _key(self, key_id):
+        """AESGCM of a data key by its _id as 12 bytes, the form stored in each value"""
+        aead = self.cache.get(key_id)
+        if aead is None:
+            document = self.keys.find_one({"_id": ObjectId(key_id)})
+            if document is None:
+                raise DataKeyMissing(f"data key {ObjectId(key_id)} not found")
+            aead = self._unwrap(document)
+            self.cache.put(key_id, aead)
+        return aead
+
+    def encrypt(self, patient_id, field, value):
+        """value (a string) encrypted under the patient's data key; None and empty values are kept"""
+        if not value or is_encrypted(value):
+            return value
+        key_id, aead = self._patient_key(patient_id)
+        nonce = os.urandom(NONCE_BYTES)
+        ciphertext = aead.encrypt(nonce, value.encode("utf-8"), field.encode())
+        return Binary(bytes([FORMAT_VERSION]) + key_id.binary + nonce + ciphertext, USER_DEFINED_SUBTYPE)
+
+    def decrypt(self, field, value):
+        """The text of an encrypted value; plaintext (not yet migrated) is returned as it is"""
+        if not is_encrypted(value):
+            return value
+        return _open(self._key(value[1:KEY_END]), field, value)
+
+    def encrypt_fields(self, patient_id, document, fields=ENCRYPTED_FIELDS):
+        """A copy of document with the given fields encrypted (fields it lacks stay absent)"""
+        if patient_id is None:
+            return document
+        return {**document, **{field: self.encrypt(patient_id, field, document[field])
+                               for field in fields if field in document}}
+
+    def decrypt_fields(self, document, fields=ENCRYPTED_FIELDS):
+        """Decrypt, in place, the fields present in document; a projection that left them out costs nothing"""
+        if document:
+            self.decrypt_documents([document], fields)
+        return document
+
+    def decrypt_documents(self, documents, fields=ENCRYPTED_FIELDS):
+        """decrypt_fields for a list of documents, going to the key cache once per data key"""
+        keys = {}
+        for document in documents:
+            for field in fields:
+                value = document.get(field)
+                if is_encrypted(value):
+                    key_id = value[1:KEY_END]
+                    aead = keys.get(key_id)
+                    if aead is None:
+                        aead = keys[key_id] = self._key(key_id)
+                    document[field] = _open(aead, field, value)
+        return documents
+
+def _open(aead, field, value):
+    return aead.decrypt(value[KEY_END:NONCE_END], value[NONCE_END:], field.encode()).decode("utf-8")
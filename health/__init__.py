@@ -0,0 +1,131 @@
+# health/__init__.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from database import db
+from database.connection import pool_monitor
+from database.memory import MemoryDatabase
+from startup import WARM_STATE, ACTIVE_RUNS
+from metrics import EXPORTED, collect, render, session_report
+from config import HEALTH_PORT, HEALTH_PING_BUDGET_MS, HEALTH_MAX_RUN_SECONDS, DIAGNOSTICS_PORT
+
+# =============================================
+# CHECKS
+# =============================================
+
+def check_mongo(database=db, budget_ms=HEALTH_PING_BUDGET_MS):
+    """Ping latency against the budget; a slow or failing ping means not ready"""
+    start = time.perf_counter()
+    try:
+        database.command("ping")
+    except Exception as e:
+        return False, {"error": str(e)}
+    latency_ms = (time.perf_counter() - start) * 1000
+    return latency_ms <= budget_ms, {"latency_ms": round(latency_ms, 1), "budget_ms": budget_ms}
+
+def check_pool(database=db, monitor=pool_monitor):
+    """A server pool is ready and has a free connection"""
+    if isinstance(database, MemoryDatabase):
+        return True, {"backend": "memory"}
+    max_pool_size = database.client.options.pool_options.max_pool_size
+    return monitor.available(max_pool_size), {
+        "checked_out": monitor.checked_out,
+        "max_pool_size": max_pool_size,
+        "ready_servers": sum(monitor.ready.values())
+    }
+
+def check_warm(state=WARM_STATE):
+    return state["warm"], {key: value for key, value in state.items() if value is not None}
+
+def check_script_runner(active_runs=ACTIVE_RUNS, max_run_seconds=HEALTH_MAX_RUN_SECONDS, now=None):
+    """No full script run has been going for longer than max_run_seconds"""
+    now = now or time.monotonic()
+    longest = max((now - started for started in list(active_runs.values())), default=0)
+    return longest <= max_run_seconds, {"active_runs": len(active_runs), "longest_run_s": round(longest, 1)}
+
+def check_runtime():
+    """The Streamlit runtime, once started, has not begun shutting down"""
+    from streamlit import runtime
+    if not runtime.exists():
+        return True, {"state": "not started"}
+    state = runtime.get_instance().state.value
+    return state not in ("STOPPING", "STOPPED"), {"state": state}
+
+def readiness():
+    """Mongo reachable within budget, pool available and caches warm"""
+    return _combine(mongo=check_mongo(), pool=check_pool(), warm=check_warm())
+
+def liveness():
+    """The process should be restarted when the script runner or runtime is stuck"""
+    return _combine(script_runner=check_script_runner(), runtime=check_runtime())
+
+def _combine(**checks):
+    ok = all(passed for passed, _ in checks.values())
+    return ok, {name: {"ok": passed, **details} for name, (passed, details) in checks.items()}
+
+# =============================================
+# HTTP ENDPOINTS
+# =============================================
+
+ENDPOINTS = {
+    "/readyz": readiness,
+    "/livez": liveness
+}
+
+# Always 200: {path: (content type, body)}
+REPORTS = {
+    "/metrics": lambda: ("text/plain; version=0.0.4", render(collect(EXPORTED), EXPORTED))
+}
+
+# Per-session detail for operators, served only on the loopback diagnostics port
+DIAGNOSTICS = {
+    "/sessions": lambda: ("application/json", json.dumps(session_report()))
+}
+
+class HealthHandler(BaseHTTPRequestHandler):
+    endpoints = ENDPOINTS
+    reports = REPORTS
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path in self.reports:
+            content_type, body = self.reports[path]()
+            self._reply(200, content_type, body.encode('utf-8'))
+            return
+        check = self.endpoints.get(path)
+        if not check:
+            self.send_error(404)
+            return
+        ok, details = check()
+        body = json.dumps({"ok": ok, "checks": details}).encode('utf-8')
+        self._reply(200 if ok else 503, "application/json", body)
+
+    def _reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Probes hit these every few seconds; keep them out of the app log
+        pass
+
+class DiagnosticsHandler(HealthHandler):
+    endpoints = {}
+    reports = DIAGNOSTICS
+
+def _serve(handler, host, port, name):
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return server
+
+def start_health_server(port=HEALTH_PORT, host="0.0.0.0"):
+    """Serve /readyz, /livez and /metrics from a daemon thread; return the server"""
+    return _serve(HealthHandler, host, port, "health-server")
+
+def start_diagnostics_server(port=DIAGNOSTICS_PORT):
+    """Serve /sessions on 127.0.0.1 only (reach it with kubectl exec or port-forward); return the server"""
+    return _serve(DiagnosticsHandler, "127.0.0.1", port, "diagnostics-server")
@@ -0,0 +1,137 @@
+# interactions/__init__.py
+import json
+import re
+from functools import lru_cache
+
+from config import INTERACTIONS_FILE
+from vocabulary import normalize_term, normalize_terms
+
+# Prescription words, casefolded; hyphenated and slashed names (tmp-smx, tmp/smx) stay one token
+TOKEN = re.compile(r"[a-z0-9]+(?:[-/][a-z0-9]+)*")
+
+SEVERITY_ORDER = {"high": 0, "moderate": 1, "low": 2}
+
+def tokenize(text):
+    return TOKEN.findall((text or "").casefold())
+
+class DrugTrie:
+    """Drug names and synonyms by token, matched longest first in one pass over free text"""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, name, drug):
+        node = self.root
+        for token in tokenize(name):
+            node = node.setdefault(token, {})
+        node[None] = drug
+
+    def find(self, text):
+        """Canonical drugs named in text, in order of first mention"""
+        tokens = tokenize(text)
+        found = []
+        start = 0
+        while start < len(tokens):
+            node, match, end = self.root, None, start + 1
+            position = start
+            while position < len(tokens) and tokens[position] in node:
+                node = node[tokens[position]]
+                position += 1
+                if None in node:
+                    match, end = node[None], position
+            if match is not None and match not in found:
+                found.append(match)
+            start = end
+        return found
+
+class InteractionChecker:
+    """Drug-allergy and drug-drug conflicts from a precomputed table.
+    
+    Loading expands drug classes into (allergen, drug) and (drug, drug) hash
+    tables once, so a check is one trie pass over the prescription plus a
+    dict lookup per pair; nothing is scanned per keystroke.
+    """
+
+    def __init__(self, data):
+        self.drug_classes = {}
+        for class_name, drugs in data.get("drug_classes", {}).items():
+            for drug in drugs:
+                self.drug_classes.setdefault(drug, set()).add(class_name)
+        class_members = {class_name: set(drugs) for class_name, drugs in data.get("drug_classes", {}).items()}
+        
+        self.trie = DrugTrie()
+        synonyms = data.get("drug_synonyms", {})
+        for drug in set(self.drug_classes) | set(synonyms):
+            self.trie.add(drug, drug)
+            for synonym in synonyms.get(drug, []):
+                self.trie.add(synonym, drug)
+        
+        def expand(names):
+            """Drugs named directly or through their class"""
+            drugs = set()
+            for name in names:
+                drugs |= class_members.get(name, {name})
+            return drugs
+        
+        self.allergy_conflicts = {}
+        for entry in data.get("allergen_conflicts", []):
+            # Allergens are stored as canonical vocabulary terms, so match them the same way
+            allergen = normalize_term(entry["allergen"], "allergies")
+            for drug in expand([*entry.get("drugs", []), *entry.get("classes", [])]):
+                self._keep(self.allergy_conflicts, (allergen, drug), entry)
+        self.allergens = {allergen for allergen, _ in self.allergy_conflicts}
+        
+        self.drug_interactions = {}
+        for entry in data.get("drug_interactions", []):
+            for first in expand([entry["a"]]):
+                for second in expand([entry["b"]]):
+                    if first != second:
+                        self._keep(self.drug_interactions, _pair(first, second), entry)
+
+    @staticmethod
+    def _keep(table, key, entry):
+        """Record entry under key unless a more severe one is already there"""
+        current = table.get(key)
+        if current is None or SEVERITY_ORDER[entry["severity"]] < SEVERITY_ORDER[current["severity"]]:
+            table[key] = {"severity": entry["severity"], "reason": entry.get("reason", "")}
+
+    def drugs(self, text):
+        return self.trie.find(text)
+
+    def check(self, prescription, allergies=(), current_prescriptions=()):
+        """Conflicts of the drugs in prescription with allergies and with current prescriptions.
+        
+        Returns [{"kind", "drug", "conflicts_with", "severity", "reason"}], most severe first.
+        """
+        drugs = self.drugs(prescription)
+        if not drugs:
+            return []
+        allergens = [allergen for allergen in normalize_terms(allergies, "allergies") if allergen in self.allergens]
+        current = []
+        for text in current_prescriptions:
+            current.extend(drug for drug in self.drugs(text) if drug not in drugs and drug not in current)
+        
+        conflicts = []
+        for index, drug in enumerate(drugs):
+            for allergen in allergens:
+                hit = self.allergy_conflicts.get((allergen, drug))
+                if hit:
+                    conflicts.append({"kind": "allergy", "drug": drug, "conflicts_with": allergen, **hit})
+            for other in (*drugs[index + 1:], *current):
+                hit = self.drug_interactions.get(_pair(drug, other))
+                if hit:
+                    conflicts.append({"kind": "interaction", "drug": drug, "conflicts_with": other, **hit})
+        conflicts.sort(key=lambda conflict: SEVERITY_ORDER[conflict["severity"]])
+        return conflicts
+
+def _pair(first, second):
+    return (first, second) if first < second else (second, first)
+
+@lru_cache(maxsize=None)
+def get_checker(path=INTERACTIONS_FILE):
+    """The checker for a dataset file, built once per process"""
+    with open(path, encoding='utf-8') as f:
+        return InteractionChecker(json.load(f))
+
+def check_prescription(prescription, allergies=(), current_prescriptions=()):
+    return get_checker().check(prescription, allergies, current_prescriptions)
@@ -0,0 +1,85 @@
+# interactions/audit.py
+"""
+Batch audit of historical prescriptions against the drug-allergy and
+drug-drug interaction table, written as CSV.
+
+Each prescription is checked against the allergies recorded on its
+consultation and on the patient's record; known_at_time says whether the
+allergy was already on the consultation when it was prescribed.
+
+Usage:
+    python -m interactions.audit > prescription_audit.csv
+    python -m interactions.audit --since 2024-01-01 --batch-size 1000 --output audit.csv
+"""
+import argparse
+import csv
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING
+
+from config import MIGRATION_BATCH_SIZE
+from database import consultations as default_consultations
+from interactions import get_checker
+
+AUDIT_FIELDS = ("consultation_id", "patient_id", "doctor_id", "created_at", "kind", "drug", "conflicts_with",
+                "severity", "reason", "known_at_time")
+
+def audit_prescriptions(batch_size=MIGRATION_BATCH_SIZE, since=None, consultations=None, checker=None):
+    """Yield one row per conflict found in a prescribed consultation, batch_size consultations per read"""
+    consultations = consultations or default_consultations
+    checker = checker or get_checker()
+    query = {"prescription": {"$nin": [None, ""]}}
+    if since is not None:
+        query["created_at"] = {"$gte": since}
+    projection = {"patient_id": 1, "doctor_id": 1, "created_at": 1, "prescription": 1, "allergies": 1}
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        batch = list(consultations.collection.find(batch_query, projection).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            return
+        # One read for the allergies on every record in the batch
+        patient_ids = list({consult.get("patient_id") for consult in batch} - {None})
+        records = consultations.records.collection.find({"_id": {"$in": patient_ids}}, {"allergies": 1})
+        record_allergies = {record["_id"]: record.get("allergies", []) for record in records}
+        for consult in batch:
+            consultations.decrypt_fields(consult)
+            recorded = consult.get("allergies", [])
+            allergies = [*recorded, *record_allergies.get(consult.get("patient_id"), [])]
+            for conflict in checker.check(consult["prescription"], allergies):
+                yield {
+                    "consultation_id": consult["_id"],
+                    "patient_id": consult.get("patient_id"),
+                    "doctor_id": consult.get("doctor_id"),
+                    "created_at": consult.get("created_at"),
+                    **conflict,
+                    "known_at_time": conflict["kind"] != "allergy" or conflict["conflicts_with"] in recorded
+                }
+        last_id = batch[-1]["_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit historical prescriptions for allergy and drug conflicts")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="only consultations created on or after this ISO date")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--output", help="CSV file to write (default stdout)")
+    args = parser.parse_args()
+    
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(output, fieldnames=AUDIT_FIELDS)
+        writer.writeheader()
+        found = 0
+        for row in audit_prescriptions(args.batch_size, args.since):
+            writer.writerow(row)
+            found += 1
+    finally:
+        if args.output:
+            output.close()
+    print(f"{found} conflicts found", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
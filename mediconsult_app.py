@@ -1,153 +1,19 @@
 # mediconsult_app.py
 import streamlit as st
-import bcrypt
-from pymongo import MongoClient
 from datetime import datetime
-from bson import ObjectId
-
-# =============================================
-# DATABASE CONNECTION (No imports needed)
-# =============================================
-
-# MongoDB Configuration
-client = MongoClient("mongodb://mongodb:27017/") 
-db = client["mediconsult"]
-
-# Collections
-USERS_COLLECTION = "users"
-CONSULTATIONS_COLLECTION = "consultations"
-
-# User Types
-USER_TYPE_PATIENT = "patient"
-USER_TYPE_DOCTOR = "doctor"
-USER_TYPE_ADMIN = "admin"
-
-# Specializations
-SPECIALIZATIONS = [
-    "Cardiologist",
-    "Dermatologist",
-    "Neurologist",
-    "Orthopedic",
-    "Pediatrician",
-    "Psychiatrist",
-    "General Physician"
-]
-
-# =============================================
-# UTILITY FUNCTIONS
-# =============================================
-
-def hash_password(password):
-    pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed_bytes = bcrypt.hashpw(pwd_bytes, salt)
-    return hashed_bytes.decode('utf-8')
-
-def verify_password(password, hashed):
-    pwd_bytes = password.encode('utf-8')
-    hashed_bytes = hashed.encode('utf-8')
-    return bcrypt.checkpw(pwd_bytes, hashed_bytes)
-
-def register_user(name, email, password, user_type, **kwargs):
-    users_collection = db[USERS_COLLECTION]
-    
-    # Check if user already exists
-    if users_collection.find_one({"email": email}):
-        return False, "User already exists"
-    
-    # Create new user
-    hashed_password = hash_password(password)
-    user_data = {
-        "name": name,
-        "email": email,
-        "password": hashed_password,
-        "user_type": user_type,
-        **kwargs,
-        "created_at": datetime.utcnow()
-    }
-    
-    result = users_collection.insert_one(user_data)
-    return True, "User registered successfully"
-
-def authenticate_user(email, password):
-    users_collection = db[USERS_COLLECTION]
-    user = users_collection.find_one({"email": email})
-    
-    if user and verify_password(password, user["password"]):
-        return True, user
-    return False, None
-
-def get_user_by_id(user_id):
-    users_collection = db[USERS_COLLECTION]
-    return users_collection.find_one({"_id": user_id})
-
-def get_doctors_by_specialization(specialization=None):
-    users_collection = db[USERS_COLLECTION]
-    query = {"user_type": "doctor"}
-    if specialization:
-        query["specialization"] = specialization
-    return list(users_collection.find(query))
-
-def get_all_doctors():
-    users_collection = db[USERS_COLLECTION]
-    return list(users_collection.find({"user_type": "doctor"}))
-
-def setup_database():
-    """Initialize database with admin and sample doctors"""
-    users_collection = db[USERS_COLLECTION]
-    
-    # Create admin user if not exists
-    admin_user = users_collection.find_one({"email": "admin@mediconsult.com"})
-    if not admin_user:
-        admin_data = {
-            "name": "System Administrator",
-            "email": "admin@mediconsult.com",
-            "password": hash_password("admin123"),
-            "user_type": "admin",
-            "phone": "+1234567890",
-            "created_at": datetime.utcnow()
-        }
-        users_collection.insert_one(admin_data)
-        st.sidebar.success("✅ Admin: admin@mediconsult.com / admin123")
-    
-    # Create sample doctors
-    sample_doctors = [
-        {
-            "name": "Sarah Wilson",
-            "email": "cardio@mediconsult.com",
-            "password": hash_password("doctor123"),
-            "user_type": "doctor",
-            "specialization": "Cardiologist",
-            "qualifications": "MD Cardiology, 10 years experience",
-            "consultation_fee": 100,
-            "available_hours": "Mon-Fri 9AM-5PM",
-            "phone": "+1234567891",
-            "is_available": True,
-            "created_at": datetime.utcnow()
-        },
-        {
-            "name": "Michael Chen",
-            "email": "derma@mediconsult.com",
-            "password": hash_password("doctor123"),
-            "user_type": "doctor",
-            "specialization": "Dermatologist",
-            "qualifications": "MD Dermatology, Skin specialist",
-            "consultation_fee": 80,
-            "available_hours": "Mon-Wed-Fri 10AM-6PM",
-            "phone": "+1234567892",
-            "is_available": True,
-            "created_at": datetime.utcnow()
-        }
-    ]
-    
-    for doctor in sample_doctors:
-        if not users_collection.find_one({"email": doctor["email"]}):
-            users_collection.insert_one(doctor)
-    
-    # Create indexes
-    users_collection.create_index("email", unique=True)
-    users_collection.create_index("user_type")
-    users_collection.create_index("specialization")
+from database import users, consultations
+from startup import setup_database, script_run
+from utils import (register_user, authenticate_user, get_user_profile,
+                   get_all_doctors, get_doctors_by_specialization, get_consultation_summaries,
+                   get_consultation_detail, idempotency_key, get_slot_index, book_consultation_slot,
+                   submit_task, task_outcome, start_session, restore_session, checkpoint_session,
+                   end_session, patient_record_summary, consultation_thread_summary,
+                   prescription_warnings, audit_access, get_pending_consultations,
+                   count_pending_consultations, degraded_on_outage, triage_summary, keep_drafts)
+from config import SPECIALIZATIONS, USER_TYPE_LAB
+from triage import priority_label
+from pages.lab_dashboard import lab_dashboard
+from pages.audit_log import audit_log_dashboard
 
 # =============================================
 # STREAMLIT APP CONFIGURATION
@@ -180,174 +46,279 @@ def patient_dashboard():
     st.title("👨‍💼 Patient Dashboard")
     
     user_id = st.session_state.user_id
-    consultations_collection = db[CONSULTATIONS_COLLECTION]
     
     # Sidebar navigation
     menu = ["Find Doctors", "New Consultation", "Consultation History"]
-    choice = st.sidebar.selectbox("Navigation", menu)
+    choice = st.sidebar.selectbox("Navigation", menu, key="navigation")
     
+    # Each view is a fragment, so its buttons and forms rerun only that view
     if choice == "Find Doctors":
-        st.header("👨‍⚕️ Find Available Doctors")
-        
-        doctors = get_all_doctors()
-        
-        if not doctors:
-            st.info("No doctors found.")
-            return
-        
-        for doctor in doctors:
-            with st.container():
-                st.subheader(f"Dr. {doctor['name']}")
-                st.write(f"**Specialization:** {doctor.get('specialization', 'Not specified')}")
-                st.write(f"**Qualifications:** {doctor.get('qualifications', 'Not provided')}")
-                st.write(f"**Fee:** ${doctor.get('consultation_fee', 'N/A')}")
-                
-                if st.button(f"Book Consultation", key=f"book_{doctor['_id']}"):
-                    st.session_state.selected_doctor = doctor
-                    st.rerun()
-        
-        if st.session_state.get('selected_doctor'):
-            doctor = st.session_state.selected_doctor
-            st.markdown("""
-                <style>
-                .consultation-header {
-                    color: #0d47a1;
-                    font-size: 1.8rem;
-                    font-weight: bold;
-                    margin-bottom: 1.5rem;
-                    padding: 10px;
-                    background-color: #e3f2fd;
-                    border-radius: 8px;
-                    text-align: center;
-                }
-                </style>
-            """, unsafe_allow_html=True)
+        find_doctors_view(user_id)
+    elif choice == "New Consultation":
+        new_consultation_view(user_id)
+    elif choice == "Consultation History":
+        consultation_history_view(user_id)
 
-            st.markdown(f'<div class="consultation-header">📅 Book Consultation with Dr. {doctor["name"]}</div>', unsafe_allow_html=True)
+@st.fragment
+@degraded_on_outage()
+def find_doctors_view(user_id):
+    st.header("👨‍⚕️ Find Available Doctors")
+    
+    specialization = st.selectbox("Specialization", ["All Specializations"] + SPECIALIZATIONS)
+    specialization = None if specialization == "All Specializations" else specialization
+    
+    # Bookable times come from the in-memory availability index, not from scanning bookings
+    st.subheader("🕒 Next Available Times")
+    slot_index = get_slot_index()
+    free_slots = slot_index.next_free_slots(specialization, limit=8)
+    
+    if not free_slots:
+        st.info("No open appointment times in the next 7 days.")
+    
+    slot_columns = st.columns(4)
+    for position, (start, doctor_id) in enumerate(free_slots):
+        label = f"{start.strftime('%a %d %b %H:%M')} · Dr. {slot_index.doctor(doctor_id)['name']}"
+        if slot_columns[position % 4].button(label, key=f"slot_{doctor_id}_{start.isoformat()}"):
+            st.session_state.selected_doctor_id = doctor_id
+            st.session_state.selected_slot = start
+    
+    doctors = get_doctors_by_specialization(specialization)
+    
+    if not doctors:
+        st.info("No doctors found.")
+        return
+    
+    for doctor in doctors:
+        with st.container():
+            st.subheader(f"Dr. {doctor['name']}")
+            st.write(f"**Specialization:** {doctor.get('specialization', 'Not specified')}")
+            st.write(f"**Qualifications:** {doctor.get('qualifications', 'Not provided')}")
+            st.write(f"**Fee:** ${doctor.get('consultation_fee', 'N/A')}")
             
-            with st.form("quick_consultation"):
-                st.write(f"**Doctor:** Dr. {doctor['name']} ({doctor.get('specialization', 'General Physician')})")
-                st.write(f"**Fee:** ${doctor.get('consultation_fee', 'N/A')}")
-                
-                symptoms = st.text_area("Describe Your Symptoms", placeholder="Please describe your symptoms in detail...", height=100)
-                medical_history = st.text_area("Medical History (Optional)")
-                allergies = st.text_area("Allergies (Optional)")
-                
-                submitted = st.form_submit_button("Submit Consultation Request")
-                
-                if submitted:
-                    if not symptoms:
-                        st.error("Please describe your symptoms")
-                    else:
-                        consultation_data = {
-                            "patient_id": user_id,
-                            "doctor_id": doctor["_id"],
-                            "doctor_name": doctor["name"],
-                            "doctor_specialization": doctor.get("specialization"),
-                            "symptoms": symptoms,
-                            "medical_history": medical_history.split(',') if medical_history else [],
-                            "allergies": allergies.split(',') if allergies else [],
-                            "consultation_fee": doctor.get("consultation_fee"),
-                            "status": "pending",
-                            "created_at": datetime.utcnow(),
-                            "updated_at": datetime.utcnow()
-                        }
-                        
-                        result = consultations_collection.insert_one(consultation_data)
-                        
-                        if result.inserted_id:
-                            st.success("✅ Consultation request submitted successfully!")
-                            st.session_state.selected_doctor = None
-                            st.rerun()
+            if st.button(f"Book Consultation", key=f"book_{doctor['_id']}"):
+                st.session_state.selected_doctor_id = doctor["_id"]
+                st.session_state.selected_slot = None
     
-    elif choice == "New Consultation":
-        st.header("🆕 New Consultation")
-        
-        doctors = get_all_doctors()
-        if not doctors:
-            st.info("No doctors available.")
-            return
+    # Only the _id is kept in the session; the profile comes from the shared cache
+    doctor = st.session_state.get('selected_doctor_id') and get_user_profile(st.session_state.selected_doctor_id)
+    if doctor:
+        slot = st.session_state.get('selected_slot')
+        st.markdown("""
+            <style>
+            .consultation-header {
+                color: #0d47a1;
+                font-size: 1.8rem;
+                font-weight: bold;
+                margin-bottom: 1.5rem;
+                padding: 10px;
+                background-color: #e3f2fd;
+                border-radius: 8px;
+                text-align: center;
+            }
+            </style>
+        """, unsafe_allow_html=True)
+
+        st.markdown(f'<div class="consultation-header">📅 Book Consultation with Dr. {doctor["name"]}</div>', unsafe_allow_html=True)
         
-        doctor_options = {f"Dr. {doc['name']} ({doc.get('specialization')})": doc["_id"] for doc in doctors}
-        selected_doctor_label = st.selectbox("Choose a Doctor", list(doctor_options.keys()))
-        selected_doctor_id = doctor_options[selected_doctor_label]
-        selected_doctor = get_user_by_id(selected_doctor_id)
+        with st.form("quick_consultation"):
+            st.write(f"**Doctor:** Dr. {doctor['name']} ({doctor.get('specialization', 'General Physician')})")
+            st.write(f"**Fee:** ${doctor.get('consultation_fee', 'N/A')}")
+            if slot:
+                st.write(f"**Appointment:** {slot.strftime('%A %d %B, %H:%M')}")
+            
+            symptoms = st.text_area("Describe Your Symptoms", placeholder="Please describe your symptoms in detail...", height=100)
+            medical_history = st.text_area("Medical History (Optional)")
+            allergies = st.text_area("Allergies (Optional)")
+            
+            submitted = st.form_submit_button("Submit Consultation Request")
+            
+            if submitted:
+                if not symptoms:
+                    st.error("Please describe your symptoms")
+                else:
+                    consultation_data = {
+                        "patient_id": user_id,
+                        "patient_name": st.session_state.user_name,
+                        "doctor_id": doctor["_id"],
+                        "doctor_name": doctor["name"],
+                        "doctor_specialization": doctor.get("specialization"),
+                        "symptoms": symptoms,
+                        "medical_history": medical_history.split(',') if medical_history else [],
+                        "allergies": allergies.split(',') if allergies else [],
+                        "consultation_fee": doctor.get("consultation_fee"),
+                        "status": "pending",
+                        "created_at": datetime.utcnow(),
+                        "updated_at": datetime.utcnow()
+                    }
+                    
+                    # Same key for a double-click or rerun of this booking, so only one insert happens
+                    key = idempotency_key(f"quick_consultation_{doctor['_id']}", slot, symptoms, medical_history, allergies)
+                    if slot:
+                        consultation_id, created = book_consultation_slot(consultation_data, doctor["_id"], slot, key)
+                    else:
+                        consultation_id, created = consultations.create_once(consultation_data, key)
+                    
+                    if not consultation_id:
+                        st.error("That time was just booked by someone else. Please pick another slot.")
+                    elif created:
+                        st.success("✅ Consultation request submitted successfully!")
+                    else:
+                        st.info("This consultation request was already submitted.")
+                    st.session_state.selected_doctor_id = None
+                    st.session_state.selected_slot = None
+
+@st.fragment
+@degraded_on_outage()
+def new_consultation_view(user_id):
+    st.header("🆕 New Consultation")
+    
+    doctors = get_all_doctors()
+    if not doctors:
+        st.info("No doctors available.")
+        return
+    
+    doctor_options = {f"Dr. {doc['name']} ({doc.get('specialization')})": doc for doc in doctors}
+    selected_doctor_label = st.selectbox("Choose a Doctor", list(doctor_options.keys()))
+    selected_doctor = doctor_options[selected_doctor_label]
+    
+    with st.form("consultation_form"):
+        symptoms = st.text_area("Symptoms", placeholder="Describe your symptoms...")
+        submitted = st.form_submit_button("Submit Consultation")
         
-        with st.form("consultation_form"):
-            symptoms = st.text_area("Symptoms", placeholder="Describe your symptoms...")
-            submitted = st.form_submit_button("Submit Consultation")
+        if submitted and symptoms:
+            consultation_data = {
+                "patient_id": user_id,
+                "patient_name": st.session_state.user_name,
+                "doctor_id": selected_doctor["_id"],
+                "doctor_name": selected_doctor['name'],
+                "symptoms": symptoms,
+                "status": "pending",
+                "created_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }
+            key = idempotency_key(f"consultation_form_{selected_doctor['_id']}", symptoms)
+            consultation_id, created = consultations.create_once(consultation_data, key)
             
-            if submitted and symptoms:
-                consultation_data = {
-                    "patient_id": user_id,
-                    "doctor_id": selected_doctor_id,
-                    "doctor_name": selected_doctor['name'],
-                    "symptoms": symptoms,
-                    "status": "pending",
-                    "created_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
-                }
-                consultations_collection.insert_one(consultation_data)
+            if created:
                 st.success("Consultation request submitted!")
+            else:
+                st.info("This consultation request was already submitted.")
+
+@st.fragment
+@degraded_on_outage()
+def consultation_history_view(user_id):
+    st.header("📋 Consultation History")
     
-    elif choice == "Consultation History":
-        st.header("📋 Consultation History")
-        
-        consultations = list(consultations_collection.find({"patient_id": user_id}).sort("created_at", -1))
-        
-        for consult in consultations:
-            with st.expander(f"Consultation with Dr. {consult.get('doctor_name', 'Unknown')} - {consult['created_at'].strftime('%Y-%m-%d')}"):
-                st.write(f"**Symptoms:** {consult['symptoms']}")
-                st.write(f"**Status:** {consult['status']}")
-                st.write(f"**Diagnosis:** {consult.get('diagnosis', 'Not provided yet')}")
+    history = get_consultation_summaries({"patient_id": user_id})
+    
+    for consult in history:
+        expander = st.expander(
+            f"Consultation with Dr. {consult.get('doctor_name', 'Unknown')} - {consult['created_at'].strftime('%Y-%m-%d')}",
+            key=f"history_{consult['_id']}",
+            on_change="rerun"
+        )
+        with expander:
+            st.write(f"**Status:** {consult['status']}")
+            if consult.get("appointment_start"):
+                st.write(f"**Appointment:** {consult['appointment_start'].strftime('%A %d %B, %H:%M')}")
+            
+            # Clinical fields are only fetched for the row the patient opened
+            if expander.open:
+                detail = get_consultation_detail(consult["_id"], user_id)
+                audit_access("view_consultation", user_id, consultation_id=consult["_id"])
+                if detail:
+                    st.write(f"**Symptoms:** {detail['symptoms']}")
+                    st.write(f"**Diagnosis:** {detail.get('diagnosis', 'Not provided yet')}")
 
 def doctor_dashboard():
     st.title("👨‍⚕️ Doctor Dashboard")
     
     user_id = st.session_state.user_id
-    consultations_collection = db[CONSULTATIONS_COLLECTION]
     
-    # Get pending consultations
-    pending_consultations = list(consultations_collection.find({
-        "doctor_id": user_id,
-        "status": "pending"
-    }))
+    pending_counter(user_id)
+    
+    # Served from the shared cache until one of this doctor's consultations changes
+    pending_consultations = get_pending_consultations(user_id)
     
-    st.header(f"🆕 Pending Consultations ({len(pending_consultations)})")
+    # Completions of consultations that have left the queue no longer need remembering
+    if "completed_consultations" in st.session_state:
+        st.session_state.completed_consultations &= {consult["_id"] for consult in pending_consultations}
     
     for consult in pending_consultations:
-        patient = get_user_by_id(consult["patient_id"])
-        with st.expander(f"Consultation from {patient['name']}"):
-            st.write(f"**Symptoms:** {consult['symptoms']}")
-            
-            with st.form(key=f"response_{consult['_id']}"):
-                diagnosis = st.text_area("Diagnosis")
-                prescription = st.text_area("Prescription")
-                
-                if st.form_submit_button("Complete Consultation"):
-                    consultations_collection.update_one(
-                        {"_id": consult["_id"]},
-                        {"$set": {
-                            "diagnosis": diagnosis,
-                            "prescription": prescription,
-                            "status": "completed",
-                            "updated_at": datetime.utcnow()
-                        }}
-                    )
-                    st.success("Consultation completed!")
-                    st.rerun()
+        # One keyed fragment per consultation so a submit reruns only this form and the counter.
+        # Fragments keep their arguments for the session, so they get ids and the score, not documents.
+        st.fragment(consultation_response, key=f"consultation_{consult['_id']}")(
+            consult["_id"], consult["patient_id"], consult.get("triage_score"))
+
+@st.fragment(key="pending_counter")
+@degraded_on_outage()
+def pending_counter(doctor_id):
+    pending_count = count_pending_consultations(doctor_id)
+    st.header(f"🆕 Pending Consultations ({pending_count})")
+
+@degraded_on_outage()
+def consultation_response(consult_id, patient_id, triage_score):
+    patient = get_user_profile(patient_id)
+    
+    if consult_id in st.session_state.get("completed_consultations", set()):
+        st.success(f"Consultation from {patient['name']} completed!")
+        return
+    
+    expander = st.expander(f"{priority_label(triage_score)} · Consultation from {patient['name']}",
+                           key=f"response_{consult_id}", on_change="rerun")
+    with expander:
+        # Clinical detail is loaded, and its access audited, only for the request the doctor opened
+        if not expander.open:
+            keep_drafts(consult_id)
+            return
+        consult = get_consultation_detail(consult_id, patient_id)
+        audit_access("view_consultation", patient_id, consultation_id=consult_id)
+        if consult.get("appointment_start"):
+            st.write(f"**Appointment:** {consult['appointment_start'].strftime('%A %d %B, %H:%M')}")
+        st.write(f"**Symptoms:** {consult['symptoms']}")
+        triage_summary(consult)
+        consultation_thread_summary(consult)
+        patient_record_summary(patient_id)
+        
+        # Not a form: each field reaches the server as it is edited, rerunning only this
+        # fragment, so the draft is checkpointed and survives a move to another replica
+        st.text_area("Diagnosis", key=f"diagnosis_{consult_id}", on_change=checkpoint_session)
+        st.text_area("Prescription", key=f"prescription_{consult_id}", on_change=checkpoint_session)
+        prescription_warnings(consult)
+        
+        st.button(
+            "Complete Consultation",
+            key=f"complete_{consult_id}",
+            on_click=complete_consultation,
+            args=(consult_id,)
+        )
+
+@degraded_on_outage()
+def complete_consultation(consult_id):
+    """Button callback: persist the response, then rerun only this consultation and the counter"""
+    consultations.update(consult_id, {
+        "diagnosis": st.session_state[f"diagnosis_{consult_id}"],
+        "prescription": st.session_state[f"prescription_{consult_id}"],
+        "status": "completed",
+        "updated_at": datetime.utcnow()
+    })
+    st.session_state.setdefault("completed_consultations", set()).add(consult_id)
+    st.rerun([f"consultation_{consult_id}", "pending_counter"])
 
 def admin_dashboard():
     st.title("🔧 Admin Dashboard")
     
-    users_collection = db[USERS_COLLECTION]
-    consultations_collection = db[CONSULTATIONS_COLLECTION]
+    # Sidebar navigation
+    choice = st.sidebar.selectbox("Navigation", ["Overview", "Audit Log"], key="navigation")
+    if choice == "Audit Log":
+        audit_log_dashboard()
+        return
     
     # Statistics
-    total_users = users_collection.count_documents({})
-    total_patients = users_collection.count_documents({"user_type": "patient"})
-    total_doctors = users_collection.count_documents({"user_type": "doctor"})
-    total_consultations = consultations_collection.count_documents({})
+    total_users = users.count()
+    total_patients = users.count("patient")
+    total_doctors = users.count("doctor")
+    total_consultations = consultations.count()
     
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("Total Users", total_users)
@@ -356,10 +327,35 @@ def admin_dashboard():
     col4.metric("Consultations", total_consultations)
     
     st.subheader("User Management")
-    users = list(users_collection.find({}, {"password": 0}))
+    all_users = users.list_all({"password": 0})
     
-    for user in users:
+    for user in all_users:
         st.write(f"**{user['name']}** ({user['user_type']}) - {user['email']}")
+    
+    # Lab staff cannot register themselves; their accounts are created here
+    st.subheader("Create Lab Account")
+    with st.form("lab_account_form", clear_on_submit=True):
+        name = st.text_input("Lab Name")
+        email = st.text_input("Email")
+        password = st.text_input("Password", type="password")
+        phone = st.text_input("Phone Number")
+        
+        if st.form_submit_button("Create Lab Account"):
+            if not all([name, email, password]):
+                st.error("Please fill all required fields")
+            elif not submit_task("create_lab_account", register_user, name, email, password,
+                                 USER_TYPE_LAB, phone=phone):
+                st.error("The server is busy. Please try again in a moment.")
+    
+    created = task_outcome("create_lab_account", "Creating the lab account...")
+    if created and created.status == "done":
+        success, message = created.result
+        if success:
+            st.success("Lab account created")
+        else:
+            st.error(message)
+    elif created and created.status == "failed":
+        st.error("The lab account could not be created. Please try again.")
 
 # =============================================
 # MAIN APPLICATION
@@ -368,10 +364,12 @@ def admin_dashboard():
 def main():
     # Initialize session state
     if 'logged_in' not in st.session_state:
-        st.session_state.logged_in = False
-        st.session_state.user_id = None
-        st.session_state.user_type = None
-        st.session_state.user_name = None
+        # A reconnect that landed on another replica resumes from the shared checkpoint. Restored
+        # before the defaults are set, so a run that fails on a database outage tries again
+        restore_session()
+        st.session_state.setdefault("logged_in", False)
+        for key in ("user_id", "user_type", "user_name"):
+            st.session_state.setdefault(key, None)
     
     # Setup database (creates admin user if needed)
     setup_database()
@@ -388,7 +386,7 @@ def main():
             with st.form("login_form"):
                 email = st.text_input("Email")
                 password = st.text_input("Password", type="password")
-                user_type = st.selectbox("Login as", ["Patient", "Doctor", "Admin"])
+                user_type = st.selectbox("Login as", ["Patient", "Doctor", "Lab", "Admin"])
                 submitted = st.form_submit_button("Login")
                 
                 if submitted:
@@ -398,6 +396,7 @@ def main():
                         st.session_state.user_id = user["_id"]
                         st.session_state.user_type = user["user_type"]
                         st.session_state.user_name = user["name"]
+                        start_session()
                         st.success(f"Welcome back, {user['name']}!")
                         st.rerun()
                     else:
@@ -405,6 +404,7 @@ def main():
         
         with tab2:
             with st.form("register_form"):
+                # Lab accounts are created by an admin (see admin_dashboard)
                 user_type = st.selectbox("Register as", ["Patient", "Doctor"])
                 name = st.text_input("Full Name")
                 email = st.text_input("Email")
@@ -421,17 +421,27 @@ def main():
                     if user_type == "Doctor":
                         additional_fields["specialization"] = specialization
                     
-                    success, message = register_user(name, email, password, user_type.lower(), **additional_fields)
-                    if success:
-                        st.success(message)
-                    else:
-                        st.error(message)
+                    # Password hashing runs on the shared pool so this script thread is not held
+                    if not submit_task("register", register_user, name, email, password,
+                                       user_type.lower(), **additional_fields):
+                        st.error("The server is busy. Please try again in a moment.")
+            
+            registration = task_outcome("register", "Creating your account...")
+            if registration and registration.status == "done":
+                success, message = registration.result
+                if success:
+                    st.success(message)
+                else:
+                    st.error(message)
+            elif registration and registration.status == "failed":
+                st.error("Registration failed. Please try again.")
     else:
         # User is logged in - show dashboard
         st.sidebar.title(f"Welcome, {st.session_state.user_name}!")
         st.sidebar.write(f"Role: {st.session_state.user_type.title()}")
         
         if st.sidebar.button("🚪 Logout"):
+            end_session()
             st.session_state.logged_in = False
             st.session_state.user_id = None
             st.session_state.user_type = None
@@ -443,8 +453,13 @@ def main():
             patient_dashboard()
         elif st.session_state.user_type == "doctor":
             doctor_dashboard()
+        elif st.session_state.user_type == "lab":
+            lab_dashboard()
         elif st.session_state.user_type == "admin":
             admin_dashboard()
+    
+    checkpoint_session()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with script_run(), degraded_on_outage(recover=True):
+        main()
\ No newline at end of file
@@ -0,0 +1,165 @@
+# metrics/__init__.py
+import threading
+from contextlib import contextmanager
+
+# Served as Prometheus text on the health port (GET /metrics) and used by the
+# custom-metrics HPA (k8s/web-hpa-custom-metrics.yaml) through prometheus-adapter
+
+class InFlight:
+    """Thread-safe count of operations in progress"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.value += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.value -= 1
+
+# bcrypt hashes and checks running in this process (login, registration, seeding)
+HASHING = InFlight()
+
+# Background tasks whose work is a password hash; counted while they wait for a worker
+HASHING_TASKS = ("register", "create_lab_account")
+
+# =============================================
+# GAUGES
+# =============================================
+
+def active_sessions():
+    """Browser sessions connected to this replica"""
+    from streamlit import runtime
+    if not runtime.exists():
+        return 0
+    return runtime.get_instance()._session_mgr.num_active_sessions()
+
+def inflight_reruns():
+    """Script runs in progress, full and fragment reruns"""
+    from streamlit import runtime
+    # The runtime marks a session running for fragment runs too; without one
+    # (tests, benchmarks) only full runs, recorded by startup.script_run(), are seen
+    if not runtime.exists():
+        from startup import ACTIVE_RUNS
+        return len(ACTIVE_RUNS)
+    from streamlit.runtime.app_session import AppSessionState
+    return sum(info.session._state == AppSessionState.APP_IS_RUNNING
+               for info in runtime.get_instance()._session_mgr.list_active_sessions())
+
+def hashing_queue_depth():
+    """Password hashes running plus registrations queued behind them"""
+    from utils import get_task_executor
+    executor = get_task_executor()
+    return HASHING.value + sum(executor.queued(name) for name in HASHING_TASKS)
+
+GAUGES = {
+    "mediconsult_active_sessions": active_sessions,
+    "mediconsult_inflight_reruns": inflight_reruns,
+    "mediconsult_hashing_queue_depth": hashing_queue_depth
+}
+
+# =============================================
+# USER CACHE
+# =============================================
+
+# For dashboards and alerts rather than scaling, so kept out of GAUGES (the HPA's inputs)
+
+def _user_cache():
+    from database import users
+    return users.cache
+
+def user_cache_hits():
+    """User profile lookups served from this process's cache"""
+    return _user_cache().stats["hits"]
+
+def user_cache_misses():
+    """User profile lookups that read Mongo"""
+    return _user_cache().stats["misses"]
+
+def user_cache_evictions():
+    """Cached user profiles evicted to stay within USER_CACHE_SIZE"""
+    return _user_cache().stats["evictions"]
+
+def user_cache_entries():
+    """User profiles cached in this process"""
+    return len(_user_cache())
+
+CACHE_METRICS = {
+    "mediconsult_user_cache_hits_total": user_cache_hits,
+    "mediconsult_user_cache_misses_total": user_cache_misses,
+    "mediconsult_user_cache_evictions_total": user_cache_evictions,
+    "mediconsult_user_cache_entries": user_cache_entries
+}
+
+# Everything served on GET /metrics
+EXPORTED = {**GAUGES, **CACHE_METRICS}
+
+# =============================================
+# SESSION MEMORY
+# =============================================
+
+GIB = 1024 ** 3
+
+def session_state_bytes(session_state):
+    """{key: bytes} held by one session's state, widget values included (deep size)"""
+    from streamlit.runtime.stats import safe_sizeof
+    return {key: safe_sizeof(value) for key, value in session_state.filtered_state.items()}
+
+def session_report(sessions=None, top_keys=5):
+    """Bytes held by each connected session and how many such sessions fit in a GiB.
+    
+    sessions is {label: session state}; by default every active session of
+    the running server, numbered. Sizing walks each session's objects, so this is served
+    on request (GET /sessions) rather than with every metrics scrape.
+    """
+    if sessions is None:
+        sessions = _active_session_states()
+    report = []
+    for label, session_state in sessions.items():
+        sizes = session_state_bytes(session_state)
+        report.append({
+            "session": label,
+            "bytes": sum(sizes.values()),
+            "keys": len(sizes),
+            "largest": dict(sorted(sizes.items(), key=lambda item: -item[1])[:top_keys])
+        })
+    report.sort(key=lambda session: -session["bytes"])
+    total = sum(session["bytes"] for session in report)
+    mean = total / len(report) if report else 0
+    return {
+        "sessions": len(report),
+        "total_bytes": total,
+        "mean_bytes": round(mean),
+        # Session state only: leaves out the process baseline and shared caches
+        "sessions_per_gib": int(GIB // mean) if mean else None,
+        "by_session": report
+    }
+
+def _active_session_states():
+    from streamlit import runtime
+    if not runtime.exists():
+        return {}
+    # Numbered, not keyed by session id: an id is enough to reattach to a session
+    return {str(number): info.session.session_state
+            for number, info in enumerate(runtime.get_instance()._session_mgr.list_active_sessions(), 1)}
+
+def collect(gauges=GAUGES):
+    """{metric name: current value}"""
+    return {name: gauge() for name, gauge in gauges.items()}
+
+def render(values, gauges=GAUGES):
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for name, value in values.items():
+        description = getattr(gauges.get(name), "__doc__", None)
+        if description:
+            lines.append(f"# HELP {name} {description}")
+        # Prometheus naming: cumulative counts end in _total
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,268 @@
+# migrations/__init__.py
+from pymongo import ASCENDING
+
+from config import MIGRATION_BATCH_SIZE
+from database import consultations as default_consultations
+from encryption import ENCRYPTED_FIELDS
+from vocabulary import CLINICAL_TERM_FIELDS, normalize_terms
+
+# One-off data migrations, run by hand or from a deploy job (see migrations/run.py).
+# Each takes dry_run and returns counts, and is safe to run again.
+
+# =============================================
+# FOLLOW-UP THREADS
+# =============================================
+
+# Re-consultations used to be stored as "Follow-up: {previous symptoms}\nNew: {new text}"
+FOLLOW_UP_PREFIX = "Follow-up: "
+FOLLOW_UP_SEPARATOR = "\nNew: "
+LEGACY_FOLLOW_UP_QUERY = {
+    "symptoms": {"$regex": "^Follow-up: "},
+    "parent_consultation_id": {"$exists": False}
+}
+
+def split_follow_up(symptoms, known):
+    """(previous text, new text) of a concatenated follow-up whose previous text is in known, or None.
+    
+    The new text may itself contain the separator, so every split is tried,
+    longest previous text first.
+    """
+    if not symptoms.startswith(FOLLOW_UP_PREFIX):
+        return None
+    body = symptoms[len(FOLLOW_UP_PREFIX):]
+    end = body.rfind(FOLLOW_UP_SEPARATOR)
+    while end != -1:
+        previous = body[:end]
+        if previous in known:
+            return previous, body[end + len(FOLLOW_UP_SEPARATOR):]
+        end = body.rfind(FOLLOW_UP_SEPARATOR, 0, end)
+    return None
+
+def migrate_follow_up_threads(dry_run=False, consultations=None):
+    """Link concatenated follow-ups to the consultation they continue and keep only their new text.
+    
+    The parent is the latest earlier consultation of the same patient and doctor
+    whose symptoms, as originally stored, are the follow-up's previous text;
+    follow-ups of follow-ups join the thread of the first consultation. Records
+    with no such parent are left as they are and counted as unmatched.
+    
+    Legacy follow-ups are found by a regex on symptoms, so run this before
+    field_encryption encrypts them.
+    """
+    consultations = consultations or default_consultations
+    counts = {"patients": 0, "split": 0, "unmatched": 0}
+    for patient_id in consultations.collection.distinct("patient_id", LEGACY_FOLLOW_UP_QUERY):
+        counts["patients"] += 1
+        history = consultations.find(
+            {"patient_id": patient_id},
+            {"_id": 1, "doctor_id": 1, "symptoms": 1, "parent_consultation_id": 1, "thread_root_id": 1},
+            newest_first=False
+        )
+        originals = {}  # _id -> symptoms as stored before any split
+        roots = {}
+        latest = {}  # (doctor_id, original symptoms) -> latest consultation _id with them
+        for consult in history:
+            consult_id = consult["_id"]
+            parent_id = consult.get("parent_consultation_id")
+            if parent_id in originals:
+                # Already linked (a new follow-up, or split by an earlier run)
+                original = f"{FOLLOW_UP_PREFIX}{originals[parent_id]}{FOLLOW_UP_SEPARATOR}{consult['symptoms']}"
+                roots[consult_id] = consult.get("thread_root_id") or roots[parent_id]
+            else:
+                original = consult["symptoms"]
+                roots[consult_id] = consult.get("thread_root_id") or consult_id
+                if parent_id is None and original.startswith(FOLLOW_UP_PREFIX):
+                    known = {text for doctor_id, text in latest if doctor_id == consult["doctor_id"]}
+                    split = split_follow_up(original, known)
+                    if split is None:
+                        counts["unmatched"] += 1
+                    else:
+                        previous, new_text = split
+                        parent_id = latest[(consult["doctor_id"], previous)]
+                        roots[consult_id] = roots[parent_id]
+                        counts["split"] += 1
+                        if not dry_run:
+                            consultations.collection.update_one(
+                                {"_id": consult_id, "parent_consultation_id": {"$exists": False}},
+                                {"$set": {**consultations.encrypt_fields(patient_id, {"symptoms": new_text}),
+                                          "parent_consultation_id": parent_id,
+                                          "thread_root_id": roots[parent_id]}}
+                            )
+            originals[consult_id] = original
+            latest[(consult["doctor_id"], original)] = consult_id
+    return counts
+
+# =============================================
+# CLINICAL TERMS
+# =============================================
+
+def migrate_clinical_terms(dry_run=False, batch_size=MIGRATION_BATCH_SIZE, consultations=None):
+    """Normalize the allergies and medical history of existing consultations.
+    
+    Consultations are read batch_size at a time in _id order, so the migration
+    holds one batch in memory and can run while the app serves traffic. The
+    records of patients whose terms changed are then rebuilt.
+    """
+    consultations = consultations or default_consultations
+    counts = {"scanned": 0, "normalized": 0, "batches": 0, "records_rebuilt": 0}
+    projection = {"patient_id": 1, **{field: 1 for field in CLINICAL_TERM_FIELDS}}
+    patients = set()
+    last_id = None
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        batch = list(consultations.collection.find(query, projection).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        counts["batches"] += 1
+        for consult in batch:
+            counts["scanned"] += 1
+            normalized = {field: normalize_terms(consult[field], field)
+                          for field in CLINICAL_TERM_FIELDS if field in consult}
+            if all(normalized[field] == consult[field] for field in normalized):
+                continue
+            counts["normalized"] += 1
+            if consult.get("patient_id") is not None:
+                patients.add(consult["patient_id"])
+            if not dry_run:
+                consultations.collection.update_one({"_id": consult["_id"]}, {"$set": normalized})
+        last_id = batch[-1]["_id"]
+    
+    counts["records_rebuilt"] = len(patients)
+    if not dry_run:
+        for patient_id in patients:
+            consultations.records.rebuild(patient_id, consultations.find({"patient_id": patient_id},
+                                                                         newest_first=False))
+    return counts
+
+# =============================================
+# LAB REQUESTS
+# =============================================
+
+def migrate_lab_requests(dry_run=False, batch_size=MIGRATION_BATCH_SIZE, consultations=None):
+    """Create lab_requests documents, as requested, for the lab_requests strings of existing consultations.
+    
+    Reads batch_size consultations at a time in _id order; tests that already
+    have a request are left as they are, so the migration can be run again.
+    """
+    consultations = consultations or default_consultations
+    counts = {"consultations": 0, "requests": 0, "batches": 0}
+    query = {"lab_requests.0": {"$exists": True}}
+    projection = {"patient_id": 1, "doctor_id": 1, "lab_requests": 1, "created_at": 1, "updated_at": 1}
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        batch = list(consultations.collection.find(batch_query, projection).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        counts["batches"] += 1
+        for consult in batch:
+            counts["consultations"] += 1
+            if dry_run:
+                tests = {test.strip() for test in consult["lab_requests"] if test and test.strip()}
+                existing = consultations.lab_requests.collection.count_documents(
+                    {"consultation_id": consult["_id"], "test": {"$in": list(tests)}})
+                counts["requests"] += len(tests) - existing
+            else:
+                counts["requests"] += consultations.lab_requests.sync(
+                    consult, consult["lab_requests"], now=consult.get("updated_at") or consult.get("created_at"))
+        last_id = batch[-1]["_id"]
+    return counts
+
+# =============================================
+# FIELD ENCRYPTION
+# =============================================
+
+def migrate_field_encryption(dry_run=False, batch_size=MIGRATION_BATCH_SIZE, consultations=None):
+    """Encrypt the clinical text of consultations stored before field encryption.
+    
+    Reads batch_size consultations at a time in _id order. Each write only
+    applies while the fields still hold the plaintext that was read, so an edit
+    made meanwhile is kept (and was encrypted by the repository). Records of
+    the patients concerned are rebuilt, which encrypts their copies of
+    diagnoses and prescriptions.
+    """
+    consultations = consultations or default_consultations
+    if consultations.cipher is None:
+        raise ValueError("consultations has no cipher to encrypt with")
+    counts = {"scanned": 0, "encrypted": 0, "batches": 0, "records_rebuilt": 0}
+    projection = {"patient_id": 1, **{field: 1 for field in ENCRYPTED_FIELDS}}
+    patients = set()
+    last_id = None
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        batch = list(consultations.collection.find(query, projection).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        counts["batches"] += 1
+        for consult in batch:
+            counts["scanned"] += 1
+            plaintext = {field: consult[field] for field in ENCRYPTED_FIELDS
+                         if isinstance(consult.get(field), str) and consult[field]}
+            if not plaintext or consult.get("patient_id") is None:
+                continue
+            counts["encrypted"] += 1
+            patients.add(consult["patient_id"])
+            if not dry_run:
+                consultations.collection.update_one(
+                    {"_id": consult["_id"], **plaintext},
+                    {"$set": consultations.encrypt_fields(consult["patient_id"], plaintext)}
+                )
+        last_id = batch[-1]["_id"]
+    
+    counts["records_rebuilt"] = len(patients)
+    if not dry_run:
+        for patient_id in patients:
+            consultations.records.rebuild(patient_id, consultations.find({"patient_id": patient_id},
+                                                                         newest_first=False))
+    return counts
+
+# =============================================
+# TRIAGE PRIORITY
+# =============================================
+
+# Replaced by (doctor_id, status, triage_due_at), which serves the same queries
+LEGACY_QUEUE_INDEX = "doctor_id_1_status_1"
+
+def migrate_triage_priority(dry_run=False, batch_size=MIGRATION_BATCH_SIZE, consultations=None):
+    """Score consultations stored before triage, so the pending queue orders them with the rest.
+    
+    Reads batch_size unscored consultations at a time in _id order and scores
+    each from its (decrypted) symptoms, its patient's age and whether it is a
+    follow-up, aged from its created_at. Then drops the old
+    (doctor_id, status) index, a prefix of the new queue index.
+    """
+    consultations = consultations or default_consultations
+    counts = {"scored": 0, "batches": 0, "legacy_index_dropped": 0}
+    query = {"triage_score": {"$exists": False}}
+    projection = {"patient_id": 1, "patient_age": 1, "symptoms": 1, "created_at": 1, "parent_consultation_id": 1}
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        batch = list(consultations.collection.find(batch_query, projection).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        counts["batches"] += 1
+        for consult in batch:
+            counts["scored"] += 1
+            if not dry_run:
+                scored = consultations.with_triage(consultations.decrypt_fields(consult))
+                consultations.collection.update_one(
+                    {"_id": consult["_id"], **query},
+                    {"$set": {"triage_score": scored["triage_score"], "triage_due_at": scored["triage_due_at"]}}
+                )
+        last_id = batch[-1]["_id"]
+    
+    if LEGACY_QUEUE_INDEX in consultations.collection.index_information():
+        counts["legacy_index_dropped"] = 1
+        if not dry_run:
+            consultations.collection.drop_index(LEGACY_QUEUE_INDEX)
+    return counts
+
+# Name -> migration, as given to python -m migrations.run
+MIGRATIONS = {
+    "follow_up_threads": migrate_follow_up_threads,
+    "clinical_terms": migrate_clinical_terms,
+    "lab_requests": migrate_lab_requests,
+    "field_encryption": migrate_field_encryption,
+    "triage_priority": migrate_triage_priority
+}
@@ -0,0 +1,36 @@
+# migrations/run.py
+"""
+Run a data migration against the configured database.
+
+Usage:
+    python -m migrations.run follow_up_threads --dry-run
+    python -m migrations.run follow_up_threads
+    python -m migrations.run clinical_terms --batch-size 1000
+    python -m migrations.run field_encryption
+    python -m migrations.run triage_priority
+"""
+import argparse
+
+from database import ensure_indexes, generations
+from migrations import MIGRATIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a MediConsult data migration")
+    parser.add_argument("name", choices=sorted(MIGRATIONS))
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--batch-size", type=int, help="for batched migrations (default MIGRATION_BATCH_SIZE)")
+    args = parser.parse_args()
+
+    ensure_indexes()
+    options = {"batch_size": args.batch_size} if args.batch_size else {}
+    counts = MIGRATIONS[args.name](dry_run=args.dry_run, **options)
+    if not args.dry_run:
+        # Migrations write to the collections directly; cached views on every replica are stale
+        generations.bump_all()
+    print(f"{args.name}{' (dry run)' if args.dry_run else ''}: "
+          + ", ".join(f"{key}={value}" for key, value in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
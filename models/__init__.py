@@ -35,10 +35,13 @@ class User:
 class Consultation:
     def __init__(self, patient_id, doctor_id, symptoms, medical_history=None, 
                  allergies=None, status="pending", diagnosis=None, prescription=None, 
-                 lab_requests=None, consultation_notes=None, lab_reports=None):
+                 lab_requests=None, consultation_notes=None, lab_reports=None,
+                 parent_consultation_id=None, thread_root_id=None, patient_age=None):
         self.patient_id = patient_id
         self.doctor_id = doctor_id
         self.symptoms = symptoms
+        # Age given on the consultation form, scored by triage
+        self.patient_age = patient_age
         self.medical_history = medical_history or []
         self.allergies = allergies or []
         self.status = status  # pending, in_progress, completed
@@ -47,14 +50,18 @@ class Consultation:
         self.lab_requests = lab_requests or []
         self.consultation_notes = consultation_notes
         self.lab_reports = lab_reports or []
+        # Follow-ups point at the consultation they continue and at the first one of the thread
+        self.parent_consultation_id = parent_consultation_id
+        self.thread_root_id = thread_root_id
         self.created_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
     
     def to_dict(self):
-        return {
+        data = {
             "patient_id": self.patient_id,
             "doctor_id": self.doctor_id,
             "symptoms": self.symptoms,
+            "patient_age": self.patient_age,
             "medical_history": self.medical_history,
             "allergies": self.allergies,
             "status": self.status,
@@ -66,10 +73,15 @@ class Consultation:
             "created_at": self.created_at,
             "updated_at": self.updated_at
         }
+        # Only follow-ups carry the thread fields, so the thread indexes cover just them
+        if self.parent_consultation_id is not None:
+            data["parent_consultation_id"] = self.parent_consultation_id
+            data["thread_root_id"] = self.thread_root_id or self.parent_consultation_id
+        return data
 
 class LabReport:
     def __init__(self, consultation_id, patient_id, doctor_id, report_type, 
-                 report_data, file_path=None, notes=None):
+                 report_data, file_path=None, notes=None, lab_request_id=None):
         self.consultation_id = consultation_id
         self.patient_id = patient_id
         self.doctor_id = doctor_id
@@ -77,6 +89,8 @@ class LabReport:
         self.report_data = report_data
         self.file_path = file_path
         self.notes = notes
+        # The lab request this report answers; None lets the repository link it when unambiguous
+        self.lab_request_id = lab_request_id
         self.created_at = datetime.utcnow()
     
     def to_dict(self):
@@ -88,5 +102,6 @@ class LabReport:
             "report_data": self.report_data,
             "file_path": self.file_path,
             "notes": self.notes,
+            "lab_request_id": self.lab_request_id,
             "created_at": self.created_at
         }
\ No newline at end of file
@@ -0,0 +1,147 @@
+# notifications/__init__.py
+import importlib
+import smtplib
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from config import (NOTIFICATION_TRANSPORT, SMTP_HOST, SMTP_PORT, SMTP_SENDER,
+                    NOTIFICATION_BATCH_SIZE, NOTIFICATION_MAX_ATTEMPTS,
+                    NOTIFICATION_BACKOFF_SECONDS, NOTIFICATION_BACKOFF_MAX_SECONDS)
+
+# =============================================
+# TRANSPORTS
+# =============================================
+
+class DebugTransport:
+    """Prints messages instead of sending them; the default for local development"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, recipient, subject, body):
+        self.sent.append((recipient, subject, body))
+        print(f"📧 To: {recipient} | {subject}\n{body}\n")
+
+class SMTPTransport:
+    """Delivers through an SMTP relay"""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, sender=SMTP_SENDER, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.timeout = timeout
+
+    def send(self, recipient, subject, body):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(message)
+
+TRANSPORTS = {
+    "debug": DebugTransport,
+    "smtp": SMTPTransport
+}
+
+def get_transport(name=NOTIFICATION_TRANSPORT):
+    """Transport by registered name, or any class given as "package.module:ClassName" """
+    if name in TRANSPORTS:
+        return TRANSPORTS[name]()
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+# =============================================
+# MESSAGES
+# =============================================
+
+def describe(message):
+    """One line for a queued notification"""
+    if message["event"] == "consultation_requested":
+        return f"New consultation request from {message.get('patient_name') or 'a patient'}"
+    status = message.get("consultation_status")
+    doctor = f"Dr. {message['doctor_name']}" if message.get("doctor_name") else "Your doctor"
+    return f"{doctor} updated your consultation" + (f" (status: {status})" if status else "")
+
+def render_digest(name, messages):
+    """Subject and body for every notification a recipient has in one batch"""
+    lines = [f"- {describe(message)}" for message in sorted(messages, key=lambda m: m["created_at"])]
+    if len(messages) == 1:
+        subject = f"MediConsult: {describe(messages[0])}"
+    else:
+        subject = f"MediConsult: {len(messages)} consultation updates"
+    body = f"Hello {name or ''},\n\n" + "\n".join(lines) + "\n\nSign in to MediConsult for details."
+    return subject, body
+
+# =============================================
+# WORKER
+# =============================================
+
+def backoff_delay(attempts, base=NOTIFICATION_BACKOFF_SECONDS, cap=NOTIFICATION_BACKOFF_MAX_SECONDS):
+    """Seconds to wait before retry number `attempts` (1, 2, ...)"""
+    return min(base * 2 ** (attempts - 1), cap)
+
+class NotificationWorker:
+    """Drains the outbox: relay from consultations, claim a batch, send one digest per recipient"""
+
+    def __init__(self, outbox, users, transport, batch_size=NOTIFICATION_BATCH_SIZE,
+                 max_attempts=NOTIFICATION_MAX_ATTEMPTS):
+        self.outbox = outbox
+        self.users = users
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+    def run_once(self, now=None):
+        """Process one batch; return {"sent": n, "retried": n, "dead": n} counted in messages"""
+        now = now or datetime.utcnow()
+        stats = {"sent": 0, "retried": 0, "dead": 0}
+        self.outbox.relay(self.batch_size)
+        
+        by_recipient = defaultdict(list)
+        for message in self.outbox.claim(self.batch_size, now=now):
+            by_recipient[message["recipient_id"]].append(message)
+        if not by_recipient:
+            return stats
+        
+        recipients = {
+            user["_id"]: user for user in self.users.collection.find(
+                {"_id": {"$in": list(by_recipient)}}, {"name": 1, "email": 1}
+            )
+        }
+        for recipient_id, messages in by_recipient.items():
+            ids = [message["_id"] for message in messages]
+            user = recipients.get(recipient_id)
+            if not user or not user.get("email"):
+                self.outbox.mark_failed(ids, "recipient has no email address")
+                stats["dead"] += len(ids)
+                continue
+            
+            subject, body = render_digest(user.get("name"), messages)
+            try:
+                self.transport.send(user["email"], subject, body)
+            except Exception as e:
+                # Retry the whole digest together; the most-retried message decides the delay
+                attempts = max(message.get("attempts", 0) for message in messages) + 1
+                if attempts >= self.max_attempts:
+                    self.outbox.mark_failed(ids, e)
+                    stats["dead"] += len(ids)
+                else:
+                    self.outbox.mark_failed(ids, e, now + timedelta(seconds=backoff_delay(attempts)))
+                    stats["retried"] += len(ids)
+                continue
+            self.outbox.mark_sent(ids, now)
+            stats["sent"] += len(ids)
+        return stats
+
+    def run_forever(self, poll_interval=5, stop=None):
+        """Loop until stop (a threading.Event) is set; full batches are drained without sleeping"""
+        while not (stop and stop.is_set()):
+            stats = self.run_once()
+            if sum(stats.values()) < self.batch_size:
+                if stop:
+                    stop.wait(poll_interval)
+                else:
+                    time.sleep(poll_interval)
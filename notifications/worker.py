@@ -0,0 +1,42 @@
+# notifications/worker.py
+"""
+Notification worker: delivers the outbox written by consultation inserts and
+updates, so the Streamlit script thread never waits on SMTP.
+
+Run one or more next to the web app (they share the outbox safely):
+    python -m notifications.worker
+    python -m notifications.worker --once
+"""
+import argparse
+import signal
+import threading
+
+from database import users, outbox, ensure_indexes
+from notifications import NotificationWorker, get_transport
+from config import NOTIFICATION_TRANSPORT, NOTIFICATION_BATCH_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver queued MediConsult notifications")
+    parser.add_argument("--transport", default=NOTIFICATION_TRANSPORT,
+                        help='"debug", "smtp" or a "package.module:ClassName" transport')
+    parser.add_argument("--batch-size", type=int, default=NOTIFICATION_BATCH_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=5, help="seconds to wait when the outbox is empty")
+    parser.add_argument("--once", action="store_true", help="process one batch and exit")
+    args = parser.parse_args()
+
+    ensure_indexes()
+    worker = NotificationWorker(outbox, users, get_transport(args.transport), batch_size=args.batch_size)
+    if args.once:
+        print(worker.run_once())
+        return
+
+    # Finish the batch in flight on SIGTERM (e.g. a rolling deploy) before exiting
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    worker.run_forever(args.poll_interval, stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 # app.py
 import streamlit as st
 from datetime import datetime
-from database.connection import db
-from utils import register_user, authenticate_user, get_user_by_id
+from utils import (register_user, authenticate_user, get_user_by_id, start_session, restore_session,
+                   checkpoint_session, end_session, degraded_on_outage)
 from config import USERS_COLLECTION, USER_TYPE_PATIENT, USER_TYPE_DOCTOR, SPECIALIZATIONS
 
 # Page configuration
@@ -15,10 +15,11 @@ st.set_page_config(
 
 def main():
     if 'logged_in' not in st.session_state:
-        st.session_state.logged_in = False
-        st.session_state.user_id = None
-        st.session_state.user_type = None
-        st.session_state.user_name = None
+        # Before the defaults, so a run that fails on a database outage tries again
+        restore_session()
+        st.session_state.setdefault("logged_in", False)
+        for key in ("user_id", "user_type", "user_name"):
+            st.session_state.setdefault(key, None)
     
     # Custom CSS
     st.markdown("""
@@ -45,6 +46,8 @@ def main():
         show_login_register()
     else:
         show_dashboard()
+    
+    checkpoint_session()
 
 def show_login_register():
     tab1, tab2, tab3 = st.tabs(["🔐 Login", "📝 Register", "ℹ️ About"])
@@ -55,7 +58,7 @@ def show_login_register():
         with st.form("login_form"):
             email = st.text_input("Email")
             password = st.text_input("Password", type="password")
-            user_type = st.selectbox("Login as", ["Patient", "Doctor", "Admin"])
+            user_type = st.selectbox("Login as", ["Patient", "Doctor", "Lab", "Admin"])
             
             submitted = st.form_submit_button("Login")
             
@@ -67,6 +70,7 @@ def show_login_register():
                         st.session_state.user_id = user["_id"]
                         st.session_state.user_type = user["user_type"]
                         st.session_state.user_name = user["name"]
+                        start_session()
                         st.success(f"Welcome back, {user['name']}!")
                         st.rerun()
                     else:
@@ -78,6 +82,7 @@ def show_login_register():
         st.header("Register")
         
         with st.form("register_form"):
+            # Lab accounts are created by an admin
             user_type = st.selectbox("Register as", ["Patient", "Doctor"])
             name = st.text_input("Full Name")
             email = st.text_input("Email")
@@ -164,6 +169,7 @@ def show_dashboard():
         st.write(f"Role: {st.session_state.user_type.title()}")
         
         if st.button("🚪 Logout"):
+            end_session()
             st.session_state.logged_in = False
             st.session_state.user_id = None
             st.session_state.user_type = None
@@ -177,9 +183,13 @@ def show_dashboard():
     elif st.session_state.user_type == "doctor":
         from pages.doctor_dashboard import doctor_dashboard
         doctor_dashboard()
+    elif st.session_state.user_type == "lab":
+        from pages.lab_dashboard import lab_dashboard
+        lab_dashboard()
     elif st.session_state.user_type == "admin":
         from pages.admin_dashboard import admin_dashboard
         admin_dashboard()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with degraded_on_outage(recover=True):
+        main()
\ No newline at end of file
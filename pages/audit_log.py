@@ -0,0 +1,51 @@
+# pages/audit_log.py
+import streamlit as st
+from datetime import datetime, time, timedelta
+from database import users, audit_log
+from config import USER_TYPE_ADMIN, USER_TYPE_PATIENT
+from utils import get_user_profile, get_audit_logger
+
+def audit_log_dashboard():
+    st.header("🔍 PHI Access Log")
+    
+    if st.session_state.user_type != USER_TYPE_ADMIN:
+        st.error("Access denied. Administrators only.")
+        return
+    
+    patients = {str(p["_id"]): p for p in users.list_by_type(USER_TYPE_PATIENT, {"password": 0})}
+    actors = {str(u["_id"]): u for u in users.list_all({"password": 0})}
+    
+    col1, col2, col3 = st.columns(3)
+    patient_id = col1.selectbox("Patient", [None, *patients], key="audit_patient",
+                                format_func=lambda key: "Any patient" if key is None else patients[key]["name"])
+    actor_id = col2.selectbox("Accessed by", [None, *actors], key="audit_actor",
+                              format_func=lambda key: "Anyone" if key is None else
+                              f"{actors[key]['name']} ({actors[key]['user_type']})")
+    since = col3.date_input("Since", datetime.utcnow().date() - timedelta(days=7), key="audit_since")
+    
+    # Events still in this process's buffer are written first so the page is current
+    get_audit_logger().flush()
+    events = audit_log.find(
+        patient_id=patients[patient_id]["_id"] if patient_id else None,
+        actor_id=actors[actor_id]["_id"] if actor_id else None,
+        since=datetime.combine(since, time.min)
+    )
+    if not events:
+        st.info("No access recorded for this selection.")
+        return
+    
+    rows = []
+    for event in events:
+        patient = get_user_profile(event["meta"]["patient_id"]) or {}
+        actor = get_user_profile(event["meta"]["actor_id"]) if event["meta"].get("actor_id") else None
+        rows.append({
+            "At": event["at"].strftime("%Y-%m-%d %H:%M:%S"),
+            "Patient": patient.get("name", "Unknown"),
+            "Accessed by": actor["name"] if actor else "Unknown",
+            "Role": event.get("actor_type"),
+            "Action": event["action"],
+            "Consultation": str(event.get("consultation_id", "")),
+            "Lab request": str(event.get("lab_request_id", ""))
+        })
+    st.dataframe(rows, hide_index=True)
+    st.caption(f"{len(events)} most recent events, newest first.")
@@ -1,9 +1,20 @@
 # pages/doctor_dashboard.py
 import streamlit as st
 from datetime import datetime
-from database.connection import db
-from config import CONSULTATIONS_COLLECTION
-from utils import get_user_by_id
+from database import consultations, lab_requests
+from vocabulary import canonical_terms
+from triage import priority_label
+from utils import (get_user_profile, get_consultation_summaries, get_consultation_detail, checkpoint_session,
+                   patient_record_summary, consultation_thread_summary, prescription_warnings,
+                   audit_access, get_pending_consultations, count_pending_consultations, degraded_on_outage,
+                   triage_summary, keep_drafts)
+
+# Notes a bulk action can add; {patient_name} is filled in per consultation
+BULK_NOTE_TEMPLATES = {
+    "Reviewed, no action needed": "Dear {patient_name}, your doctor has reviewed your request. No action is needed.",
+    "Book a follow-up": "Dear {patient_name}, please book a follow-up consultation so we can review your symptoms.",
+    "Lab tests requested": "Dear {patient_name}, lab tests have been requested. Your doctor will review the results."
+}
 
 def doctor_dashboard():
     st.title("👨‍⚕️ Doctor Dashboard")
@@ -17,89 +28,57 @@ def doctor_dashboard():
     
     # Sidebar navigation
     menu = ["New Consultations", "Patient History", "My Consultations"]
-    choice = st.sidebar.selectbox("Navigation", menu)
-    
-    consultations_collection = db.get_collection(CONSULTATIONS_COLLECTION)
+    choice = st.sidebar.selectbox("Navigation", menu, key="navigation")
     
     if choice == "New Consultations":
-        st.header("🆕 New Consultation Requests")
+        pending_counter(user_id)
         
-        # Get pending consultations for this doctor
-        pending_consultations = list(consultations_collection.find({
-            "doctor_id": user_id,
-            "status": "pending"
-        }).sort("created_at", -1))
+        # Served from the shared cache until one of this doctor's consultations changes
+        pending_consultations = get_pending_consultations(user_id)
         
         if not pending_consultations:
             st.info("No new consultation requests.")
             return
         
+        # Bulk mode: one form for many requests, so nothing reruns until it is submitted
+        if st.toggle("Bulk actions", key="bulk_mode"):
+            bulk_actions(user_id, pending_consultations)
+            return
+        
+        # Outcomes for requests that have left the queue no longer need remembering
+        if "consultation_updates" in st.session_state:
+            pending_ids = {consult["_id"] for consult in pending_consultations}
+            st.session_state.consultation_updates = {
+                consult_id: updated for consult_id, updated in st.session_state.consultation_updates.items()
+                if consult_id in pending_ids
+            }
+        
         for consult in pending_consultations:
-            patient = get_user_by_id(consult["patient_id"])
-            patient_name = patient["name"] if patient else "Unknown Patient"
-            
-            with st.expander(f"Consultation Request from {patient_name} - {consult['created_at'].strftime('%Y-%m-%d %H:%M')}"):
-                st.subheader("Patient Information")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.write(f"**Name:** {patient_name}")
-                    st.write(f"**Age:** {patient.get('age', 'Not provided')}")
-                    st.write(f"**Gender:** {patient.get('gender', 'Not provided')}")
-                
-                with col2:
-                    st.write(f"**Allergies:** {', '.join(consult.get('allergies', []))}")
-                    st.write(f"**Medical History:** {', '.join(consult.get('medical_history', []))}")
-                
-                st.subheader("Current Symptoms")
-                st.write(consult["symptoms"])
-                
-                # Doctor's response form
-                with st.form(key=f"response_form_{consult['_id']}"):
-                    diagnosis = st.text_area("Diagnosis")
-                    prescription = st.text_area("Prescription")
-                    lab_requests = st.text_area("Lab Requests (one per line)")
-                    consultation_notes = st.text_area("Consultation Notes")
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        status = st.selectbox("Status", ["in_progress", "completed"], key=f"status_{consult['_id']}")
-                    
-                    with col2:
-                        st.write("")  # Spacer
-                        submitted = st.form_submit_button("Update Consultation")
-                    
-                    if submitted:
-                        update_data = {
-                            "diagnosis": diagnosis,
-                            "prescription": prescription,
-                            "consultation_notes": consultation_notes,
-                            "status": status,
-                            "updated_at": datetime.utcnow()
-                        }
-                        
-                        if lab_requests:
-                            update_data["lab_requests"] = [req.strip() for req in lab_requests.split('\n') if req.strip()]
-                        
-                        result = consultations_collection.update_one(
-                            {"_id": consult["_id"]},
-                            {"$set": update_data}
-                        )
-                        
-                        if result.modified_count > 0:
-                            st.success("Consultation updated successfully!")
-                            st.rerun()
-                        else:
-                            st.error("Failed to update consultation")
+            # One keyed fragment per request so a submit reruns only this form and the counter.
+            # Fragments keep their arguments for the session, so they get ids and the row's label fields.
+            st.fragment(consultation_response, key=f"consultation_{consult['_id']}")(
+                consult["_id"], consult["patient_id"], consult.get("triage_score"), consult["created_at"])
     
     elif choice == "Patient History":
         st.header("📋 Patient History")
         
+        # Typed terms are normalized like stored ones, so "PCN" finds penicillin allergies
+        col1, col2 = st.columns(2)
+        with col1:
+            allergy_filter = st.multiselect("Allergic to", canonical_terms("allergies"),
+                                            accept_new_options=True, key="filter_allergies")
+        with col2:
+            history_filter = st.multiselect("History of", canonical_terms("medical_history"),
+                                            accept_new_options=True, key="filter_history")
+        
         # Get all patients who consulted this doctor
-        patient_consultations = list(consultations_collection.find({
-            "doctor_id": user_id
-        }).sort("created_at", -1))
+        patient_consultations = get_consultation_summaries({"doctor_id": user_id})
+        if allergy_filter or history_filter:
+            # Answered by the (doctor_id, allergies) / (doctor_id, medical_history) multikey indexes
+            matching = {consult["patient_id"] for consult in consultations.find_by_terms(
+                user_id, allergy_filter, history_filter, {"patient_id": 1})}
+            patient_consultations = [consult for consult in patient_consultations
+                                     if consult["patient_id"] in matching]
         
         if not patient_consultations:
             st.info("No patient history found.")
@@ -110,7 +89,7 @@ def doctor_dashboard():
         for consult in patient_consultations:
             patient_id = consult["patient_id"]
             if patient_id not in patients_data:
-                patient = get_user_by_id(patient_id)
+                patient = get_user_profile(patient_id)
                 patients_data[patient_id] = {
                     "patient_info": patient,
                     "consultations": []
@@ -119,22 +98,29 @@ def doctor_dashboard():
         
         for patient_id, data in patients_data.items():
             patient = data["patient_info"]
-            consultations = data["consultations"]
+            history = data["consultations"]
             
             with st.expander(f"Patient: {patient['name']} (Age: {patient.get('age', 'N/A')}, Gender: {patient.get('gender', 'N/A')})"):
-                for consult in consultations:
+                patient_record_summary(patient_id)
+                st.write("---")
+                
+                for consult in history:
                     st.write(f"**Date:** {consult['created_at'].strftime('%Y-%m-%d %H:%M')}")
-                    st.write(f"**Symptoms:** {consult['symptoms']}")
-                    st.write(f"**Diagnosis:** {consult.get('diagnosis', 'Not provided')}")
                     st.write(f"**Status:** {consult['status']}")
+                    
+                    # Clinical detail is loaded per consultation on request
+                    if st.toggle("Show details", key=f"detail_{consult['_id']}"):
+                        detail = get_consultation_detail(consult["_id"], patient_id)
+                        audit_access("view_consultation", patient_id, consultation_id=consult["_id"])
+                        if detail:
+                            st.write(f"**Symptoms:** {detail['symptoms']}")
+                            st.write(f"**Diagnosis:** {detail.get('diagnosis', 'Not provided')}")
                     st.write("---")
     
     elif choice == "My Consultations":
         st.header("📊 My Consultations Overview")
         
-        all_consultations = list(consultations_collection.find({
-            "doctor_id": user_id
-        }).sort("created_at", -1))
+        all_consultations = get_consultation_summaries({"doctor_id": user_id})
         
         if not all_consultations:
             st.info("No consultations found.")
@@ -145,15 +131,17 @@ def doctor_dashboard():
         pending_count = len([c for c in all_consultations if c["status"] == "pending"])
         completed_count = len([c for c in all_consultations if c["status"] == "completed"])
         
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         col1.metric("Total Consultations", total_consultations)
         col2.metric("Pending", pending_count)
         col3.metric("Completed", completed_count)
+        # Counted on the (doctor_id, status, requested_at) index of lab_requests
+        col4.metric("Outstanding Labs", lab_requests.count_outstanding(user_id))
         
         # Display all consultations
         st.subheader("All Consultations")
         for consult in all_consultations:
-            patient = get_user_by_id(consult["patient_id"])
+            patient = get_user_profile(consult["patient_id"])
             patient_name = patient["name"] if patient else "Unknown Patient"
             
             status_color = {
@@ -162,4 +150,165 @@ def doctor_dashboard():
                 "completed": "🟢"
             }.get(consult["status"], "⚪")
             
-            st.write(f"{status_color} **{patient_name}** - {consult['created_at'].strftime('%Y-%m-%d')} - Status: {consult['status']}")
\ No newline at end of file
+            st.write(f"{status_color} **{patient_name}** - {consult['created_at'].strftime('%Y-%m-%d')} - Status: {consult['status']}")
+
+@st.fragment(key="pending_counter")
+@degraded_on_outage()
+def pending_counter(doctor_id):
+    pending_count = count_pending_consultations(doctor_id)
+    st.header(f"🆕 New Consultation Requests ({pending_count})")
+
+@degraded_on_outage()
+def consultation_response(consult_id, patient_id, triage_score, created_at):
+    patient = get_user_profile(patient_id) or {}
+    patient_name = patient["name"] if patient else "Unknown Patient"
+    
+    update_result = st.session_state.get("consultation_updates", {}).get(consult_id)
+    if update_result:
+        st.success(f"Consultation from {patient_name} updated successfully!")
+        return
+    
+    label = f"Consultation Request from {patient_name} - {created_at.strftime('%Y-%m-%d %H:%M')}"
+    expander = st.expander(f"{priority_label(triage_score)} · {label}", key=f"response_{consult_id}",
+                           on_change="rerun")
+    with expander:
+        # Clinical detail is loaded, and its access audited, only for the request the doctor opened
+        if not expander.open:
+            keep_drafts(consult_id)
+            return
+        consult = get_consultation_detail(consult_id, patient_id)
+        audit_access("view_consultation", patient_id, consultation_id=consult_id)
+        
+        st.subheader("Patient Information")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.write(f"**Name:** {patient_name}")
+            st.write(f"**Age:** {patient.get('age', 'Not provided')}")
+            st.write(f"**Gender:** {patient.get('gender', 'Not provided')}")
+        
+        with col2:
+            st.write(f"**Allergies:** {', '.join(consult.get('allergies', []))}")
+            st.write(f"**Medical History:** {', '.join(consult.get('medical_history', []))}")
+        
+        st.subheader("Medical Record")
+        patient_record_summary(patient_id)
+        
+        st.subheader("Current Symptoms")
+        st.write(consult["symptoms"])
+        triage_summary(consult)
+        consultation_thread_summary(consult)
+        
+        if update_result is False:
+            st.error("Failed to update consultation")
+        
+        # Doctor's response: not a form, so each field reaches the server as it is edited
+        # (rerunning only this fragment) and the draft is checkpointed for other replicas
+        st.text_area("Diagnosis", key=f"diagnosis_{consult_id}", on_change=checkpoint_session)
+        st.text_area("Prescription", key=f"prescription_{consult_id}", on_change=checkpoint_session)
+        prescription_warnings(consult)
+        st.text_area("Lab Requests (one per line)", key=f"lab_requests_{consult_id}", on_change=checkpoint_session)
+        st.text_area("Consultation Notes", key=f"notes_{consult_id}", on_change=checkpoint_session)
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.selectbox("Status", ["in_progress", "completed"], key=f"status_{consult_id}",
+                         on_change=checkpoint_session)
+        
+        with col2:
+            st.write("")  # Spacer
+            st.button(
+                "Update Consultation",
+                key=f"update_{consult_id}",
+                on_click=update_consultation,
+                args=(consult_id,)
+            )
+
+@degraded_on_outage()
+def update_consultation(consult_id):
+    """Button callback: persist the response, then rerun only this consultation and the counter"""
+    update_data = {
+        "diagnosis": st.session_state[f"diagnosis_{consult_id}"],
+        "prescription": st.session_state[f"prescription_{consult_id}"],
+        "consultation_notes": st.session_state[f"notes_{consult_id}"],
+        "status": st.session_state[f"status_{consult_id}"],
+        "updated_at": datetime.utcnow()
+    }
+    
+    lab_requests = st.session_state[f"lab_requests_{consult_id}"]
+    if lab_requests:
+        update_data["lab_requests"] = [req.strip() for req in lab_requests.split('\n') if req.strip()]
+    
+    updated = consultations.update(consult_id, update_data)
+    st.session_state.setdefault("consultation_updates", {})[consult_id] = updated
+    st.rerun([f"consultation_{consult_id}", "pending_counter"])
+
+def bulk_actions(doctor_id, pending_consultations):
+    """Apply one status, note template and set of lab requests to the selected pending requests"""
+    if "bulk_warning" in st.session_state:
+        st.warning(st.session_state.pop("bulk_warning"))
+    results = st.session_state.pop("bulk_results", None)
+    if results:
+        bulk_results_summary(results)
+    
+    pending = {}
+    for consult in pending_consultations:
+        patient = get_user_profile(consult["patient_id"])
+        patient_name = patient["name"] if patient else "Unknown Patient"
+        pending[consult["_id"]] = (f"{priority_label(consult.get('triage_score'))} · {patient_name}", patient_name)
+    # Requests that left the queue since the last run cannot stay selected
+    if "bulk_selection" in st.session_state:
+        st.session_state.bulk_selection = [consult_id for consult_id in st.session_state.bulk_selection
+                                           if consult_id in pending]
+    
+    with st.form("bulk_actions"):
+        st.multiselect("Consultations", list(pending), format_func=lambda consult_id: pending[consult_id][0],
+                       key="bulk_selection")
+        st.selectbox("Status", [None, "in_progress", "completed"], key="bulk_status",
+                     format_func=lambda status: status or "Leave unchanged")
+        st.selectbox("Note", ["No note", *BULK_NOTE_TEMPLATES], key="bulk_note_template")
+        st.text_area("Lab Requests to add (one per line)", key="bulk_lab_requests")
+        st.form_submit_button("Apply to Selected", on_click=apply_bulk_actions, args=(doctor_id, pending))
+
+def bulk_results_summary(results):
+    """Per-consultation outcome of the last bulk action"""
+    updated = sum(outcome == "updated" for _, outcome in results)
+    if updated == len(results):
+        st.success(f"{updated} consultations updated")
+    else:
+        st.warning(f"{updated} of {len(results)} consultations updated")
+    for label, outcome in results:
+        if outcome == "updated":
+            st.write(f"✅ {label}")
+        elif outcome == "skipped":
+            st.write(f"⏭️ {label}: no longer pending, left unchanged")
+        else:
+            st.write(f"❌ {label}: {outcome}")
+
+@degraded_on_outage()
+def apply_bulk_actions(doctor_id, pending):
+    """Form callback: persist every selected response in one bulk_write; the submit's own rerun shows the outcomes"""
+    selected = st.session_state.bulk_selection
+    status = st.session_state.bulk_status
+    template = BULK_NOTE_TEMPLATES.get(st.session_state.bulk_note_template)
+    tests = [req.strip() for req in st.session_state.bulk_lab_requests.split('\n') if req.strip()]
+    if not selected or not (status or template or tests):
+        st.session_state.bulk_warning = "Select consultations and at least one action to apply."
+        return
+    
+    now = datetime.utcnow()
+    updates = {}
+    for consult_id in selected:
+        update_data = {"updated_at": now}
+        if status:
+            update_data["status"] = status
+        if template:
+            update_data["consultation_notes"] = template.replace("{patient_name}", pending[consult_id][1])
+        if tests:
+            update_data["lab_requests"] = tests
+        updates[consult_id] = update_data
+    
+    outcomes = consultations.bulk_update(doctor_id, updates)
+    st.session_state.bulk_results = [(pending[consult_id][0], outcome) for consult_id, outcome in outcomes.items()]
+    st.session_state.bulk_selection = []
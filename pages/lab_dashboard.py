@@ -0,0 +1,59 @@
+# pages/lab_dashboard.py
+import streamlit as st
+from database import lab_requests
+from config import LAB_REQUEST_STATUSES, LAB_QUEUE_PAGE_SIZE, USER_TYPE_LAB
+from utils import get_user_profile, save_lab_reports, audit_access, degraded_on_outage
+
+def lab_dashboard():
+    st.title("🧪 Lab Dashboard")
+    
+    if st.session_state.user_type != USER_TYPE_LAB:
+        st.error("Access denied. Lab staff only.")
+        return
+    
+    outstanding = list(LAB_REQUEST_STATUSES[:-1])
+    statuses = st.sidebar.multiselect("Show", outstanding, default=outstanding, key="lab_statuses")
+    st.header(f"🧾 Lab Queue ({lab_requests.count_outstanding()} outstanding)")
+    
+    # Oldest first straight from the (status, requested_at) index; no consultation is loaded
+    queue = lab_requests.queue(statuses or outstanding, limit=LAB_QUEUE_PAGE_SIZE)
+    if not queue:
+        st.info("No outstanding lab requests.")
+        return
+    
+    for request in queue:
+        # One keyed fragment per request: collecting or uploading reruns only its row
+        st.fragment(lab_request_row, key=f"lab_request_{request['_id']}")(request["_id"])
+
+@degraded_on_outage()
+def lab_request_row(request_id):
+    request = lab_requests.get(request_id)
+    patient = get_user_profile(request["patient_id"]) or {}
+    doctor = get_user_profile(request["doctor_id"]) or {}
+    # Listing a request is not audited; collecting its sample and resulting it are
+    
+    with st.container(border=True):
+        st.write(f"**{request['test']}** for {patient.get('name', 'Unknown Patient')} "
+                 f"(Dr. {doctor.get('name', 'Unknown')}, requested {request['requested_at'].strftime('%Y-%m-%d %H:%M')})")
+        st.write(f"**Status:** {request['status']}")
+        
+        if request["status"] == "requested":
+            st.button("Mark Sample Collected", key=f"collect_{request_id}", on_click=collect_sample,
+                      args=(request_id, request["patient_id"]))
+        elif request["status"] == "collected":
+            result = st.file_uploader("Upload result", key=f"result_{request_id}",
+                                      type=['pdf', 'jpg', 'jpeg', 'png'])
+            if result and st.button("Submit Result", key=f"submit_result_{request_id}"):
+                # Saving the report moves the request to resulted
+                audit_access("result_lab_request", request["patient_id"], lab_request_id=request_id)
+                save_lab_reports(request["consultation_id"], request["patient_id"], request["doctor_id"],
+                                 [(result.name, result.type, result.getvalue())], lab_request_id=request_id)
+                st.rerun(scope="fragment")
+        else:
+            st.success(f"Resulted {request['resulted_at'].strftime('%Y-%m-%d %H:%M')}")
+
+@degraded_on_outage()
+def collect_sample(request_id, patient_id):
+    """Button callback: the sample was taken"""
+    audit_access("collect_lab_sample", patient_id, lab_request_id=request_id)
+    lab_requests.advance(request_id, "collected", collected_by=st.session_state.user_id)
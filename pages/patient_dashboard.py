@@ -1,10 +1,15 @@
 # pages/patient_dashboard.py
 import streamlit as st
 from datetime import datetime
-from database.connection import db
+from database import users, consultations, lab_requests
 from models import Consultation
-from config import CONSULTATIONS_COLLECTION, SPECIALIZATIONS
-from utils import get_doctors_by_specialization, get_user_by_id
+from config import SPECIALIZATIONS
+from utils import (get_doctors_by_specialization, get_user_profile,
+                   get_consultation_summaries, get_consultation_detail, idempotency_key,
+                   submit_task, task_outcome, save_lab_reports, get_consultation_thread, audit_access,
+                   degraded_on_outage)
+
+ANY_AVAILABLE_DOCTOR = "any"
 
 def patient_dashboard():
     st.title("👨‍💼 Patient Dashboard")
@@ -18,9 +23,7 @@ def patient_dashboard():
     
     # Sidebar navigation
     menu = ["New Consultation", "Re-consultation", "Consultation History"]
-    choice = st.sidebar.selectbox("Navigation", menu)
-    
-    consultations_collection = db.get_collection(CONSULTATIONS_COLLECTION)
+    choice = st.sidebar.selectbox("Navigation", menu, key="navigation")
     
     if choice == "New Consultation":
         st.header("🆕 First-time Consultation")
@@ -41,6 +44,9 @@ def patient_dashboard():
             # Get doctors by specialization
             doctors = get_doctors_by_specialization(specialization)
             doctor_options = {f"{doc['name']} ({doc['specialization']})": doc["_id"] for doc in doctors}
+            if doctor_options:
+                # Assigned on submit to the doctor with the shortest pending queue
+                doctor_options = {f"Any available {specialization}": ANY_AVAILABLE_DOCTOR, **doctor_options}
             
             if doctor_options:
                 selected_doctor = st.selectbox("Available Doctors", list(doctor_options.keys()))
@@ -56,110 +62,170 @@ def patient_dashboard():
             submitted = st.form_submit_button("Submit Consultation Request")
             
             if submitted and doctor_id:
+                key = idempotency_key("new_consultation", doctor_id, specialization, symptoms, allergies, medical_history)
+                pending_claimed = doctor_id == ANY_AVAILABLE_DOCTOR
+                if pending_claimed:
+                    doctor = users.claim_least_loaded_doctor(specialization)
+                    if not doctor:
+                        st.error("No doctors are currently available for this specialization")
+                        return
+                    doctor_id = doctor["_id"]
+                
                 consultation_data = Consultation(
                     patient_id=user_id,
                     doctor_id=doctor_id,
                     symptoms=symptoms,
+                    patient_age=age,
                     medical_history=medical_history.split(',') if medical_history else [],
                     allergies=allergies.split(',') if allergies else [],
                     status="pending"
                 )
                 
-                result = consultations_collection.insert_one(consultation_data.to_dict())
+                consultation_id, created = consultations.create_once(consultation_data.to_dict(), key,
+                                                                     pending_claimed=pending_claimed)
                 
-                if result.inserted_id:
+                if created:
                     st.success("Consultation request submitted successfully!")
+                    if pending_claimed:
+                        st.info(f"Assigned to Dr. {doctor['name']}")
+                    if uploaded_files:
+                        files = [(file.name, file.type, file.getvalue()) for file in uploaded_files]
+                        if not submit_task("lab_reports", save_lab_reports, consultation_id, user_id, doctor_id, files):
+                            st.warning("Lab reports could not be queued right now. Please upload them again later.")
+                elif consultation_id:
+                    st.info("This consultation request was already submitted.")
                 else:
                     st.error("Failed to submit consultation request")
+        
+        uploads = task_outcome("lab_reports", "Uploading lab reports...")
+        if uploads and uploads.status == "done":
+            st.success(f"{uploads.result} lab report(s) uploaded")
+        elif uploads and uploads.status == "cancelled":
+            st.info("Lab report upload cancelled")
+        elif uploads and uploads.status == "failed":
+            st.error("Lab reports could not be uploaded")
     
     elif choice == "Re-consultation":
-        st.header("🔄 Re-consultation")
-        
-        # Get patient's previous consultations
-        previous_consultations = list(consultations_collection.find(
-            {"patient_id": user_id}
-        ).sort("created_at", -1))
-        
-        if not previous_consultations:
-            st.info("No previous consultations found. Please start with a new consultation.")
-            return
-        
-        consultation_options = {}
-        for consult in previous_consultations:
-            doctor = get_user_by_id(consult["doctor_id"])
-            doctor_name = doctor["name"] if doctor else "Unknown Doctor"
-            label = f"Consultation with Dr. {doctor_name} - {consult['created_at'].strftime('%Y-%m-%d')}"
-            consultation_options[label] = consult["_id"]
-        
-        selected_consultation_label = st.selectbox("Select Previous Consultation", list(consultation_options.keys()))
-        consultation_id = consultation_options[selected_consultation_label]
-        
-        selected_consultation = consultations_collection.find_one({"_id": consultation_id})
+        re_consultation_view(user_id)
+    
+    elif choice == "Consultation History":
+        consultation_history_view(user_id)
+
+@st.fragment
+@degraded_on_outage()
+def re_consultation_view(user_id):
+    # Switching the selected consultation reruns only this view
+    st.header("🔄 Re-consultation")
+    
+    # Get patient's previous consultations
+    previous_consultations = get_consultation_summaries({"patient_id": user_id})
+    
+    if not previous_consultations:
+        st.info("No previous consultations found. Please start with a new consultation.")
+        return
+    
+    consultation_options = {}
+    for consult in previous_consultations:
+        doctor = get_user_profile(consult["doctor_id"])
+        doctor_name = doctor["name"] if doctor else "Unknown Doctor"
+        label = f"Consultation with Dr. {doctor_name} - {consult['created_at'].strftime('%Y-%m-%d')}"
+        consultation_options[label] = consult["_id"]
+    
+    selected_consultation_label = st.selectbox("Select Previous Consultation", list(consultation_options.keys()))
+    consultation_id = consultation_options[selected_consultation_label]
+    
+    selected_consultation = get_consultation_detail(consultation_id, user_id)
+    
+    if selected_consultation:
+        # The whole thread comes back from one indexed query on its first consultation
+        root_id = selected_consultation.get("thread_root_id") or consultation_id
+        st.subheader("Consultation Thread")
+        for entry in get_consultation_thread(root_id):
+            label = "Follow-up" if entry.get("parent_consultation_id") else "Consultation"
+            st.write(f"**{label} on {entry['created_at'].strftime('%Y-%m-%d')}:** {entry['symptoms']}")
+            st.write(f"**Diagnosis:** {entry.get('diagnosis') or 'Not provided'} — **Status:** {entry['status']}")
         
-        if selected_consultation:
-            st.subheader("Previous Consultation Details")
-            st.write(f"**Symptoms:** {selected_consultation['symptoms']}")
-            st.write(f"**Diagnosis:** {selected_consultation.get('diagnosis', 'Not provided')}")
-            st.write(f"**Status:** {selected_consultation['status']}")
+        with st.form("re_consultation"):
+            st.subheader("New Information")
+            new_symptoms = st.text_area("New Symptoms or Updates")
             
-            with st.form("re_consultation"):
-                st.subheader("New Information")
-                new_symptoms = st.text_area("New Symptoms or Updates")
-                
-                st.subheader("Upload New Lab Reports")
-                new_uploads = st.file_uploader("Upload new lab reports", accept_multiple_files=True,
-                                             type=['pdf', 'jpg', 'jpeg', 'png'])
+            st.subheader("Upload New Lab Reports")
+            new_uploads = st.file_uploader("Upload new lab reports", accept_multiple_files=True,
+                                         type=['pdf', 'jpg', 'jpeg', 'png'])
+            
+            submitted = st.form_submit_button("Submit Re-consultation")
+            
+            if submitted:
+                # The follow-up holds only the new text and links back to the consultation it continues
+                new_consultation = Consultation(
+                    patient_id=user_id,
+                    doctor_id=selected_consultation["doctor_id"],
+                    symptoms=new_symptoms,
+                    patient_age=selected_consultation.get("patient_age"),
+                    medical_history=selected_consultation.get("medical_history", []),
+                    allergies=selected_consultation.get("allergies", []),
+                    status="pending"
+                )
                 
-                submitted = st.form_submit_button("Submit Re-consultation")
+                key = idempotency_key(f"re_consultation_{consultation_id}", new_symptoms)
+                new_consultation_id, created = consultations.create_follow_up(
+                    selected_consultation, new_consultation.to_dict(), key
+                )
                 
-                if submitted:
-                    # Create new consultation referencing the previous one
-                    new_consultation = Consultation(
-                        patient_id=user_id,
-                        doctor_id=selected_consultation["doctor_id"],
-                        symptoms=f"Follow-up: {selected_consultation['symptoms']}\nNew: {new_symptoms}",
-                        medical_history=selected_consultation.get("medical_history", []),
-                        allergies=selected_consultation.get("allergies", []),
-                        status="pending"
-                    )
-                    
-                    result = consultations_collection.insert_one(new_consultation.to_dict())
-                    
-                    if result.inserted_id:
-                        st.success("Re-consultation request submitted successfully!")
-                    else:
-                        st.error("Failed to submit re-consultation request")
+                if created:
+                    st.success("Re-consultation request submitted successfully!")
+                elif new_consultation_id:
+                    st.info("This re-consultation request was already submitted.")
+                else:
+                    st.error("Failed to submit re-consultation request")
+
+@st.fragment
+@degraded_on_outage()
+def consultation_history_view(user_id):
+    # Expanding a row reruns only this view
+    st.header("📋 Consultation History")
     
-    elif choice == "Consultation History":
-        st.header("📋 Consultation History")
-        
-        consultations = list(consultations_collection.find(
-            {"patient_id": user_id}
-        ).sort("created_at", -1))
-        
-        if not consultations:
-            st.info("No consultation history found.")
-            return
+    consultations = get_consultation_summaries({"patient_id": user_id})
+    
+    if not consultations:
+        st.info("No consultation history found.")
+        return
+    
+    for consult in consultations:
+        doctor = get_user_profile(consult["doctor_id"])
+        doctor_name = doctor["name"] if doctor else "Unknown Doctor"
+        specialization = doctor["specialization"] if doctor else "N/A"
         
-        for consult in consultations:
-            doctor = get_user_by_id(consult["doctor_id"])
-            doctor_name = doctor["name"] if doctor else "Unknown Doctor"
-            specialization = doctor["specialization"] if doctor else "N/A"
+        expander = st.expander(
+            f"Consultation with Dr. {doctor_name} ({specialization}) - {consult['created_at'].strftime('%Y-%m-%d %H:%M')}",
+            key=f"history_{consult['_id']}",
+            on_change="rerun"
+        )
+        with expander:
+            if not expander.open:
+                st.write(f"**Status:** {consult['status']}")
+                continue
             
-            with st.expander(f"Consultation with Dr. {doctor_name} ({specialization}) - {consult['created_at'].strftime('%Y-%m-%d %H:%M')}"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.write(f"**Status:** {consult['status']}")
-                    st.write(f"**Symptoms:** {consult['symptoms']}")
-                    st.write(f"**Allergies:** {', '.join(consult.get('allergies', []))}")
-                
-                with col2:
-                    st.write(f"**Diagnosis:** {consult.get('diagnosis', 'Not provided')}")
-                    st.write(f"**Prescription:** {consult.get('prescription', 'Not provided')}")
-                    st.write(f"**Consultation Notes:** {consult.get('consultation_notes', 'Not provided')}")
-                
-                if consult.get('lab_requests'):
-                    st.write("**Lab Requests:**")
-                    for lab_req in consult['lab_requests']:
-                        st.write(f"- {lab_req}")
\ No newline at end of file
+            # Full record is only fetched for the row the patient opened
+            detail = get_consultation_detail(consult["_id"], user_id)
+            audit_access("view_consultation", user_id, consultation_id=consult["_id"])
+            if not detail:
+                st.error("Consultation could not be loaded")
+                continue
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.write(f"**Status:** {detail['status']}")
+                st.write(f"**Symptoms:** {detail['symptoms']}")
+                st.write(f"**Allergies:** {', '.join(detail.get('allergies', []))}")
+            
+            with col2:
+                st.write(f"**Diagnosis:** {detail.get('diagnosis', 'Not provided')}")
+                st.write(f"**Prescription:** {detail.get('prescription', 'Not provided')}")
+                st.write(f"**Consultation Notes:** {detail.get('consultation_notes', 'Not provided')}")
+            
+            if detail.get('lab_requests'):
+                st.write("**Lab Requests:**")
+                for lab_request in lab_requests.list_for_consultation(consult["_id"]):
+                    st.write(f"- {lab_request['test']} ({lab_request['status']})")
@@ -0,0 +1,173 @@
+# scheduling/__init__.py
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from config import SLOT_MINUTES, BOOKING_HORIZON_DAYS
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+_TIME = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm)?"
+_HOURS_RE = re.compile(rf"^(?P<days>[a-z,\-\s]+?)\s+{_TIME}\s*-\s*{_TIME}$")
+
+def _minutes(hour, minute, meridiem):
+    hour = int(hour) % 12 if meridiem else int(hour)
+    if meridiem == "pm":
+        hour += 12
+    return hour * 60 + int(minute or 0)
+
+def _parse_days(text):
+    names = [part[:3] for part in re.split(r"[\s,]+|-", text) if part]
+    if any(name not in DAYS for name in names):
+        return []
+    # "Mon-Fri" is a range, "Mon-Wed-Fri" and "Mon, Wed" are lists of days
+    if '-' in text and len(names) == 2:
+        first, last = DAYS.index(names[0]), DAYS.index(names[1])
+        return [day % 7 for day in range(first, last + 1 if last >= first else last + 8)]
+    return [DAYS.index(name) for name in names]
+
+def parse_available_hours(text):
+    """Turn free-text hours like "Mon-Fri 9AM-5PM" into {weekday: [(start_min, end_min)]}.
+
+    Several groups can be separated by ';'. Unrecognised groups are ignored.
+    """
+    weekly = defaultdict(list)
+    for group in (text or "").lower().split(';'):
+        match = _HOURS_RE.match(group.strip())
+        if not match:
+            continue
+        start_h, start_m, start_ap, end_h, end_m, end_ap = match.groups()[1:]
+        start = _minutes(start_h, start_m, start_ap)
+        end = _minutes(end_h, end_m, end_ap)
+        if end <= start:
+            continue
+        for day in _parse_days(match.group("days")):
+            weekly[day].append((start, end))
+    return dict(weekly)
+
+class SlotIndex:
+    """Per-doctor availability bitmaps for fast "next free slot" queries.
+
+    Each doctor has one bitmask per weekday with a bit per SLOT_MINUTES slot,
+    and each booked day has a mask of taken slots. A free slot is a set bit in
+    weekly & ~booked, so answering a query never touches stored bookings.
+    """
+
+    def __init__(self, slot_minutes=SLOT_MINUTES, horizon_days=BOOKING_HORIZON_DAYS):
+        self.slot_minutes = slot_minutes
+        self.horizon_days = horizon_days
+        self.built_at = datetime.now()
+        # Generation of the doctor directory the indexed doctors were read at (see sync_doctors)
+        self.directory_generation = None
+        self._weekly = {}
+        self._booked = defaultdict(int)
+        self._doctors = {}
+        self._by_specialization = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _mask(self, intervals):
+        mask = 0
+        for start, end in intervals:
+            first = -(-start // self.slot_minutes)
+            last = end // self.slot_minutes
+            for slot in range(first, last):
+                mask |= 1 << slot
+        return mask
+
+    def _slot(self, start):
+        return (start.hour * 60 + start.minute) // self.slot_minutes
+
+    def add_doctor(self, doctor):
+        weekly = parse_available_hours(doctor.get("available_hours"))
+        with self._lock:
+            self.remove_doctor(doctor["_id"], locked=True)
+            if not doctor.get("is_available", True) or not weekly:
+                return
+            self._weekly[doctor["_id"]] = [self._mask(weekly.get(day, [])) for day in range(7)]
+            self._doctors[doctor["_id"]] = {
+                "_id": doctor["_id"],
+                "name": doctor["name"],
+                "specialization": doctor.get("specialization"),
+                "consultation_fee": doctor.get("consultation_fee")
+            }
+            self._by_specialization[doctor.get("specialization")].add(doctor["_id"])
+
+    def remove_doctor(self, doctor_id, locked=False):
+        if not locked:
+            with self._lock:
+                return self.remove_doctor(doctor_id, locked=True)
+        doctor = self._doctors.pop(doctor_id, None)
+        self._weekly.pop(doctor_id, None)
+        if doctor:
+            self._by_specialization[doctor["specialization"]].discard(doctor_id)
+
+    def sync_doctors(self, doctors, generation=None):
+        """Re-index the given doctors and drop those no longer listed; bookings are kept"""
+        listed = set()
+        for doctor in doctors:
+            self.add_doctor(doctor)
+            listed.add(doctor["_id"])
+        for doctor_id in set(self._weekly) - listed:
+            self.remove_doctor(doctor_id)
+        self.directory_generation = generation
+
+    def book(self, doctor_id, start):
+        with self._lock:
+            self._booked[(doctor_id, start.date())] |= 1 << self._slot(start)
+
+    def release(self, doctor_id, start):
+        with self._lock:
+            self._booked[(doctor_id, start.date())] &= ~(1 << self._slot(start))
+
+    def is_free(self, doctor_id, start):
+        weekly = self._weekly.get(doctor_id)
+        if not weekly:
+            return False
+        bit = 1 << self._slot(start)
+        return bool(weekly[start.weekday()] & bit) and not self._booked.get((doctor_id, start.date()), 0) & bit
+
+    def doctor(self, doctor_id):
+        return self._doctors.get(doctor_id)
+
+    def next_free_slots(self, specialization=None, doctor_id=None, limit=10, now=None):
+        """Earliest free (start, doctor_id) pairs within the booking horizon"""
+        now = now or datetime.now()
+        if doctor_id is not None:
+            doctor_ids = [doctor_id] if doctor_id in self._weekly else []
+        elif specialization:
+            doctor_ids = list(self._by_specialization.get(specialization, ()))
+        else:
+            doctor_ids = list(self._weekly)
+
+        results = []
+        for offset in range(self.horizon_days):
+            day = now.date() + timedelta(days=offset)
+            earliest = self._slot(now) + 1 if offset == 0 else 0
+            day_slots = []
+            with self._lock:
+                for candidate in doctor_ids:
+                    free = self._weekly[candidate][day.weekday()] & ~self._booked.get((candidate, day), 0)
+                    free >>= earliest
+                    slot = earliest
+                    while free:
+                        if free & 1:
+                            day_slots.append((slot, candidate))
+                        free >>= 1
+                        slot += 1
+            day_start = datetime.combine(day, datetime.min.time())
+            for slot, candidate in sorted(day_slots, key=lambda item: item[0]):
+                results.append((day_start + timedelta(minutes=slot * self.slot_minutes), candidate))
+                if len(results) >= limit:
+                    return results
+        return results
+
+def build_slot_index(users, consultations, now=None):
+    """Index every available doctor and the slots already booked in the horizon"""
+    index = SlotIndex()
+    for doctor in users.list_doctors():
+        index.add_doctor(doctor)
+    now = now or datetime.now()
+    until = now + timedelta(days=index.horizon_days + 1)
+    for booking in consultations.list_booked_slots(now - timedelta(days=1), until):
+        index.book(booking["doctor_id"], booking["appointment_start"])
+    return index
@@ -0,0 +1,35 @@
+# serve.py
+"""
+Container entry point: warm the process up, then start Streamlit in it.
+
+The health endpoints (/readyz, /livez on HEALTH_PORT) start first, with
+/sessions on DIAGNOSTICS_PORT bound to 127.0.0.1. The server only opens its
+port once warm_up() has opened the Mongo pool and filled the process-wide
+caches, and /readyz reports ready only after that, so a new replica gets
+traffic once it can serve the first session at full speed.
+
+Usage (extra arguments are passed to `streamlit run`):
+    python serve.py --server.port=8501 --server.address=0.0.0.0
+"""
+import os
+import sys
+
+from streamlit.web import cli as stcli
+
+from health import start_health_server, start_diagnostics_server
+from startup import warm_up
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mediconsult_app.py")
+
+
+def main():
+    start_health_server()
+    start_diagnostics_server()
+    duration = warm_up()
+    print(f"Warm-up finished in {duration * 1000:.0f} ms")
+    sys.argv = ["streamlit", "run", APP_FILE, *sys.argv[1:]]
+    sys.exit(stcli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# startup/__init__.py
+import importlib
+import time
+from contextlib import contextmanager
+import streamlit as st
+from datetime import datetime
+from database import (db, users, consultations, patient_records, cipher, ensure_indexes,
+                      reconcile_pending_counts, rebuild_patient_records)
+from utils import hash_password, get_slot_index
+
+# Read by the readiness check: the pod should not take traffic before warm_up() finished
+WARM_STATE = {"warm": False, "duration": None, "error": None}
+
+# Imported by the views on first use rather than when the app script loads
+LAZY_MODULES = ("bcrypt", "scheduling", "tasks", "models")
+
+# Full script runs in progress, {run token: start time}; read by the liveness check.
+# Keyed per run, not per thread name: Streamlit names every script thread alike
+ACTIVE_RUNS = {}
+
+# =============================================
+# DATABASE SETUP
+# =============================================
+
+@st.cache_resource(show_spinner=False)
+def setup_database():
+    """Initialize database with admin and sample doctors (runs once per server process)"""
+    # Create indexes
+    ensure_indexes()
+    reconcile_pending_counts()
+    # Consultations written before patient records existed
+    if not patient_records.count() and consultations.count():
+        rebuild_patient_records()
+    
+    # Create admin user if not exists
+    admin_user = users.get_by_email("admin@mediconsult.com")
+    if not admin_user:
+        admin_data = {
+            "name": "System Administrator",
+            "email": "admin@mediconsult.com",
+            "password": hash_password("admin123"),
+            "user_type": "admin",
+            "phone": "+1234567890",
+            "created_at": datetime.utcnow()
+        }
+        users.create(admin_data)
+        print("✅ Admin: admin@mediconsult.com / admin123")
+    
+    # Create sample doctors
+    sample_doctors = [
+        {
+            "name": "Sarah Wilson",
+            "email": "cardio@mediconsult.com",
+            "password": hash_password("doctor123"),
+            "user_type": "doctor",
+            "specialization": "Cardiologist",
+            "qualifications": "MD Cardiology, 10 years experience",
+            "consultation_fee": 100,
+            "available_hours": "Mon-Fri 9AM-5PM",
+            "phone": "+1234567891",
+            "is_available": True,
+            "created_at": datetime.utcnow()
+        },
+        {
+            "name": "Michael Chen",
+            "email": "derma@mediconsult.com",
+            "password": hash_password("doctor123"),
+            "user_type": "doctor",
+            "specialization": "Dermatologist",
+            "qualifications": "MD Dermatology, Skin specialist",
+            "consultation_fee": 80,
+            "available_hours": "Mon-Wed-Fri 10AM-6PM",
+            "phone": "+1234567892",
+            "is_available": True,
+            "created_at": datetime.utcnow()
+        }
+    ]
+    
+    for doctor in sample_doctors:
+        if not users.get_by_email(doctor["email"]):
+            users.create(doctor)
+
+# =============================================
+# WARM-UP
+# =============================================
+
+def warm_up():
+    """Open the Mongo pool and fill process-wide caches before the server accepts sessions.
+    
+    Caches created here (st.cache_resource) are the ones sessions use, so the
+    first visitor to a new replica does not pay for them.
+    """
+    start = time.perf_counter()
+    try:
+        db.command("ping")
+        # Fail closed: without the master key no clinical text can be read or stored
+        cipher.master
+        setup_database()
+        get_slot_index()
+        for module in LAZY_MODULES:
+            importlib.import_module(module)
+    except Exception as e:
+        WARM_STATE["error"] = str(e)
+        raise
+    WARM_STATE.update(warm=True, duration=time.perf_counter() - start, error=None)
+    return WARM_STATE["duration"]
+
+@contextmanager
+def script_run():
+    """Record a full run of the app script so a wedged script runner can be detected"""
+    token = object()
+    ACTIVE_RUNS[token] = time.monotonic()
+    try:
+        yield
+    finally:
+        ACTIVE_RUNS.pop(token, None)
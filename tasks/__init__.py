@@ -0,0 +1,167 @@
+# tasks/__init__.py
+import multiprocessing
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+from datetime import datetime
+from config import TASK_THREADS, TASK_PROCESSES, TASK_QUEUE_LIMIT
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_current = threading.local()
+
+class QueueFull(Exception):
+    """The pool already has its limit of queued and running tasks"""
+
+class TaskCancelled(Exception):
+    """Raised inside a thread task by check_cancelled() once cancellation was requested"""
+
+class Task:
+    """Status, progress and outcome of one submitted task"""
+
+    def __init__(self, name, kind):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        self.future = None
+        self._cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_requested.is_set()
+
+def current_task():
+    """The Task a thread-pool worker is running, or None outside a task"""
+    return getattr(_current, "task", None)
+
+def report_progress(fraction, message=""):
+    """Record progress (0..1) for the running thread task; a no-op elsewhere"""
+    task = current_task()
+    if task:
+        task.progress = max(0.0, min(1.0, fraction))
+        task.message = message
+
+def check_cancelled():
+    """Stop the running thread task if cancel() was called for it"""
+    task = current_task()
+    if task and task.cancel_requested:
+        raise TaskCancelled()
+
+class TaskExecutor:
+    """Shared thread and process pools with task ids, progress and bounded queues.
+    
+    Thread tasks can call report_progress() and check_cancelled(). Process
+    tasks run picklable functions in another interpreter, for CPU-bound work
+    that would otherwise hold the GIL; they can only be cancelled before they start.
+    """
+
+    def __init__(self, threads=TASK_THREADS, processes=TASK_PROCESSES, queue_limit=TASK_QUEUE_LIMIT,
+                 keep_finished=1000):
+        self._pools = {"thread": ThreadPoolExecutor(threads, thread_name_prefix="mediconsult-task")}
+        self._process_workers = processes
+        self._slots = {"thread": threading.BoundedSemaphore(queue_limit),
+                       "process": threading.BoundedSemaphore(queue_limit)}
+        self._tasks = OrderedDict()
+        self._keep_finished = keep_finished
+        self._lock = threading.Lock()
+
+    def _pool(self, kind):
+        with self._lock:
+            if kind not in self._pools:
+                # Spawning interpreters is slow, so the process pool starts on first use.
+                # Forking a process that runs threads (the Streamlit server) can deadlock.
+                self._pools[kind] = ProcessPoolExecutor(self._process_workers,
+                                                        mp_context=multiprocessing.get_context("spawn"))
+            return self._pools[kind]
+
+    def submit(self, fn, *args, kind="thread", name=None, **kwargs):
+        """Queue fn(*args, **kwargs) and return its task id; raises QueueFull"""
+        if kind not in self._slots:
+            raise ValueError(f"Unknown task kind: {kind}")
+        if not self._slots[kind].acquire(blocking=False):
+            raise QueueFull(f"Too many {kind} tasks queued")
+        
+        task = Task(name or getattr(fn, "__name__", "task"), kind)
+        with self._lock:
+            self._tasks[task.id] = task
+            self._prune()
+        try:
+            if kind == "thread":
+                task.future = self._pool(kind).submit(self._run, task, fn, args, kwargs)
+            else:
+                task.future = self._pool(kind).submit(fn, *args, **kwargs)
+                task.status = RUNNING
+        except Exception:
+            self._slots[kind].release()
+            raise
+        task.future.add_done_callback(lambda future: self._finish(task, future))
+        return task.id
+
+    def _run(self, task, fn, args, kwargs):
+        if task.cancel_requested:
+            raise TaskCancelled()
+        task.status = RUNNING
+        _current.task = task
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.task = None
+
+    def _finish(self, task, future):
+        try:
+            task.result = future.result()
+            task.progress = 1.0
+            task.status = DONE
+        except (CancelledError, TaskCancelled):
+            task.status = CANCELLED
+        except Exception as e:
+            task.error = e
+            task.status = FAILED
+        task.finished_at = datetime.utcnow()
+        self._slots[task.kind].release()
+
+    def _prune(self):
+        finished = [task_id for task_id, task in self._tasks.items() if task.finished]
+        for task_id in finished[:max(0, len(finished) - self._keep_finished)]:
+            del self._tasks[task_id]
+
+    def get(self, task_id):
+        return self._tasks.get(task_id)
+
+    def cancel(self, task_id):
+        """Cancel a queued task, or ask a running thread task to stop; return True if requested"""
+        task = self._tasks.get(task_id)
+        if not task or task.finished:
+            return False
+        task._cancel_requested.set()
+        if task.future and task.future.cancel():
+            return True
+        return task.kind == "thread"
+
+    def pending(self, kind="thread"):
+        return sum(1 for task in list(self._tasks.values()) if task.kind == kind and not task.finished)
+
+    def queued(self, name=None):
+        """Tasks (optionally only those submitted under name) waiting for a worker"""
+        return sum(1 for task in list(self._tasks.values())
+                   if task.status == QUEUED and (name is None or task.name == name))
+
+    def shutdown(self, wait=True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,238 @@
+"""
+PHI access audit log tests for MediConsult
+
+Test Coverage:
+1. Memory engine create_collection with time-series options
+2. Audit repository: time-series collection and queries by patient and actor
+3. Batched writes: flush on batch size, on the timer and on close
+4. Failed flushes keep events for the next one, bounded by max_buffer
+5. Consultation views record events; the admin audit page lists them
+6. The lab queue is not audited; collecting a sample is
+"""
+
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, CollectionInvalid, ConnectionFailure
+from streamlit.testing.v1 import AppTest
+
+from audit import AuditLogger
+from database import users, consultations, lab_requests, audit_log, AuditLogRepository
+from database.memory import MemoryDatabase
+from utils import get_audit_logger
+
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mediconsult_app.py")
+
+
+class FlakyRepository:
+    """insert_many that fails while down is set"""
+
+    def __init__(self):
+        self.down = False
+        self.batches = []
+
+    def insert_many(self, events):
+        if self.down:
+            raise ConnectionFailure("mongod unreachable")
+        self.batches.append(list(events))
+
+
+class AuditRepositoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MemoryDatabase()
+        self.audit_log = AuditLogRepository(self.db)
+        self.audit_log.ensure_indexes()
+
+    def test_time_series_collection(self):
+        options = self.audit_log.collection.options()
+        self.assertEqual(options["timeseries"]["timeField"], "at")
+        self.assertEqual(options["timeseries"]["metaField"], "meta")
+        self.assertGreater(options["expireAfterSeconds"], 0)
+        self.assertIn("audit_log", self.db.list_collection_names())
+        with self.assertRaises(CollectionInvalid):
+            self.db.create_collection("audit_log")
+        # Another replica starting up keeps the existing collection
+        self.audit_log.ensure_indexes()
+        self.assertEqual(self.audit_log.collection.options(), options)
+
+    def test_find_by_patient_and_actor(self):
+        patient, other, doctor, lab = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+        start = datetime(2026, 1, 1)
+        self.audit_log.insert_many([
+            {"at": start, "meta": {"patient_id": patient, "actor_id": doctor}, "action": "view_patient_record"},
+            {"at": start + timedelta(hours=1), "meta": {"patient_id": other, "actor_id": doctor},
+             "action": "view_consultation"},
+            {"at": start + timedelta(hours=2), "meta": {"patient_id": patient, "actor_id": lab},
+             "action": "view_lab_request"}
+        ])
+        self.assertEqual([e["action"] for e in self.audit_log.find(patient_id=patient)],
+                         ["view_lab_request", "view_patient_record"])
+        self.assertEqual([e["meta"]["patient_id"] for e in self.audit_log.find(actor_id=doctor)], [other, patient])
+        self.assertEqual(len(self.audit_log.find(patient_id=patient, actor_id=doctor)), 1)
+        self.assertEqual(len(self.audit_log.find(since=start + timedelta(minutes=30))), 2)
+        self.assertEqual(len(self.audit_log.find(limit=1)), 1)
+
+
+class AuditLoggerTests(unittest.TestCase):
+
+    def logger(self, repository, **options):
+        logger = AuditLogger(repository, **{"batch_size": 3, "flush_seconds": 60, **options})
+        self.addCleanup(logger.close)
+        return logger
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_flush_on_batch_size(self):
+        repository = FlakyRepository()
+        logger = self.logger(repository)
+        patient_id, doctor_id = ObjectId(), ObjectId()
+        logger.record("view_patient_record", doctor_id, patient_id, actor_type="doctor")
+        logger.record("view_consultation", doctor_id, patient_id, consultation_id=ObjectId())
+        time.sleep(0.05)
+        self.assertEqual(repository.batches, [])
+        logger.record("view_consultation", doctor_id, patient_id)
+        self.assertTrue(self.wait_for(lambda: repository.batches))
+        self.assertEqual(len(repository.batches[0]), 3)
+        event = repository.batches[0][0]
+        self.assertEqual(event["meta"], {"patient_id": patient_id, "actor_id": doctor_id})
+        self.assertEqual((event["action"], event["actor_type"]), ("view_patient_record", "doctor"))
+        self.assertIn("consultation_id", repository.batches[0][1])
+
+    def test_flush_on_timer(self):
+        repository = FlakyRepository()
+        logger = self.logger(repository, flush_seconds=0.05)
+        logger.record("view_patient_record", ObjectId(), ObjectId())
+        self.assertTrue(self.wait_for(lambda: repository.batches))
+        self.assertEqual(logger.pending(), 0)
+
+    def test_close_writes_remaining_events(self):
+        repository = FlakyRepository()
+        logger = AuditLogger(repository, batch_size=100, flush_seconds=60)
+        logger.record("view_patient_record", ObjectId(), ObjectId())
+        logger.close()
+        self.assertEqual(len(repository.batches), 1)
+        self.assertFalse(logger._thread.is_alive())
+        
+        # Late events during shutdown are written straight away
+        logger.record("view_patient_record", ObjectId(), ObjectId())
+        self.assertEqual(len(repository.batches), 2)
+
+    def test_failed_flush_keeps_events(self):
+        repository = FlakyRepository()
+        logger = self.logger(repository, batch_size=100, max_buffer=5)
+        repository.down = True
+        for i in range(3):
+            logger.record("view_patient_record", ObjectId(), ObjectId(), n=i)
+        self.assertEqual(logger.flush(), 0)
+        self.assertEqual(logger.pending(), 3)
+        
+        # The oldest are dropped once the buffer is full
+        for i in range(3, 7):
+            logger.record("view_patient_record", ObjectId(), ObjectId(), n=i)
+        logger.flush()
+        self.assertEqual(logger.pending(), 5)
+        self.assertEqual(logger.stats["dropped"], 2)
+        
+        repository.down = False
+        self.assertEqual(logger.flush(), 5)
+        self.assertEqual([event["n"] for event in repository.batches[0]], [2, 3, 4, 5, 6])
+        self.assertEqual(logger.stats["written"], 5)
+
+    def test_partial_bulk_failure_requeues_only_failed_events(self):
+        class PartialRepository(FlakyRepository):
+            def insert_many(self, events):
+                super().insert_many(events)
+                if len(events) == 3:
+                    raise BulkWriteError({"writeErrors": [
+                        {"index": 0, "code": 11000, "errmsg": "duplicate key"},
+                        {"index": 1, "code": 91, "errmsg": "shutdown in progress"}
+                    ]})
+        
+        logger = self.logger(PartialRepository(), batch_size=100)
+        for i in range(3):
+            logger.record("view_patient_record", ObjectId(), ObjectId(), n=i)
+        self.assertEqual(logger.flush(), 2)
+        self.assertEqual(logger.pending(), 1)
+        self.assertEqual(logger._buffer[0]["n"], 1)
+
+
+class AuditPageTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.doctor_id = users.create({"name": "Audited Doctor", "email": "audited-doctor@example.com",
+                                      "user_type": "doctor"})
+        cls.patient_id = users.create({"name": "Audited Patient", "email": "audited-patient@example.com",
+                                       "user_type": "patient"})
+        cls.admin_id = users.create({"name": "Audit Admin", "email": "audit-admin@example.com",
+                                     "user_type": "admin"})
+        cls.lab_id = users.create({"name": "Audit Lab", "email": "audit-lab@example.com", "user_type": "lab"})
+        cls.consultation_id = consultations.create({
+            "patient_id": cls.patient_id, "doctor_id": cls.doctor_id, "doctor_name": "Audited Doctor",
+            "symptoms": "Cough", "status": "pending", "created_at": datetime.utcnow()
+        })
+
+    def run_as(self, user_id, user_type, name, **state):
+        at = AppTest.from_file(APP_FILE, default_timeout=60)
+        at.session_state.logged_in = True
+        at.session_state.user_id = user_id
+        at.session_state.user_type = user_type
+        at.session_state.user_name = name
+        for key, value in state.items():
+            at.session_state[key] = value
+        return at.run()
+
+    def test_doctor_view_is_listed_for_admin(self):
+        # Listing the queue reads no clinical detail, so nothing is audited until a request is opened
+        get_audit_logger().flush()
+        doctor = self.run_as(self.doctor_id, "doctor", "Audited Doctor")
+        self.assertEqual(len(doctor.exception), 0)
+        self.assertEqual(get_audit_logger().pending(), 0)
+        
+        doctor = self.run_as(self.doctor_id, "doctor", "Audited Doctor",
+                             **{f"response_{self.consultation_id}": True})
+        self.assertEqual(len(doctor.exception), 0)
+        self.assertTrue(any("Cough" in markdown.value for markdown in doctor.markdown))
+        get_audit_logger().flush()
+        
+        admin = self.run_as(self.admin_id, "admin", "Audit Admin")
+        admin.sidebar.selectbox(key="navigation").select("Audit Log").run()
+        admin.selectbox(key="audit_patient").select(str(self.patient_id)).run()
+        self.assertEqual(len(admin.exception), 0)
+        rows = admin.dataframe[0].value
+        self.assertEqual(set(rows["Accessed by"]), {"Audited Doctor"})
+        self.assertIn("view_consultation", set(rows["Action"]))
+        self.assertIn(str(self.consultation_id), set(rows["Consultation"]))
+
+    
+    def test_lab_queue_audits_actions_only(self):
+        lab_requests.sync({"_id": self.consultation_id, "patient_id": self.patient_id,
+                           "doctor_id": self.doctor_id}, ["Audit CBC"])
+        request_id = next(request["_id"] for request in lab_requests.list_for_consultation(self.consultation_id)
+                          if request["test"] == "Audit CBC")
+        lab = self.run_as(self.lab_id, "lab", "Audit Lab")
+        self.assertEqual(len(lab.exception), 0)
+        get_audit_logger().flush()
+        self.assertEqual(audit_log.find(actor_id=self.lab_id), [])
+        
+        lab.button(key=f"collect_{request_id}").click().run()
+        self.assertEqual(len(lab.exception), 0)
+        get_audit_logger().flush()
+        self.assertEqual([(event["action"], event["lab_request_id"]) for event in audit_log.find(actor_id=self.lab_id)],
+                         [("collect_lab_sample", request_id)])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
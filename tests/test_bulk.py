@@ -0,0 +1,172 @@
+"""
+Bulk doctor action tests for MediConsult
+
+Test Coverage:
+1. bulk_write on the in-memory engine: counts, upserts, per-index errors, ordered vs unordered
+2. bulk_update: one bulk_write, per-item outcomes, pending counts, notifications, lab requests
+3. A consultation that leaves the queue between the read and the write is reported skipped
+4. The doctor's bulk mode applies a status and note template to the selected requests
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime
+from unittest import mock
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from streamlit.testing.v1 import AppTest
+
+from database import users, consultations, UserRepository, ConsultationRepository
+from database.generations import LocalGenerations, doctor_scope, patient_scope
+from database.memory import MemoryDatabase
+from encryption import FieldCipher, generate_master_key, is_encrypted
+
+
+class MemoryBulkWriteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = MemoryDatabase().get_collection("things")
+        self.collection.create_index("key", unique=True)
+
+    def test_counts(self):
+        self.collection.insert_one({"key": 1})
+        result = self.collection.bulk_write([
+            InsertOne({"key": 2}),
+            UpdateOne({"key": 1}, {"$set": {"value": "a"}}),
+            UpdateOne({"key": 3}, {"$set": {"value": "b"}}, upsert=True),
+            DeleteOne({"key": 2})
+        ])
+        self.assertEqual((result.inserted_count, result.matched_count, result.modified_count,
+                          result.upserted_count, result.deleted_count), (1, 1, 1, 1, 1))
+        self.assertEqual(list(result.upserted_ids), [2])
+        self.assertEqual(self.collection.count_documents({}), 2)
+
+    def test_errors_by_index(self):
+        self.collection.insert_one({"key": 1})
+        with self.assertRaises(BulkWriteError) as ordered:
+            self.collection.bulk_write([InsertOne({"key": 1}), InsertOne({"key": 2})])
+        self.assertEqual([error["index"] for error in ordered.exception.details["writeErrors"]], [0])
+        self.assertEqual(self.collection.count_documents({"key": 2}), 0)
+        
+        with self.assertRaises(BulkWriteError) as unordered:
+            self.collection.bulk_write([InsertOne({"key": 1}), InsertOne({"key": 2})], ordered=False)
+        self.assertEqual(unordered.exception.details["writeErrors"][0]["code"], 11000)
+        self.assertEqual(unordered.exception.details["nInserted"], 1)
+
+
+class BulkUpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        db = MemoryDatabase()
+        self.generations = LocalGenerations()
+        self.users = UserRepository(db)
+        self.consultations = ConsultationRepository(db, FieldCipher(db, master_key=generate_master_key()),
+                                                    self.generations)
+        self.consultations.ensure_indexes()
+        self.consultations.lab_requests.ensure_indexes()
+        self.doctor_id = self.users.create({"name": "Bulk Doctor", "email": "bulk@example.com",
+                                            "user_type": "doctor", "pending_count": 0})
+        self.patient_id = self.users.create({"name": "Bulk Patient", "email": "bulk-patient@example.com",
+                                             "user_type": "patient"})
+
+    def create(self, doctor_id=None, status="pending", **fields):
+        return self.consultations.create({"patient_id": self.patient_id, "doctor_id": doctor_id or self.doctor_id,
+                                          "doctor_name": "Bulk Doctor", "symptoms": "Cough", "status": status,
+                                          "created_at": datetime.utcnow(), **fields})
+
+    def pending_count(self):
+        return self.users.get_by_id(self.doctor_id)["pending_count"]
+
+    def test_one_bulk_write(self):
+        first, second = self.create(), self.create(lab_requests=["CBC"])
+        self.consultations.lab_requests.sync({"_id": second, "patient_id": self.patient_id,
+                                              "doctor_id": self.doctor_id}, ["CBC"])
+        completed = self.create(status="completed")
+        elsewhere = self.create(doctor_id=ObjectId())
+        self.assertEqual(self.pending_count(), 2)
+        before = self.generations.get(patient_scope(self.patient_id))
+        
+        fields = {"status": "completed", "consultation_notes": "Reviewed", "lab_requests": ["Chest X-ray", "CBC"]}
+        with mock.patch.object(self.consultations.collection, "bulk_write",
+                               wraps=self.consultations.collection.bulk_write) as bulk_write:
+            outcomes = self.consultations.bulk_update(self.doctor_id, {
+                consult_id: fields for consult_id in (first, second, completed, elsewhere)})
+        bulk_write.assert_called_once()
+        self.assertEqual(len(bulk_write.call_args.args[0]), 2)
+        self.assertEqual(outcomes, {first: "updated", second: "updated", completed: "skipped", elsewhere: "skipped"})
+        
+        stored = self.consultations.collection.find_one({"_id": first})
+        self.assertNotIn("bulk_update_id", stored)
+        self.assertTrue(is_encrypted(stored["consultation_notes"]))
+        self.assertEqual(stored["outbox"][-1]["event"], "consultation_updated")
+        self.assertEqual(self.consultations.get(first)["consultation_notes"], "Reviewed")
+        self.assertEqual(self.consultations.get(second)["lab_requests"], ["CBC", "Chest X-ray"])
+        self.assertEqual(len(self.consultations.lab_requests.list_for_consultation(second)), 2)
+        self.assertEqual(self.pending_count(), 0)
+        self.assertGreater(self.generations.get(patient_scope(self.patient_id)), before)
+        self.assertEqual(self.consultations.get(elsewhere)["status"], "pending")
+
+    def test_left_the_queue_after_the_read(self):
+        first, second = self.create(), self.create()
+        bulk_write = self.consultations.collection.bulk_write
+
+        def completed_meanwhile(requests, ordered=True):
+            self.consultations.update(second, {"status": "completed"})
+            return bulk_write(requests, ordered=ordered)
+        
+        before = self.generations.get(doctor_scope(self.doctor_id))
+        with mock.patch.object(self.consultations.collection, "bulk_write", side_effect=completed_meanwhile):
+            outcomes = self.consultations.bulk_update(self.doctor_id, {first: {"status": "in_progress"},
+                                                                       second: {"status": "in_progress"}})
+        self.assertEqual(outcomes, {first: "updated", second: "skipped"})
+        self.assertEqual(self.consultations.collection.count_documents({"bulk_update_id": {"$exists": True}}), 0)
+        self.assertEqual(self.consultations.get(second)["status"], "completed")
+        self.assertEqual(self.pending_count(), 0)
+        self.assertGreater(self.generations.get(doctor_scope(self.doctor_id)), before)
+
+
+class BulkModeTests(unittest.TestCase):
+
+    def test_apply_to_selected(self):
+        doctor_id = users.create({"name": "Bulk Mode Doctor", "email": f"bulk-{ObjectId()}@example.com",
+                                  "user_type": "doctor"})
+        consult_ids = {}
+        for name in ("Ana", "Ben", "Cy"):
+            patient_id = users.create({"name": name, "email": f"{ObjectId()}@example.com", "user_type": "patient"})
+            consult_ids[name] = consultations.create({"patient_id": patient_id, "doctor_id": doctor_id,
+                                                      "symptoms": "Itchy eyes", "status": "pending",
+                                                      "created_at": datetime.utcnow()})
+        
+        at = AppTest.from_file(os.path.join(APP_DIR, "pages", "admin_dashboard.py"), default_timeout=60)
+        at.session_state.logged_in = True
+        at.session_state.user_id = doctor_id
+        at.session_state.user_type = "doctor"
+        at.session_state.user_name = "Bulk Mode Doctor"
+        at.run()
+        at.toggle(key="bulk_mode").set_value(True).run()
+        self.assertEqual(len(at.expander), 0)
+        
+        at.multiselect(key="bulk_selection").select(consult_ids["Ana"]).select(consult_ids["Ben"])
+        at.selectbox(key="bulk_status").select("completed")
+        at.selectbox(key="bulk_note_template").select("Book a follow-up")
+        next(button for button in at.button if button.label == "Apply to Selected").click().run()
+        self.assertEqual(len(at.exception), 0)
+        
+        self.assertIn("2 consultations updated", [success.value for success in at.success])
+        self.assertTrue(any("Ben" in markdown.value for markdown in at.markdown))
+        self.assertEqual(consultations.get(consult_ids["Ana"])["consultation_notes"],
+                         "Dear Ana, please book a follow-up consultation so we can review your symptoms.")
+        self.assertEqual(consultations.get(consult_ids["Cy"])["status"], "pending")
+        self.assertEqual(at.multiselect(key="bulk_selection").options, ["🟢 Routine · Cy"])
+        self.assertEqual(at.header[0].value, "🆕 New Consultation Requests (1)")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,210 @@
+"""
+Cross-session query cache tests for MediConsult
+
+Test Coverage:
+1. Generation counters, in process and in the cache_generations collection
+2. Consultation and doctor writes bump the scopes they change
+3. Cached views (consultation detail included) are served until their scope's generation changes
+4. Writes to one doctor's consultations leave other doctors' caches alone
+5. User profile cache: no password, LRU eviction, invalidation on update and registration
+6. User cache statistics on /metrics
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+
+from database import users, consultations, generations, UserRepository, ConsultationRepository
+from encryption import KeyCache
+from metrics import CACHE_METRICS, collect
+from database.generations import (LocalGenerations, SharedGenerations, DIRECTORY_SCOPE, doctor_scope,
+                                  patient_scope)
+from database.memory import MemoryDatabase
+from utils import (get_pending_consultations, count_pending_consultations, get_consultation_summaries,
+                   get_all_doctors, get_user_profile, update_user_profile, get_consultation_detail)
+
+
+class GenerationCounterTests(unittest.TestCase):
+
+    def check_counters(self, counters):
+        self.assertEqual(counters.get("doctor:a"), (0, 0))
+        counters.bump("doctor:a", "patient:b")
+        counters.bump("doctor:a")
+        self.assertEqual(counters.get("doctor:a"), (0, 2))
+        self.assertEqual(counters.get("patient:b"), (0, 1))
+        counters.bump_all()
+        self.assertEqual(counters.get("doctor:c"), (1, 0))
+
+    def test_local(self):
+        self.check_counters(LocalGenerations())
+
+    def test_shared(self):
+        db = MemoryDatabase()
+        self.check_counters(SharedGenerations(db))
+        # Another replica reads the same counters
+        self.assertEqual(SharedGenerations(db).get("doctor:a"), (1, 2))
+        self.assertEqual(db.cache_generations.count_documents({}), 3)
+
+
+class RepositoryInvalidationTests(unittest.TestCase):
+
+    def setUp(self):
+        db = MemoryDatabase()
+        self.generations = LocalGenerations()
+        self.users = UserRepository(db, self.generations)
+        self.consultations = ConsultationRepository(db, generations=self.generations)
+        self.doctor_id = self.users.create({"name": "Doc", "email": "doc@example.com", "user_type": "doctor"})
+        self.patient_id = self.users.create({"name": "Pat", "email": "pat@example.com", "user_type": "patient"})
+
+    def test_doctor_registration_bumps_directory(self):
+        self.assertEqual(self.generations.get(DIRECTORY_SCOPE), (0, 1))
+
+    def test_consultation_writes_bump_doctor_and_patient(self):
+        consultation_id = self.consultations.create({"patient_id": self.patient_id, "doctor_id": self.doctor_id,
+                                                     "symptoms": "Cough", "status": "pending",
+                                                     "created_at": datetime.utcnow()})
+        self.assertEqual(self.generations.get(doctor_scope(self.doctor_id)), (0, 1))
+        self.assertEqual(self.generations.get(patient_scope(self.patient_id)), (0, 1))
+        
+        self.consultations.update(consultation_id, {"status": "completed"})
+        self.assertEqual(self.generations.get(doctor_scope(self.doctor_id)), (0, 2))
+        # Writing the same values again changes nothing, so nothing is invalidated
+        self.consultations.update(consultation_id, {"status": "completed"})
+        self.assertEqual(self.generations.get(patient_scope(self.patient_id)), (0, 2))
+
+
+class GenerationalCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.doctor_id = users.create({"name": "Cached Doctor", "email": f"cached-{ObjectId()}@example.com",
+                                       "user_type": "doctor"})
+        self.other_doctor_id = users.create({"name": "Other Doctor", "email": f"other-{ObjectId()}@example.com",
+                                             "user_type": "doctor"})
+        self.patient_id = ObjectId()
+
+    def create(self, doctor_id):
+        return consultations.create({"patient_id": self.patient_id, "doctor_id": doctor_id, "symptoms": "Cough",
+                                     "status": "pending", "created_at": datetime.utcnow()})
+
+    def test_served_from_cache_until_a_write(self):
+        first = self.create(self.doctor_id)
+        self.assertEqual([c["_id"] for c in get_pending_consultations(self.doctor_id)], [first])
+        self.assertEqual(count_pending_consultations(self.doctor_id), 1)
+        
+        # A write that bypasses the repository is not seen: the result came from the cache
+        consultations.collection.insert_one({"patient_id": self.patient_id, "doctor_id": self.doctor_id,
+                                             "status": "pending", "created_at": datetime.utcnow()})
+        self.assertEqual(count_pending_consultations(self.doctor_id), 1)
+        
+        second = self.create(self.doctor_id)
+        self.assertEqual(count_pending_consultations(self.doctor_id), 3)
+        self.assertIn(second, [c["_id"] for c in get_pending_consultations(self.doctor_id)])
+        consultations.update(second, {"status": "completed"})
+        self.assertEqual(count_pending_consultations(self.doctor_id), 2)
+
+    def test_other_scopes_stay_cached(self):
+        self.create(self.doctor_id)
+        other = self.create(self.other_doctor_id)
+        self.assertEqual(len(get_consultation_summaries({"doctor_id": self.doctor_id})), 1)
+        before = generations.get(doctor_scope(self.doctor_id))
+        consultations.update(other, {"status": "completed"})
+        self.assertEqual(generations.get(doctor_scope(self.doctor_id)), before)
+        # The patient's history is invalidated by either doctor's write
+        statuses = {c["_id"]: c["status"] for c in get_consultation_summaries({"patient_id": self.patient_id})}
+        self.assertEqual(statuses[other], "completed")
+
+    def test_consultation_detail(self):
+        consult_id = self.create(self.doctor_id)
+        self.assertEqual(get_consultation_detail(consult_id, self.patient_id)["status"], "pending")
+        consultations.collection.update_one({"_id": consult_id}, {"$set": {"status": "unseen"}})
+        self.assertEqual(get_consultation_detail(consult_id, self.patient_id)["status"], "pending")
+        
+        # A write on any replica bumps the patient's shared generation, so no .clear() is needed
+        consultations.update(consult_id, {"status": "completed", "diagnosis": "Flu"})
+        detail = get_consultation_detail(consult_id, self.patient_id)
+        self.assertEqual((detail["status"], detail["diagnosis"]), ("completed", "Flu"))
+
+    def test_directory(self):
+        names = {doctor["name"] for doctor in get_all_doctors()}
+        self.assertIn("Cached Doctor", names)
+        self.assertTrue(all("password" not in doctor for doctor in get_all_doctors()))
+        users.create({"name": "New Doctor", "email": f"new-{ObjectId()}@example.com", "user_type": "doctor"})
+        self.assertIn("New Doctor", {doctor["name"] for doctor in get_all_doctors()})
+        
+        generations.bump_all()
+        self.assertIn("New Doctor", {doctor["name"] for doctor in get_all_doctors()})
+
+
+class UserCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MemoryDatabase()
+        self.generations = LocalGenerations()
+        self.users = UserRepository(self.db, self.generations, KeyCache(ttl=60, max_size=2))
+        self.doctor_id = self.users.create({"name": "Doc", "email": "doc@example.com", "password": "hash",
+                                            "user_type": "doctor", "pending_count": 3})
+
+    def test_profile_is_cached_without_password(self):
+        profile = self.users.get_profile(self.doctor_id)
+        self.assertEqual(profile["name"], "Doc")
+        self.assertNotIn("password", profile)
+        self.assertNotIn("pending_count", profile)
+        
+        # Served from the cache: a write that bypasses the repository is not seen
+        self.db.users.update_one({"_id": self.doctor_id}, {"$set": {"name": "Changed"}})
+        profile["name"] = "Mutated"
+        self.assertEqual(self.users.get_profile(self.doctor_id)["name"], "Doc")
+        self.assertEqual(self.users.cache.stats, {"hits": 1, "misses": 1, "evictions": 0})
+        self.assertIsNone(self.users.get_profile(ObjectId()))
+
+    def test_update_invalidates(self):
+        self.users.get_profile(self.doctor_id)
+        before = self.generations.get(DIRECTORY_SCOPE)
+        self.assertTrue(self.users.update_profile(self.doctor_id, {"qualifications": "MD"}))
+        self.assertEqual(self.users.get_profile(self.doctor_id)["qualifications"], "MD")
+        # The directory lists doctors' profiles too
+        self.assertEqual(self.generations.get(DIRECTORY_SCOPE), (0, before[1] + 1))
+        self.assertFalse(self.users.update_profile(ObjectId(), {"name": "Nobody"}))
+
+    def test_registration_invalidates(self):
+        user_id = ObjectId()
+        self.users.cache.put(user_id, {"_id": user_id, "name": "Stale"})
+        self.users.create({"_id": user_id, "name": "Fresh", "email": "fresh@example.com", "user_type": "patient"})
+        self.assertEqual(self.users.get_profile(user_id)["name"], "Fresh")
+
+    def test_least_recently_used_is_evicted(self):
+        patients = [self.users.create({"name": f"P{i}", "email": f"p{i}@example.com", "user_type": "patient"})
+                    for i in range(2)]
+        self.users.get_profile(self.doctor_id)
+        for patient_id in patients:
+            self.users.get_profile(patient_id)
+        self.assertEqual(len(self.users.cache), 2)
+        self.assertEqual(self.users.cache.stats["evictions"], 1)
+        self.users.get_profile(patients[1])
+        self.assertEqual(self.users.cache.stats["hits"], 1)
+
+    def test_shared_profile_and_metrics(self):
+        user_id = users.create({"name": "Metered", "email": f"metered-{ObjectId()}@example.com",
+                                "password": "hash", "user_type": "patient"})
+        before = collect(CACHE_METRICS)
+        get_user_profile(user_id)
+        get_user_profile(user_id)
+        change = {name: value - before[name] for name, value in collect(CACHE_METRICS).items()}
+        self.assertEqual(change["mediconsult_user_cache_misses_total"], 1)
+        self.assertEqual(change["mediconsult_user_cache_hits_total"], 1)
+        self.assertEqual(change["mediconsult_user_cache_entries"], 1)
+        
+        self.assertTrue(update_user_profile(user_id, phone="+15550100"))
+        self.assertEqual(get_user_profile(user_id)["phone"], "+15550100")
+        with self.assertRaises(ValueError):
+            update_user_profile(user_id, password="plain")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
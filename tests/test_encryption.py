@@ -0,0 +1,230 @@
+"""
+Field encryption tests for MediConsult
+
+Test Coverage:
+1. AES-GCM round trip, fresh nonce per value, field and tamper checks
+2. Per-patient data keys, stored wrapped under the master key file, which is never created implicitly
+3. Data key cache lifetime and size bounds
+4. Repository: clinical text encrypted at rest, decrypted only where projected
+5. Updates notify only on real changes; patient records are encrypted too
+6. Migration of plaintext consultations
+"""
+
+import os
+import stat
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+from cryptography.exceptions import InvalidTag
+
+from database import ConsultationRepository
+from database.memory import MemoryDatabase
+from encryption import (FieldCipher, KeyCache, DataKeyMissing, ENCRYPTED_FIELDS, is_encrypted,
+                        generate_master_key, load_master_key, create_master_key, MasterKeyMissing)
+from migrations import migrate_field_encryption
+
+CLINICAL_TEXT = {
+    "symptoms": "Chest tightness on exertion",
+    "diagnosis": "Stable angina",
+    "prescription": "Aspirin 75mg OD",
+    "consultation_notes": "Review in two weeks"
+}
+
+
+class FieldCipherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MemoryDatabase()
+        self.cipher = FieldCipher(self.db, master_key=generate_master_key())
+        self.cipher.ensure_indexes()
+        self.patient_id = ObjectId()
+
+    def test_round_trip(self):
+        first = self.cipher.encrypt(self.patient_id, "symptoms", "Headache")
+        second = self.cipher.encrypt(self.patient_id, "symptoms", "Headache")
+        self.assertTrue(is_encrypted(first))
+        self.assertNotEqual(first, second)
+        self.assertNotIn(b"Headache", bytes(first))
+        self.assertEqual(self.cipher.decrypt("symptoms", first), "Headache")
+        self.assertEqual(self.cipher.decrypt("symptoms", "legacy plaintext"), "legacy plaintext")
+        self.assertIsNone(self.cipher.encrypt(self.patient_id, "diagnosis", None))
+
+    def test_value_is_bound_to_its_field(self):
+        value = self.cipher.encrypt(self.patient_id, "diagnosis", "Migraine")
+        with self.assertRaises(InvalidTag):
+            self.cipher.decrypt("prescription", value)
+        tampered = type(value)(bytes(value[:-1]) + bytes([value[-1] ^ 1]), value.subtype)
+        with self.assertRaises(InvalidTag):
+            self.cipher.decrypt("diagnosis", tampered)
+
+    def test_one_wrapped_data_key_per_patient(self):
+        other_patient = ObjectId()
+        self.cipher.encrypt(self.patient_id, "symptoms", "a")
+        self.cipher.encrypt(self.patient_id, "diagnosis", "b")
+        self.cipher.encrypt(other_patient, "symptoms", "c")
+        keys = list(self.cipher.keys.find({}))
+        self.assertEqual(sorted(key["patient_id"] for key in keys), sorted([self.patient_id, other_patient]))
+        # 12-byte nonce + 32-byte key + 16-byte tag: the data key is never stored in the clear
+        self.assertTrue(all(len(key["wrapped_key"]) == 60 for key in keys))
+        
+        # Another replica with the same master key reads values written here
+        value = self.cipher.encrypt(other_patient, "symptoms", "Cough")
+        replica = FieldCipher(self.db, master_key=self.cipher._master_key)
+        self.assertEqual(replica.decrypt("symptoms", value), "Cough")
+        stranger = FieldCipher(self.db, master_key=generate_master_key())
+        with self.assertRaises(InvalidTag):
+            stranger.decrypt("symptoms", value)
+
+    def test_missing_data_key(self):
+        value = self.cipher.encrypt(self.patient_id, "symptoms", "Cough")
+        self.cipher.keys.delete_many({})
+        self.cipher.cache.clear()
+        with self.assertRaises(DataKeyMissing):
+            self.cipher.decrypt("symptoms", value)
+
+    def test_master_key_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "keys", "master.key")
+            # A missing key is never replaced by a new one, which would orphan every data key
+            with self.assertRaises(MasterKeyMissing):
+                load_master_key(path)
+            with self.assertRaises(MasterKeyMissing):
+                FieldCipher(self.db, key_file=path).encrypt(self.patient_id, "symptoms", "Rash")
+            self.assertFalse(os.path.exists(path))
+            
+            key = create_master_key(path)
+            self.assertEqual(len(key), 32)
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+            self.assertEqual(load_master_key(path), key)
+            with self.assertRaises(FileExistsError):
+                create_master_key(path)
+            
+            cipher = FieldCipher(self.db, key_file=path)
+            value = cipher.encrypt(self.patient_id, "symptoms", "Rash")
+            self.assertEqual(FieldCipher(self.db, key_file=path).decrypt("symptoms", value), "Rash")
+
+
+class KeyCacheTests(unittest.TestCase):
+
+    def test_entries_expire(self):
+        cache = KeyCache(ttl=0.05, max_size=10)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats["hits"], 1)
+        self.assertEqual(cache.stats["misses"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = KeyCache(ttl=60, max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_cipher_rereads_expired_keys(self):
+        db = MemoryDatabase()
+        cipher = FieldCipher(db, master_key=generate_master_key(), cache=KeyCache(ttl=0.05))
+        value = cipher.encrypt(ObjectId(), "symptoms", "Fever")
+        misses = cipher.cache.stats["misses"]
+        time.sleep(0.06)
+        self.assertEqual(cipher.decrypt("symptoms", value), "Fever")
+        self.assertEqual(cipher.cache.stats["misses"], misses + 1)
+
+
+class EncryptedRepositoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MemoryDatabase()
+        self.cipher = FieldCipher(self.db, master_key=generate_master_key())
+        self.consultations = ConsultationRepository(self.db, self.cipher)
+        self.consultations.ensure_indexes()
+        self.patient_id = ObjectId()
+        self.doctor_id = self.db.users.insert_one({"name": "Doctor", "user_type": "doctor"}).inserted_id
+
+    def create(self, **fields):
+        return self.consultations.create({
+            "patient_id": self.patient_id, "doctor_id": self.doctor_id, "status": "pending",
+            "created_at": datetime.utcnow(), **fields
+        })
+
+    def test_clinical_text_encrypted_at_rest(self):
+        consultation_id = self.create(**CLINICAL_TEXT, allergies=["penicillin"])
+        stored = self.consultations.collection.find_one({"_id": consultation_id})
+        for field in ENCRYPTED_FIELDS:
+            self.assertTrue(is_encrypted(stored[field]), field)
+        self.assertEqual(stored["allergies"], ["penicillin"])
+        self.assertEqual({field: self.consultations.get(consultation_id)[field] for field in ENCRYPTED_FIELDS},
+                         CLINICAL_TEXT)
+        self.assertEqual(self.consultations.list_for_patient(self.patient_id)[0]["symptoms"], CLINICAL_TEXT["symptoms"])
+
+    def test_only_projected_fields_are_decrypted(self):
+        self.create(**CLINICAL_TEXT)
+        self.cipher.cache.clear()
+        stats = dict(self.cipher.cache.stats)
+        summaries = self.consultations.find({"patient_id": self.patient_id}, {"status": 1, "created_at": 1})
+        self.assertNotIn("symptoms", summaries[0])
+        self.consultations.find({"patient_id": self.patient_id}, {"_id": 1})
+        self.consultations.find({"patient_id": self.patient_id}, {"symptoms": 0, "diagnosis": 0,
+                                                                  "prescription": 0, "consultation_notes": 0})
+        self.assertEqual(self.cipher.cache.stats, stats)
+        
+        [consult] = self.consultations.find({"patient_id": self.patient_id}, {"diagnosis": 1})
+        self.assertEqual(consult["diagnosis"], "Stable angina")
+        self.assertEqual(self.cipher.cache.stats["misses"], stats["misses"] + 1)
+
+    def test_update_notifies_only_on_change(self):
+        consultation_id = self.create(symptoms="Cough")
+        self.assertTrue(self.consultations.update(consultation_id, {"diagnosis": "Bronchitis"}))
+        self.assertFalse(self.consultations.update(consultation_id, {"diagnosis": "Bronchitis"}))
+        stored = self.consultations.collection.find_one({"_id": consultation_id})
+        self.assertTrue(is_encrypted(stored["diagnosis"]))
+        self.assertEqual([entry["event"] for entry in stored["outbox"]],
+                         ["consultation_requested", "consultation_updated"])
+        self.assertFalse(self.consultations.update(ObjectId(), {"diagnosis": "Bronchitis"}))
+
+    def test_patient_record_is_encrypted(self):
+        consultation_id = self.create(symptoms="Wheeze")
+        self.consultations.update(consultation_id, {"status": "completed", "diagnosis": "Asthma",
+                                                    "prescription": "Salbutamol inhaler PRN"})
+        stored = self.consultations.records.collection.find_one({"_id": self.patient_id})
+        self.assertTrue(is_encrypted(stored["diagnoses"][0]["diagnosis"]))
+        self.assertTrue(is_encrypted(stored["prescriptions"][0]["prescription"]))
+        record = self.consultations.records.get(self.patient_id)
+        self.assertEqual(record["diagnoses"][0]["diagnosis"], "Asthma")
+        self.assertEqual(record["prescriptions"][0]["prescription"], "Salbutamol inhaler PRN")
+
+    def test_migration_encrypts_plaintext(self):
+        plain = ConsultationRepository(self.db)
+        consultation_id = plain.create({"patient_id": self.patient_id, "doctor_id": self.doctor_id,
+                                        "status": "pending", "created_at": datetime.utcnow(), **CLINICAL_TEXT})
+        plain.update(consultation_id, {"status": "completed"})
+        self.create(symptoms="Already encrypted")
+        
+        self.assertEqual(migrate_field_encryption(dry_run=True, consultations=self.consultations),
+                         {"scanned": 2, "encrypted": 1, "batches": 1, "records_rebuilt": 1})
+        self.assertFalse(is_encrypted(plain.collection.find_one({"_id": consultation_id})["symptoms"]))
+        
+        counts = migrate_field_encryption(batch_size=1, consultations=self.consultations)
+        self.assertEqual((counts["encrypted"], counts["batches"]), (1, 2))
+        stored = self.consultations.collection.find_one({"_id": consultation_id})
+        self.assertTrue(all(is_encrypted(stored[field]) for field in ENCRYPTED_FIELDS))
+        self.assertEqual(self.consultations.get(consultation_id)["prescription"], CLINICAL_TEXT["prescription"])
+        record = self.consultations.records.collection.find_one({"_id": self.patient_id})
+        self.assertTrue(is_encrypted(record["diagnoses"][0]["diagnosis"]))
+        self.assertEqual(migrate_field_encryption(consultations=self.consultations)["encrypted"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
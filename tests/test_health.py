@@ -0,0 +1,152 @@
+"""
+Health endpoint tests for MediConsult
+
+Test Coverage:
+1. Readiness: Mongo ping latency, pool availability, warm state
+2. Liveness: wedged script runner detection, also beside runs that finish
+3. Connection pool monitoring from CMAP events
+4. /readyz and /livez over HTTP; /sessions only on the loopback diagnostics port
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from database.connection import PoolMonitor
+from database.memory import MemoryDatabase
+from health import (check_mongo, check_warm, check_script_runner, readiness, liveness,
+                    start_health_server, start_diagnostics_server)
+from startup import WARM_STATE, ACTIVE_RUNS, script_run
+
+
+class SlowDatabase:
+    def command(self, name):
+        time.sleep(0.05)
+        return {"ok": 1.0}
+
+
+class HealthCheckTests(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(WARM_STATE.update, dict(WARM_STATE))
+
+    def test_mongo_ping_budget(self):
+        self.assertTrue(check_mongo(MemoryDatabase(), budget_ms=50)[0])
+        ok, details = check_mongo(SlowDatabase(), budget_ms=10)
+        self.assertFalse(ok)
+        self.assertGreaterEqual(details["latency_ms"], 10)
+
+    def test_not_ready_until_warm(self):
+        WARM_STATE["warm"] = False
+        ok, details = readiness()
+        self.assertFalse(ok)
+        self.assertFalse(details["warm"]["ok"])
+        WARM_STATE["warm"] = True
+        self.assertTrue(readiness()[0])
+        self.assertTrue(check_warm()[0])
+
+    def test_wedged_script_runner(self):
+        now = time.monotonic()
+        self.assertTrue(check_script_runner({"ScriptRunner.scriptThread": now - 5}, 60, now)[0])
+        ok, details = check_script_runner({"ScriptRunner.scriptThread": now - 300}, 60, now)
+        self.assertFalse(ok)
+        self.assertEqual(details["active_runs"], 1)
+
+    def test_script_run_is_tracked(self):
+        with script_run():
+            self.assertEqual(len(ACTIVE_RUNS), 1)
+        self.assertEqual(ACTIVE_RUNS, {})
+        self.assertTrue(liveness()[0])
+
+    def test_wedged_run_beside_a_finished_one(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def wedged():
+            with script_run():
+                started.set()
+                release.wait(5)
+        
+        # Streamlit gives every script thread this name
+        thread = threading.Thread(target=wedged, name="ScriptRunner.scriptThread")
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        started.wait(5)
+        
+        def finishes():
+            with script_run():
+                pass
+        
+        finished = threading.Thread(target=finishes, name="ScriptRunner.scriptThread")
+        finished.start()
+        finished.join()
+        ok, details = check_script_runner(now=time.monotonic() + 300)
+        self.assertFalse(ok)
+        self.assertEqual(details["active_runs"], 1)
+
+    def test_pool_monitor(self):
+        monitor = PoolMonitor()
+        event = SimpleNamespace(address=("mongodb", 27017))
+        self.assertFalse(monitor.available(2))
+        monitor.pool_created(event)
+        monitor.pool_ready(event)
+        self.assertTrue(monitor.available(2))
+        monitor.connection_checked_out(event)
+        monitor.connection_checked_out(event)
+        self.assertFalse(monitor.available(2))
+        monitor.connection_checked_in(event)
+        self.assertTrue(monitor.available(2))
+        monitor.pool_cleared(event)
+        self.assertFalse(monitor.available(2))
+
+
+class HealthServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_health_server(port=0, host="127.0.0.1")
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(WARM_STATE.update, dict(WARM_STATE))
+
+    def get(self, path):
+        url = f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b"null")
+
+    def test_endpoints(self):
+        WARM_STATE["warm"] = False
+        status, body = self.get("/readyz")
+        self.assertEqual(status, 503)
+        self.assertFalse(body["checks"]["warm"]["ok"])
+        WARM_STATE["warm"] = True
+        self.assertEqual(self.get("/readyz")[0], 200)
+        self.assertEqual(self.get("/livez")[0], 200)
+    
+    def test_sessions_only_on_loopback(self):
+        with self.assertRaises(urllib.error.HTTPError) as missing:
+            urllib.request.urlopen(f"http://127.0.0.1:{self.server.server_address[1]}/sessions", timeout=5)
+        self.assertEqual(missing.exception.code, 404)
+        diagnostics = start_diagnostics_server(port=0)
+        self.addCleanup(diagnostics.server_close)
+        self.addCleanup(diagnostics.shutdown)
+        self.assertEqual(diagnostics.server_address[0], "127.0.0.1")
+        url = f"http://127.0.0.1:{diagnostics.server_address[1]}/sessions"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            self.assertEqual(json.loads(response.read())["sessions"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
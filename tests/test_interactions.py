@@ -0,0 +1,100 @@
+"""
+Prescription safety check tests for MediConsult
+
+Test Coverage:
+1. Drug names and synonyms found in free text, longest match first
+2. Allergy conflicts, including class cross-reactivity and allergy synonyms
+3. Drug-drug interactions within a prescription and with active prescriptions
+4. Check latency on a long prescription
+5. Batch audit of historical prescriptions
+"""
+
+import os
+import sys
+import time
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+
+from database import ConsultationRepository
+from database.memory import MemoryDatabase
+from interactions import InteractionChecker, get_checker, check_prescription
+from interactions.audit import audit_prescriptions
+
+DATA = {
+    "drug_classes": {"penicillins": ["amoxicillin", "co-amoxiclav"], "cephalosporins": ["cephalexin"],
+                     "nsaids": ["ibuprofen", "aspirin"], "anticoagulants": ["warfarin"]},
+    "drug_synonyms": {"co-amoxiclav": ["augmentin", "amoxicillin clavulanate"], "ibuprofen": ["advil"]},
+    "allergen_conflicts": [
+        {"allergen": "PCN", "classes": ["penicillins"], "severity": "high", "reason": "penicillin allergy"},
+        {"allergen": "penicillin", "classes": ["cephalosporins"], "severity": "moderate", "reason": "cross"}
+    ],
+    "drug_interactions": [{"a": "anticoagulants", "b": "nsaids", "severity": "high", "reason": "bleeding"}]
+}
+
+
+class InteractionCheckerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = InteractionChecker(DATA)
+
+    def test_finds_drugs_in_free_text(self):
+        self.assertEqual(self.checker.drugs("Amoxicillin clavulanate 625mg TDS; Advil 400 mg PRN, amoxicillin"),
+                         ["co-amoxiclav", "ibuprofen", "amoxicillin"])
+        self.assertEqual(self.checker.drugs("rest and fluids"), [])
+
+    def test_allergy_conflicts(self):
+        conflicts = self.checker.check("Augmentin and cephalexin", allergies=["Penicillins"])
+        self.assertEqual([(c["drug"], c["conflicts_with"], c["severity"]) for c in conflicts],
+                         [("co-amoxiclav", "penicillin", "high"), ("cephalexin", "penicillin", "moderate")])
+        self.assertEqual(self.checker.check("Augmentin", allergies=["latex"]), [])
+
+    def test_drug_interactions(self):
+        conflicts = self.checker.check("Ibuprofen 400mg", current_prescriptions=["Warfarin 5mg daily"])
+        self.assertEqual([(c["kind"], c["drug"], c["conflicts_with"]) for c in conflicts],
+                         [("interaction", "ibuprofen", "warfarin")])
+        self.assertEqual(len(self.checker.check("warfarin, aspirin")), 1)
+        self.assertEqual(self.checker.check("ibuprofen, aspirin"), [])
+
+    def test_bundled_dataset(self):
+        conflicts = check_prescription("Bactrim DS twice daily", allergies=["sulfa drugs"])
+        self.assertEqual(conflicts[0]["drug"], "trimethoprim-sulfamethoxazole")
+        self.assertEqual(conflicts[0]["conflicts_with"], "sulfonamides")
+        self.assertIs(get_checker(), get_checker())
+
+    def test_check_is_fast(self):
+        checker = get_checker()
+        prescription = "Augmentin 625 mg three times daily for 7 days, then ibuprofen 400 mg as needed. " * 10
+        start = time.perf_counter()
+        for _ in range(100):
+            checker.check(prescription, ["penicillin", "aspirin", "latex"], ["warfarin 5 mg", "sertraline 50 mg"])
+        self.assertLess((time.perf_counter() - start) / 100, 0.005)
+
+
+class PrescriptionAuditTests(unittest.TestCase):
+
+    def test_audit(self):
+        consultations = ConsultationRepository(MemoryDatabase())
+        consultations.ensure_indexes()
+        patient_id = ObjectId()
+        flagged = consultations.create({"patient_id": patient_id, "prescription": "Augmentin", "allergies": ["PCN"],
+                                        "status": "completed", "created_at": datetime.utcnow()})
+        # The allergy was only recorded later, on another consultation
+        later = consultations.create({"patient_id": patient_id, "prescription": "cephalexin", "status": "completed",
+                                      "created_at": datetime.utcnow()})
+        consultations.create({"patient_id": ObjectId(), "prescription": "Augmentin", "status": "completed",
+                              "created_at": datetime.utcnow()})
+        consultations.create({"patient_id": patient_id, "status": "pending", "created_at": datetime.utcnow()})
+        
+        rows = list(audit_prescriptions(batch_size=1, consultations=consultations,
+                                        checker=InteractionChecker(DATA)))
+        self.assertEqual([(row["consultation_id"], row["known_at_time"]) for row in rows],
+                         [(flagged, True), (later, False)])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
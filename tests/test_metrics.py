@@ -0,0 +1,256 @@
+"""
+Autoscaling metrics tests for MediConsult
+
+Test Coverage:
+1. Gauges: in-flight reruns (concurrent and fragment runs) and the password hashing queue
+2. /metrics in Prometheus text format on the health server
+3. Custom-metrics HPA and prometheus-adapter rules match the exported names
+4. HPA replica calculation replayed on stubbed per-pod metric values; cache metrics stay out of it
+5. Per-session memory accounting; sessions hold ids, not documents
+"""
+
+import math
+import os
+import re
+import sys
+import threading
+import unittest
+import urllib.request
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+try:
+    import yaml
+except ImportError:  # PyYAML is only needed to read the manifests
+    yaml = None
+
+from health import start_health_server
+from metrics import GAUGES, EXPORTED, HASHING, collect, render, session_report
+from startup import script_run
+from config import TASK_THREADS
+from utils import hash_password, get_task_executor, get_user_profile
+from database import users
+
+HPA_FILE = os.path.join(APP_DIR, "k8s", "web-hpa-custom-metrics.yaml")
+ADAPTER_FILE = os.path.join(APP_DIR, "k8s", "prometheus-adapter-config.yaml")
+SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*) (-?[0-9.eE+]+)$")
+
+# kube-controller-manager --horizontal-pod-autoscaler-tolerance default
+HPA_TOLERANCE = 0.1
+
+
+def parse_exposition(text):
+    """{name: value} from Prometheus text, failing on malformed lines"""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        match = SAMPLE.match(line)
+        if not match:
+            raise ValueError(f"Malformed sample: {line!r}")
+        samples[match.group(1)] = float(match.group(2))
+    return samples
+
+
+def series_names(rule):
+    """The __name__ regex of a prometheus-adapter rule's seriesQuery"""
+    return re.search(r'__name__=~"([^"]+)"', rule["seriesQuery"]).group(1)
+
+
+def desired_replicas(hpa, current_replicas, pod_values):
+    """The autoscaling/v2 controller's answer for Pods metrics, as in the Kubernetes docs.
+    
+    pod_values maps a metric name to its value on each current pod, standing
+    in for what prometheus-adapter would return from custom.metrics.k8s.io.
+    """
+    spec = hpa["spec"]
+    proposals = []
+    for metric in spec["metrics"]:
+        if metric["type"] != "Pods":
+            continue
+        values = pod_values[metric["pods"]["metric"]["name"]]
+        ratio = (sum(values) / len(values)) / float(metric["pods"]["target"]["averageValue"])
+        if abs(ratio - 1.0) <= HPA_TOLERANCE:
+            proposals.append(current_replicas)
+        else:
+            proposals.append(math.ceil(current_replicas * ratio))
+    return max(spec["minReplicas"], min(spec["maxReplicas"], max(proposals)))
+
+
+class GaugeTests(unittest.TestCase):
+
+    def test_inflight_reruns(self):
+        with script_run():
+            self.assertEqual(collect()["mediconsult_inflight_reruns"], 1)
+        self.assertEqual(collect()["mediconsult_inflight_reruns"], 0)
+
+    def test_concurrent_reruns(self):
+        release = threading.Event()
+        started = threading.Barrier(3)
+
+        def run():
+            with script_run():
+                started.wait(5)
+                release.wait(5)
+        
+        # Named as Streamlit names every script thread
+        threads = [threading.Thread(target=run, name="ScriptRunner.scriptThread") for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        try:
+            self.assertEqual(collect()["mediconsult_inflight_reruns"], 2)
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(collect()["mediconsult_inflight_reruns"], 0)
+
+    def test_fragment_reruns_under_the_runtime(self):
+        from streamlit import runtime
+        from streamlit.runtime.app_session import AppSessionState
+        sessions = [SimpleNamespace(session=SimpleNamespace(_state=state)) for state in (
+            AppSessionState.APP_IS_RUNNING, AppSessionState.APP_IS_RUNNING, AppSessionState.APP_NOT_RUNNING)]
+        instance = SimpleNamespace(_session_mgr=SimpleNamespace(list_active_sessions=lambda: sessions,
+                                                                num_active_sessions=lambda: len(sessions)))
+        with mock.patch.object(runtime, "exists", return_value=True), \
+                mock.patch.object(runtime, "get_instance", return_value=instance):
+            self.assertEqual(collect()["mediconsult_inflight_reruns"], 2)
+
+    def test_hashing_queue_counts_running_and_queued(self):
+        self.assertEqual(collect()["mediconsult_hashing_queue_depth"], 0)
+        with HASHING.track():
+            self.assertEqual(collect()["mediconsult_hashing_queue_depth"], 1)
+        
+        # Fill every worker so the registration stays queued
+        executor = get_task_executor()
+        release = threading.Event()
+        blockers = [executor.submit(release.wait, 5) for _ in range(TASK_THREADS)]
+        queued = executor.submit(hash_password, "secret", name="register")
+        try:
+            self.assertEqual(collect()["mediconsult_hashing_queue_depth"], 1)
+        finally:
+            release.set()
+        for task_id in (*blockers, queued):
+            executor.get(task_id).future.result(timeout=10)
+        self.assertEqual(collect()["mediconsult_hashing_queue_depth"], 0)
+
+    def test_active_sessions_without_runtime(self):
+        self.assertEqual(collect()["mediconsult_active_sessions"], 0)
+
+
+class MetricsEndpointTests(unittest.TestCase):
+
+    def test_exposition_format(self):
+        server = start_health_server(port=0, host="127.0.0.1")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            text = response.read().decode('utf-8')
+        self.assertEqual(set(parse_exposition(text)), set(EXPORTED))
+        for name in GAUGES:
+            self.assertIn(f"# TYPE {name} gauge", text)
+        self.assertIn("# TYPE mediconsult_user_cache_hits_total counter", text)
+        self.assertIn("# TYPE mediconsult_user_cache_entries gauge", text)
+
+    def test_render_round_trips(self):
+        values = {"mediconsult_active_sessions": 12, "mediconsult_inflight_reruns": 0.5}
+        self.assertEqual(parse_exposition(render(values)), values)
+
+
+class SessionMemoryTests(unittest.TestCase):
+
+    def test_session_report(self):
+        small = SimpleNamespace(filtered_state={"user_id": "a" * 24, "logged_in": True})
+        large = SimpleNamespace(filtered_state={"user_id": "b" * 24, "notes": "x" * 10000})
+        report = session_report({"small": small, "large": large}, top_keys=1)
+        self.assertEqual(report["sessions"], 2)
+        self.assertEqual([session["session"] for session in report["by_session"]], ["large", "small"])
+        self.assertEqual(list(report["by_session"][0]["largest"]), ["notes"])
+        self.assertGreater(report["by_session"][0]["bytes"], 10000)
+        self.assertEqual(report["sessions_per_gib"], 1024 ** 3 // report["mean_bytes"])
+        self.assertEqual(session_report({})["sessions_per_gib"], None)
+
+    def test_user_profile_has_no_password(self):
+        user_id = users.create({"name": "Profile", "email": "profile@example.com",
+                                "password": "hash", "user_type": "patient"})
+        self.assertEqual(get_user_profile(user_id)["name"], "Profile")
+        self.assertNotIn("password", get_user_profile(user_id))
+
+    def test_booking_keeps_only_the_doctor_id(self):
+        from streamlit.testing.v1 import AppTest
+        doctor_id = users.create({"name": "Ids Only", "email": "ids-only@example.com",
+                                  "user_type": "doctor", "specialization": "Cardiologist",
+                                  "is_available": True, "created_at": datetime.utcnow()})
+        patient_id = users.create({"name": "Session Patient", "email": "session-patient@example.com",
+                                   "user_type": "patient"})
+        at = AppTest.from_file(os.path.join(APP_DIR, "mediconsult_app.py"), default_timeout=60)
+        at.session_state.logged_in = True
+        at.session_state.user_id = patient_id
+        at.session_state.user_type = "patient"
+        at.session_state.user_name = "Session Patient"
+        at.run()
+        next(button for button in at.button if button.key == f"book_{doctor_id}").click().run()
+        self.assertEqual(len(at.exception), 0)
+        
+        self.assertEqual(at.session_state.selected_doctor_id, doctor_id)
+        self.assertIn("Book Consultation with Dr. Ids Only", "".join(m.value for m in at.markdown))
+        documents = [key for key, value in at.session_state._state.filtered_state.items()
+                     if isinstance(value, dict) and "_id" in value]
+        self.assertEqual(documents, [])
+
+
+@unittest.skipUnless(yaml, "PyYAML not installed")
+class CustomMetricsHPATests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(HPA_FILE) as f:
+            cls.hpa = yaml.safe_load(f)
+        with open(ADAPTER_FILE) as f:
+            cls.rules = yaml.safe_load(yaml.safe_load(f)["data"]["config.yaml"])["rules"]
+        cls.pod_metrics = [metric["pods"]["metric"]["name"]
+                           for metric in cls.hpa["spec"]["metrics"] if metric["type"] == "Pods"]
+
+    def test_hpa_targets_exported_metrics(self):
+        self.assertEqual(self.hpa["apiVersion"], "autoscaling/v2")
+        self.assertEqual(self.hpa["spec"]["scaleTargetRef"]["name"], "mediconsult-web-deployment")
+        self.assertEqual(sorted(self.pod_metrics), sorted(GAUGES))
+
+    def test_adapter_exposes_every_hpa_metric(self):
+        for name in self.pod_metrics:
+            matching = [rule for rule in self.rules if re.fullmatch(series_names(rule), name)]
+            self.assertEqual(len(matching), 1, name)
+            rule = matching[0]
+            self.assertEqual(re.sub(rule["name"]["matches"], rule["name"]["as"].replace("${1}", r"\1"), name),
+                             name)
+            self.assertEqual(rule["resources"]["overrides"]["pod"], {"resource": "pod"})
+
+    def test_scaling_on_stubbed_metrics(self):
+        idle = {"mediconsult_active_sessions": [5, 3],
+                "mediconsult_inflight_reruns": [0, 1],
+                "mediconsult_hashing_queue_depth": [0, 0]}
+        self.assertEqual(desired_replicas(self.hpa, 2, idle), 2)
+        
+        # A login burst: hashing queue at 3x target drives the decision
+        burst = {**idle, "mediconsult_hashing_queue_depth": [6, 6]}
+        self.assertEqual(desired_replicas(self.hpa, 2, burst), 6)
+        
+        # Session growth within tolerance does not flap
+        steady = {**idle, "mediconsult_active_sessions": [42, 42]}
+        self.assertEqual(desired_replicas(self.hpa, 2, steady), 2)
+        
+        # Never above maxReplicas
+        flood = {**idle, "mediconsult_active_sessions": [400] * 4}
+        self.assertEqual(desired_replicas(self.hpa, 4, flood), self.hpa["spec"]["maxReplicas"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,146 @@
+"""
+Notification outbox tests for MediConsult
+
+Test Coverage:
+1. Outbox entries written with consultation inserts and updates
+2. Relay into the outbox collection and batch claiming
+3. Per-recipient coalescing, retries with exponential backoff, dead letters
+4. SMTP delivery to a local sink
+"""
+
+import os
+import socketserver
+import sys
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+
+from database import create_database, UserRepository, ConsultationRepository, OutboxRepository
+from notifications import NotificationWorker, DebugTransport, SMTPTransport, backoff_delay
+
+
+class FailingTransport:
+    def send(self, recipient, subject, body):
+        raise ConnectionError("relay unavailable")
+
+
+class SMTPSink(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib to hand over a message"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 sink ready")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 sink")
+            elif command == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                data = []
+                for raw in iter(self.rfile.readline, b".\r\n"):
+                    data.append(raw.decode())
+                self.server.messages.append("".join(data))
+                self.reply("250 queued")
+            elif command == "QUIT" or not line:
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class OutboxTests(unittest.TestCase):
+
+    def setUp(self):
+        db = create_database("memory", f"notifications_test_{ObjectId()}")
+        self.users = UserRepository(db)
+        self.consultations = ConsultationRepository(db)
+        self.outbox = OutboxRepository(db)
+        for repository in (self.users, self.consultations, self.outbox):
+            repository.ensure_indexes()
+        self.doctor_id = self.users.create({"name": "Doc", "email": "doc@test.com", "user_type": "doctor"})
+        self.patient_id = self.users.create({"name": "Pat", "email": "pat@test.com", "user_type": "patient"})
+
+    def request(self):
+        return self.consultations.create({"patient_id": self.patient_id, "doctor_id": self.doctor_id,
+                                          "patient_name": "Pat", "doctor_name": "Doc",
+                                          "status": "pending", "created_at": datetime.utcnow()})
+
+    def test_writes_queue_entries_on_the_consultation(self):
+        consultation_id = self.request()
+        self.consultations.update(consultation_id, {"diagnosis": "Flu", "status": "completed"})
+        # Saving the same response again does not notify twice
+        self.consultations.update(consultation_id, {"diagnosis": "Flu", "status": "completed",
+                                                    "updated_at": datetime.utcnow()})
+        entries = self.consultations.get(consultation_id)["outbox"]
+        self.assertEqual([(entry["event"], entry["recipient"]) for entry in entries],
+                         [("consultation_requested", "doctor"), ("consultation_updated", "patient")])
+
+    def test_relay_is_idempotent_and_empties_consultations(self):
+        consultation_id = self.request()
+        entry = self.consultations.get(consultation_id)["outbox"][0]
+        self.assertEqual(self.outbox.relay(), 1)
+        self.assertEqual(self.outbox.relay(), 0)
+        self.assertEqual(self.consultations.get(consultation_id)["outbox"], [])
+        message = self.outbox.collection.find_one({"_id": entry["id"]})
+        self.assertEqual(message["recipient_id"], self.doctor_id)
+
+    def test_messages_are_coalesced_per_recipient(self):
+        for _ in range(3):
+            self.request()
+        transport = DebugTransport()
+        stats = NotificationWorker(self.outbox, self.users, transport).run_once()
+        self.assertEqual(stats, {"sent": 3, "retried": 0, "dead": 0})
+        self.assertEqual(len(transport.sent), 1)
+        recipient, subject, body = transport.sent[0]
+        self.assertEqual(recipient, "doc@test.com")
+        self.assertIn("3 consultation updates", subject)
+        self.assertEqual(self.outbox.count("sent"), 3)
+
+    def test_failed_delivery_backs_off_then_gives_up(self):
+        self.request()
+        worker = NotificationWorker(self.outbox, self.users, FailingTransport(), max_attempts=3)
+        now = datetime.utcnow()
+        self.assertEqual(worker.run_once(now)["retried"], 1)
+        # Not due again until the backoff has passed
+        self.assertEqual(worker.run_once(now + timedelta(seconds=1))["retried"], 0)
+        later = now + timedelta(seconds=backoff_delay(1) + 1)
+        self.assertEqual(worker.run_once(later)["retried"], 1)
+        message = self.outbox.collection.find_one({})
+        self.assertEqual(message["next_attempt_at"], later + timedelta(seconds=backoff_delay(2)))
+        self.assertEqual(worker.run_once(later + timedelta(hours=1))["dead"], 1)
+        self.assertEqual(self.outbox.count("dead"), 1)
+
+    def test_expired_lease_is_claimed_again(self):
+        self.request()
+        self.outbox.relay()
+        now = datetime.utcnow()
+        self.assertEqual(len(self.outbox.claim(10, lease_seconds=60, now=now)), 1)
+        self.assertEqual(self.outbox.claim(10, now=now), [])
+        self.assertEqual(len(self.outbox.claim(10, now=now + timedelta(seconds=61))), 1)
+
+    def test_smtp_delivery_to_local_sink(self):
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPSink)
+        server.messages = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.request()
+        transport = SMTPTransport("127.0.0.1", server.server_address[1], sender="test@mediconsult.com")
+        stats = NotificationWorker(self.outbox, self.users, transport).run_once()
+        self.assertEqual(stats["sent"], 1)
+        self.assertEqual(len(server.messages), 1)
+        self.assertIn("To: doc@test.com", server.messages[0])
+        self.assertIn("New consultation request from Pat", server.messages[0])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,210 @@
+"""
+Database outage handling tests for MediConsult
+
+Test Coverage:
+1. Circuit breaker: opens after repeated failures, half-opens after the reset time or a heartbeat,
+   then lets a single trial call through
+2. Guarded database against an unreachable server: fails fast once open, lazy calls do not count
+3. Mongo client settings: short timeouts, retryable reads and writes
+4. The app renders the degraded banner instead of failing, then recovers
+"""
+
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
+from streamlit.testing.v1 import AppTest
+
+from database import users, consultations, generations, sessions
+from database.connection import (CircuitBreaker, GuardedDatabase, GuardedCollection, DatabaseUnavailable,
+                                 BreakerHeartbeatListener, create_database)
+from utils import DEGRADED_MESSAGE, SESSION_QUERY_PARAM, _token_hash
+
+APP_FILE = os.path.join(APP_DIR, "mediconsult_app.py")
+
+# Nothing listens here, so server selection fails after its timeout
+UNREACHABLE_URI = "mongodb://127.0.0.1:1/"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(threshold=3, reset_seconds=10, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(DatabaseUnavailable):
+            self.breaker.check()
+
+    def test_half_open_probe(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now = 10
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.check()
+        
+        # One failed probe reopens it for another reset period
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now = 20
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_single_trial_call(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now = 10
+        self.assertTrue(self.breaker.check())
+        with self.assertRaises(DatabaseUnavailable):
+            self.breaker.check()
+        # A trial that never reports back stops blocking after another reset period
+        self.clock.now = 20
+        self.assertTrue(self.breaker.check())
+        self.breaker.end_trial()
+        self.assertTrue(self.breaker.check())
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.check())
+        self.assertFalse(self.breaker.check())
+    
+    def test_heartbeat_half_opens(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        BreakerHeartbeatListener(self.breaker).succeeded(None)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # A heartbeat while closed changes nothing
+        self.breaker.record_success()
+        self.breaker.server_available()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+class GuardedDatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MongoClient(UNREACHABLE_URI, serverSelectionTimeoutMS=100, connectTimeoutMS=100)
+        self.addCleanup(self.client.close)
+        self.breaker = CircuitBreaker(threshold=2, reset_seconds=60)
+        self.db = GuardedDatabase(self.client["mediconsult_test"], self.breaker)
+
+    def test_fails_fast_once_open(self):
+        for _ in range(2):
+            with self.assertRaises(ServerSelectionTimeoutError):
+                list(self.db.users.find({}).sort("name").limit(5))
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        
+        start = time.perf_counter()
+        with self.assertRaises(DatabaseUnavailable):
+            self.db["users"].find_one({})
+        with self.assertRaises(DatabaseUnavailable):
+            self.db.command("ping")
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+    def test_lazy_calls_do_not_close_the_breaker(self):
+        for _ in range(2):
+            with self.assertRaises(ServerSelectionTimeoutError):
+                self.db.users.find_one({})
+        self.breaker.server_available()
+        # Building a cursor does not reach the server, so it proves nothing
+        cursor = self.db.users.find({})
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertIsNone(self.breaker.trial_started)
+        with self.assertRaises(ServerSelectionTimeoutError):
+            next(cursor)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_server_errors_count_as_reachable(self):
+        collection = mock.Mock()
+        collection.insert_one.side_effect = DuplicateKeyError("E11000 duplicate key")
+        self.breaker.record_failure()
+        with self.assertRaises(DuplicateKeyError):
+            GuardedCollection(collection, self.breaker).insert_one({})
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_client_settings(self):
+        db = create_database("mongo", "mediconsult_test", UNREACHABLE_URI)
+        self.addCleanup(db.client.close)
+        self.assertIsInstance(db, GuardedDatabase)
+        options = db.client.options
+        self.assertEqual(options.server_selection_timeout, 2)
+        self.assertEqual(options.pool_options.connect_timeout, 2)
+        self.assertEqual(options.pool_options.socket_timeout, 10)
+        self.assertTrue(options.retry_writes)
+        self.assertTrue(options.retry_reads)
+
+
+class DegradedBannerTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.patient_id = users.create({"name": "Outage Patient", "email": "outage@example.com",
+                                       "user_type": "patient", "created_at": datetime.utcnow()})
+
+    def logged_in(self):
+        at = AppTest.from_file(APP_FILE, default_timeout=60)
+        at.session_state.logged_in = True
+        at.session_state.user_id = self.patient_id
+        at.session_state.user_type = "patient"
+        at.session_state.user_name = "Outage Patient"
+        return at
+
+    def test_banner_instead_of_an_exception(self):
+        at = self.logged_in()
+        # So the doctor directory is read rather than served from the query cache
+        generations.bump_all()
+        outage = DatabaseUnavailable("Database unavailable (circuit breaker open)")
+        with mock.patch.object(consultations.collection, "find", side_effect=outage), \
+                mock.patch.object(users.collection, "find", side_effect=outage):
+            at.run()
+        self.assertEqual(len(at.exception), 0)
+        self.assertIn(DEGRADED_MESSAGE, [warning.value for warning in at.warning])
+        
+        at.run()
+        self.assertEqual(len(at.exception), 0)
+        self.assertNotIn(DEGRADED_MESSAGE, [warning.value for warning in at.warning])
+        self.assertTrue(at.session_state.logged_in)
+
+    def test_session_restore_is_retried(self):
+        sessions.save(_token_hash("outage-token"), {"logged_in": True, "user_id": self.patient_id,
+                                                    "user_type": "patient", "user_name": "Outage Patient"},
+                      timedelta(minutes=5))
+        at = AppTest.from_file(APP_FILE, default_timeout=60)
+        at.query_params[SESSION_QUERY_PARAM] = "outage-token"
+        outage = DatabaseUnavailable("Database unavailable (circuit breaker open)")
+        with mock.patch.object(sessions.collection, "find_one_and_delete", side_effect=outage):
+            at.run()
+        self.assertEqual(len(at.exception), 0)
+        self.assertIn(DEGRADED_MESSAGE, [warning.value for warning in at.warning])
+        self.assertNotIn("logged_in", at.session_state)
+        
+        # The database is back: the next run restores the session it could not before
+        at.run()
+        self.assertTrue(at.session_state.logged_in)
+        self.assertEqual(at.session_state.user_id, self.patient_id)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
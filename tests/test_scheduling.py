@@ -0,0 +1,139 @@
+"""
+Appointment scheduling tests for MediConsult
+
+Test Coverage:
+1. Parsing free-text available_hours into weekly intervals
+2. Free slot queries from the availability index
+3. Incremental booking and index rebuild from stored bookings
+4. Doctors created or made unavailable reach the shared index through the directory generation
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from database import create_database, UserRepository, ConsultationRepository
+from scheduling import parse_available_hours, SlotIndex, build_slot_index
+
+# A Monday, so weekday arithmetic in the assertions is easy to follow
+MONDAY = datetime(2026, 10, 19, 8, 0)
+
+
+def make_doctor(hours, specialization="Cardiologist", **fields):
+    return {"_id": ObjectId(), "name": "Test", "specialization": specialization,
+            "available_hours": hours, "is_available": True, **fields}
+
+
+class ParseAvailableHoursTests(unittest.TestCase):
+
+    def test_day_range(self):
+        weekly = parse_available_hours("Mon-Fri 9AM-5PM")
+        self.assertEqual(sorted(weekly), [0, 1, 2, 3, 4])
+        self.assertEqual(weekly[0], [(9 * 60, 17 * 60)])
+
+    def test_day_list(self):
+        weekly = parse_available_hours("Mon-Wed-Fri 10AM-6PM")
+        self.assertEqual(sorted(weekly), [0, 2, 4])
+
+    def test_minutes_and_multiple_groups(self):
+        weekly = parse_available_hours("Sat 9:30am-12pm; Tue, Thu 2PM-4:30PM")
+        self.assertEqual(weekly[5], [(9 * 60 + 30, 12 * 60)])
+        self.assertEqual(weekly[1], [(14 * 60, 16 * 60 + 30)])
+
+    def test_unparseable_text(self):
+        self.assertEqual(parse_available_hours("by appointment"), {})
+        self.assertEqual(parse_available_hours(None), {})
+
+
+class SlotIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SlotIndex(slot_minutes=30, horizon_days=7)
+        self.cardio = make_doctor("Mon-Fri 9AM-11AM")
+        self.derma = make_doctor("Mon 10AM-11AM", specialization="Dermatologist")
+        self.index.add_doctor(self.cardio)
+        self.index.add_doctor(self.derma)
+
+    def test_next_free_slots_by_specialization(self):
+        slots = self.index.next_free_slots("Cardiologist", limit=5, now=MONDAY)
+        self.assertEqual([start.strftime("%a %H:%M") for start, _ in slots],
+                         ["Mon 09:00", "Mon 09:30", "Mon 10:00", "Mon 10:30", "Tue 09:00"])
+        self.assertTrue(all(doctor_id == self.cardio["_id"] for _, doctor_id in slots))
+
+    def test_slots_are_merged_across_doctors_in_time_order(self):
+        slots = self.index.next_free_slots(limit=6, now=MONDAY)
+        self.assertEqual([start for start, _ in slots], sorted(start for start, _ in slots))
+        self.assertIn(self.derma["_id"], [doctor_id for _, doctor_id in slots])
+
+    def test_booking_removes_slot(self):
+        start = MONDAY.replace(hour=9)
+        self.index.book(self.cardio["_id"], start)
+        self.assertFalse(self.index.is_free(self.cardio["_id"], start))
+        first, _ = self.index.next_free_slots("Cardiologist", limit=1, now=MONDAY)[0]
+        self.assertEqual(first, MONDAY.replace(hour=9, minute=30))
+        self.index.release(self.cardio["_id"], start)
+        self.assertTrue(self.index.is_free(self.cardio["_id"], start))
+
+    def test_past_slots_are_skipped(self):
+        first, _ = self.index.next_free_slots("Cardiologist", limit=1, now=MONDAY.replace(hour=9, minute=40))[0]
+        self.assertEqual(first, MONDAY.replace(hour=10))
+
+    def test_unavailable_doctor_is_not_indexed(self):
+        self.index.add_doctor({**self.derma, "is_available": False})
+        self.assertEqual(self.index.next_free_slots("Dermatologist", now=MONDAY), [])
+
+
+class BuildSlotIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        db = create_database("memory", "scheduling_test")
+        self.users = UserRepository(db)
+        self.consultations = ConsultationRepository(db)
+        self.consultations.ensure_indexes()
+        self.doctor_id = self.users.create(make_doctor("Mon-Fri 9AM-10AM", user_type="doctor"))
+
+    def test_rebuild_includes_stored_bookings(self):
+        start = MONDAY.replace(hour=9)
+        self.consultations.create({"doctor_id": self.doctor_id, "appointment_start": start,
+                                   "created_at": MONDAY})
+        index = build_slot_index(self.users, self.consultations, now=MONDAY)
+        self.assertFalse(index.is_free(self.doctor_id, start))
+        self.assertTrue(index.is_free(self.doctor_id, start + timedelta(minutes=30)))
+
+    def test_double_booking_is_rejected(self):
+        start = MONDAY.replace(hour=9)
+        self.consultations.create({"doctor_id": self.doctor_id, "appointment_start": start})
+        with self.assertRaises(DuplicateKeyError):
+            self.consultations.create_once({"doctor_id": self.doctor_id, "appointment_start": start}, "other-key")
+
+
+class SharedSlotIndexTests(unittest.TestCase):
+
+    def test_directory_changes_reach_the_index(self):
+        from database import users
+        from utils import get_slot_index
+        
+        slot_index = get_slot_index()
+        doctor_id = users.create(make_doctor("Mon-Sun 12AM-11PM", specialization="Neurologist", user_type="doctor",
+                                             email=f"{ObjectId()}@example.com"))
+        self.assertIs(get_slot_index(), slot_index)
+        self.assertIsNotNone(slot_index.doctor(doctor_id))
+        
+        users.update_profile(doctor_id, {"available_hours": "by appointment"})
+        self.assertIsNone(get_slot_index().doctor(doctor_id))
+        users.update_profile(doctor_id, {"available_hours": "Mon-Sun 12AM-11PM"})
+        self.assertIsNotNone(get_slot_index().doctor(doctor_id))
+        users.update_profile(doctor_id, {"is_available": False})
+        self.assertIsNone(get_slot_index().doctor(doctor_id))
+        self.assertNotIn(doctor_id, [doctor for _, doctor in slot_index.next_free_slots("Neurologist")])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,184 @@
+"""
+Shared session store tests for MediConsult
+
+Test Coverage:
+1. Checkpoints keyed by token hash, with expiry and deletion
+2. Login issues a token; a new session on another replica rehydrates from it
+3. Doctor response drafts survive the move, checkpointed with clinical text encrypted
+4. Logout deletes the checkpoint
+5. A token resumes once (taken atomically, then rotated) and only for a user who still has that role
+6. Submitted-form idempotency keys move with the session
+"""
+
+import os
+import sys
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from streamlit.testing.v1 import AppTest
+
+from database import users, consultations, sessions
+from database.memory import MemoryDatabase
+from database.repositories import SessionRepository
+from encryption import is_encrypted
+from utils import hash_password, SESSION_QUERY_PARAM, _token_hash
+
+APP_FILE = os.path.join(APP_DIR, "mediconsult_app.py")
+
+
+class SessionRepositoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sessions = SessionRepository(MemoryDatabase())
+        self.sessions.ensure_indexes()
+
+    def test_save_load_delete(self):
+        self.sessions.save("hash", {"logged_in": True}, timedelta(minutes=5))
+        self.sessions.save("hash", {"logged_in": True, "navigation": "Consultation History"}, timedelta(minutes=5))
+        self.assertEqual(self.sessions.load("hash"), {"logged_in": True, "navigation": "Consultation History"})
+        self.assertEqual(self.sessions.collection.count_documents({}), 1)
+        self.sessions.delete("hash")
+        self.assertIsNone(self.sessions.load("hash"))
+
+    def test_take_is_atomic(self):
+        self.sessions.save("hash", {"logged_in": True}, timedelta(minutes=5))
+        taken = []
+        threads = [threading.Thread(target=lambda: taken.append(self.sessions.take("hash"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([state for state in taken if state is not None], [{"logged_in": True}])
+        self.assertIsNone(self.sessions.load("hash"))
+        
+        self.sessions.save("expired", {"logged_in": True}, timedelta(minutes=5))
+        self.assertIsNone(self.sessions.take("expired", now=datetime.utcnow() + timedelta(minutes=6)))
+    
+    def test_expired_checkpoint_is_not_loaded(self):
+        self.sessions.save("hash", {"logged_in": True}, timedelta(minutes=5))
+        self.assertIsNone(self.sessions.load("hash", now=datetime.utcnow() + timedelta(minutes=6)))
+
+
+class SessionRehydrationTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.doctor_id = users.create({"name": "Roaming Doctor", "email": "roaming@example.com",
+                                      "password": hash_password("secret"), "user_type": "doctor"})
+        patient_id = users.create({"name": "Roaming Patient", "email": "roaming-patient@example.com",
+                                   "user_type": "patient"})
+        cls.consultation_id = consultations.create({
+            "patient_id": patient_id, "doctor_id": cls.doctor_id, "doctor_name": "Roaming Doctor",
+            "symptoms": "Headache", "status": "pending", "created_at": datetime.utcnow()
+        })
+
+    def login(self):
+        at = AppTest.from_file(APP_FILE, default_timeout=60).run()
+        at.text_input[0].input("roaming@example.com")
+        at.text_input[1].input("secret")
+        at.selectbox[0].select("Doctor")
+        return at.button[0].click().run()
+
+    def test_reconnect_to_another_replica(self):
+        at = self.login()
+        self.assertTrue(at.session_state.logged_in)
+        token = at.query_params[SESSION_QUERY_PARAM]
+        self.assertTrue(token)
+        # Opening the request renders the response form
+        at.session_state[f"response_{self.consultation_id}"] = True
+        at.run()
+        at.text_area(key=f"diagnosis_{self.consultation_id}").input("Migraine").run()
+        checkpoint = sessions.load(_token_hash(token))
+        self.assertTrue(is_encrypted(checkpoint[f"diagnosis_{self.consultation_id}"]))
+        
+        # A fresh session, as on a replica that has never seen this browser
+        resumed = AppTest.from_file(APP_FILE, default_timeout=60)
+        resumed.query_params[SESSION_QUERY_PARAM] = token
+        resumed.run()
+        self.assertEqual(len(resumed.exception), 0)
+        self.assertTrue(resumed.session_state.logged_in)
+        self.assertEqual(resumed.session_state.user_id, self.doctor_id)
+        rotated = resumed.query_params[SESSION_QUERY_PARAM]
+        self.assertNotEqual(rotated, token)
+        self.assertIsNone(sessions.load(_token_hash(token)))
+        self.assertIsNotNone(sessions.load(_token_hash(rotated)))
+        # The draft is kept while the request is collapsed, and is there when it is opened
+        resumed.run()
+        resumed.session_state[f"response_{self.consultation_id}"] = True
+        resumed.run()
+        self.assertEqual(resumed.text_area(key=f"diagnosis_{self.consultation_id}").value, "Migraine")
+
+    def test_token_resumes_once(self):
+        token = self.login().query_params[SESSION_QUERY_PARAM]
+        for expected in (True, False):
+            resumed = AppTest.from_file(APP_FILE, default_timeout=60)
+            resumed.query_params[SESSION_QUERY_PARAM] = token
+            resumed.run()
+            self.assertEqual(resumed.session_state.logged_in, expected)
+    
+    def test_second_restore_of_a_token_fails(self):
+        token = self.login().query_params[SESSION_QUERY_PARAM]
+        
+        def resume():
+            import streamlit as st
+            from utils import restore_session
+            st.session_state.restored = restore_session()
+        
+        results = []
+        for _ in range(2):
+            resumed = AppTest.from_function(resume, default_timeout=60)
+            resumed.query_params[SESSION_QUERY_PARAM] = token
+            resumed.run()
+            self.assertEqual(len(resumed.exception), 0)
+            results.append(resumed.session_state.restored)
+        self.assertEqual(results, [True, False])
+    
+    def test_checkpoint_revalidates_the_user(self):
+        token = self.login().query_params[SESSION_QUERY_PARAM]
+        state = sessions.load(_token_hash(token))
+        sessions.save(_token_hash(token), {**state, "user_type": "admin"}, timedelta(minutes=5))
+        
+        resumed = AppTest.from_file(APP_FILE, default_timeout=60)
+        resumed.query_params[SESSION_QUERY_PARAM] = token
+        resumed.run()
+        self.assertFalse(resumed.session_state.logged_in)
+        self.assertNotIn(SESSION_QUERY_PARAM, resumed.query_params)
+        self.assertIsNone(sessions.load(_token_hash(token)))
+    
+    def test_idempotency_keys_move_with_the_session(self):
+        at = self.login()
+        at.session_state.idempotency_keys = {"new_consultation": ("key", "fingerprint")}
+        at.run()
+        
+        resumed = AppTest.from_file(APP_FILE, default_timeout=60)
+        resumed.query_params[SESSION_QUERY_PARAM] = at.query_params[SESSION_QUERY_PARAM]
+        resumed.run()
+        self.assertEqual(tuple(resumed.session_state.idempotency_keys["new_consultation"]), ("key", "fingerprint"))
+    
+    def test_logout_deletes_checkpoint(self):
+        at = self.login()
+        token = at.query_params[SESSION_QUERY_PARAM]
+        next(button for button in at.sidebar.button if "Logout" in button.label).click().run()
+        self.assertFalse(at.session_state.logged_in)
+        self.assertNotIn(SESSION_QUERY_PARAM, at.query_params)
+        
+        resumed = AppTest.from_file(APP_FILE, default_timeout=60)
+        resumed.query_params[SESSION_QUERY_PARAM] = token
+        resumed.run()
+        self.assertFalse(resumed.session_state.logged_in)
+
+    def test_unknown_token_starts_logged_out(self):
+        at = AppTest.from_file(APP_FILE, default_timeout=60)
+        at.query_params[SESSION_QUERY_PARAM] = "not-a-session"
+        at.run()
+        self.assertFalse(at.session_state.logged_in)
+        self.assertNotIn(SESSION_QUERY_PARAM, at.query_params)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
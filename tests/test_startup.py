@@ -0,0 +1,89 @@
+"""
+Cold-start tests for MediConsult
+
+Test Coverage:
+1. Modules deferred to first use are not imported with the app script
+2. Import-time budget for the app script (python -X importtime)
+3. warm_up() fills the process-wide caches
+4. The Docker build context keeps every package the entrypoints import
+"""
+
+import fnmatch
+import os
+import subprocess
+import sys
+import unittest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+# Cost of `import mediconsult_app` once streamlit and pymongo are loaded, as in the server
+SCRIPT_IMPORT_BUDGET_MS = 400
+# Listed in requirements.txt in the past but never needed to serve a page
+UNUSED_AT_STARTUP = ("pandas", "plotly", "streamlit_authenticator")
+
+
+def import_times(statement):
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=APP_DIR, capture_output=True, text=True, check=True,
+        env={**os.environ, "MEDICONSULT_STORAGE": "memory"}
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        if line.startswith("import time:") and "self [us]" not in line:
+            self_us, cumulative_us, module = line[len("import time:"):].split("|")
+            times[module.strip()] = int(cumulative_us)
+    return times
+
+
+class StartupBudgetTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        server = import_times("import streamlit, pymongo")
+        cls.times = import_times("import streamlit, pymongo; import mediconsult_app")
+        # Modules the app script brings in on top of what the server has loaded
+        cls.added = set(cls.times) - set(server)
+
+    def test_deferred_modules_are_not_imported(self):
+        from startup import LAZY_MODULES
+        loaded = [module for module in (*LAZY_MODULES, *UNUSED_AT_STARTUP) if module in self.added]
+        self.assertEqual(loaded, [])
+
+    def test_script_import_within_budget(self):
+        self.assertLess(self.times["mediconsult_app"] / 1000, SCRIPT_IMPORT_BUDGET_MS)
+
+
+class WarmUpTests(unittest.TestCase):
+
+    def test_warm_up_primes_caches(self):
+        from startup import warm_up, WARM_STATE, setup_database
+        from utils import get_slot_index
+
+        warm_up()
+        self.assertTrue(WARM_STATE["warm"])
+        # Later calls are served from st.cache_resource
+        self.assertIs(get_slot_index(), get_slot_index())
+        self.assertIsNone(setup_database())
+
+
+
+class ContainerImageTests(unittest.TestCase):
+
+    def test_build_context_keeps_packages(self):
+        with open(os.path.join(APP_DIR, ".dockerignore")) as f:
+            patterns = [line.strip().rstrip("/") for line in f if line.strip() and not line.startswith("#")]
+        packages = [name for name in os.listdir(APP_DIR)
+                    if os.path.isfile(os.path.join(APP_DIR, name, "__init__.py"))]
+        self.assertIn("database", packages)
+        excluded = [name for name in packages if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+        self.assertEqual(excluded, [])
+        
+        with open(os.path.join(APP_DIR, "Dockerfile")) as f:
+            self.assertIn("import serve, mediconsult_app, notifications.worker, migrations.run", f.read())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,510 @@
+"""
+Storage layer tests for MediConsult
+
+Runs against the in-memory engine by default, so no mongod is needed.
+Set MEDICONSULT_STORAGE=mongo (and MONGODB_URI) to run the same cases
+against a real MongoDB server.
+
+Test Coverage:
+1. In-memory engine query, projection, sort and update semantics
+2. Secondary index narrowing and unique index enforcement
+3. User, consultation and lab report repositories
+4. Idempotent consultation submission
+5. Per-doctor pending counters and least-loaded doctor assignment
+6. Patient record summaries maintained on consultation writes
+7. Follow-up threads and the migration splitting concatenated follow-ups
+8. Allergy and history normalization, term filters and the normalizing migration
+9. Lab request lifecycle, the lab queue and report linkage
+10. register_user / authenticate_user through the repository layer
+11. Lab accounts are created by an admin, never self-registered
+"""
+
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from streamlit.testing.v1 import AppTest
+
+from config import STORAGE_BACKEND, RECORD_RECENT_DIAGNOSES, RECORD_PRESCRIPTION_ACTIVE_DAYS
+from database import create_database, UserRepository, ConsultationRepository, LabReportRepository
+from database.memory import MemoryDatabase
+from migrations import migrate_follow_up_threads, migrate_clinical_terms, migrate_lab_requests
+from vocabulary import normalize_terms
+
+
+def make_test_database():
+    """Fresh database for one test case on the configured backend"""
+    return create_database(STORAGE_BACKEND, f"mediconsult_test_{ObjectId()}")
+
+
+def drop_test_database(db):
+    if not isinstance(db, MemoryDatabase):
+        db.client.drop_database(db.name)
+
+
+class MemoryEngineTests(unittest.TestCase):
+    """Behaviour the repositories rely on from the in-memory engine"""
+
+    def setUp(self):
+        self.collection = MemoryDatabase("engine_test")["items"]
+        self.collection.insert_many([
+            {"name": "a", "kind": "x", "rank": 3, "tags": ["red", "blue"]},
+            {"name": "b", "kind": "y", "rank": 1, "tags": ["green"]},
+            {"name": "c", "kind": "x", "rank": 2, "tags": []},
+        ])
+
+    def test_query_operators(self):
+        self.assertEqual(self.collection.count_documents({"kind": "x"}), 2)
+        self.assertEqual(self.collection.count_documents({"rank": {"$gte": 2}}), 2)
+        self.assertEqual(self.collection.count_documents({"tags": "blue"}), 1)
+        self.assertEqual(self.collection.count_documents({"kind": {"$in": ["y", "z"]}}), 1)
+        self.assertEqual(self.collection.count_documents({"$or": [{"name": "a"}, {"rank": 1}]}), 2)
+        self.assertEqual(self.collection.count_documents({"missing": {"$exists": False}}), 3)
+
+    def test_projection_and_sort(self):
+        docs = list(self.collection.find({}, {"name": 1, "_id": 0}).sort("rank", -1))
+        self.assertEqual(docs, [{"name": "a"}, {"name": "c"}, {"name": "b"}])
+
+    def test_update_operators(self):
+        self.collection.update_one({"name": "a"}, {"$set": {"rank": 10}, "$push": {"tags": "pink"}})
+        self.collection.update_many({"kind": "x"}, {"$inc": {"visits": 1}})
+        doc = self.collection.find_one({"name": "a"})
+        self.assertEqual(doc["rank"], 10)
+        self.assertEqual(doc["tags"], ["red", "blue", "pink"])
+        self.assertEqual(doc["visits"], 1)
+
+    def test_upsert(self):
+        result = self.collection.update_one({"name": "d"}, {"$setOnInsert": {"rank": 4}}, upsert=True)
+        self.assertIsNotNone(result.upserted_id)
+        self.assertEqual(self.collection.find_one({"name": "d"})["rank"], 4)
+
+    def test_returned_documents_are_copies(self):
+        doc = self.collection.find_one({"name": "a"})
+        doc["tags"].append("mutated")
+        self.assertNotIn("mutated", self.collection.find_one({"name": "a"})["tags"])
+
+    def test_secondary_index_narrows_candidates(self):
+        self.collection.create_index("kind")
+        index = self.collection._indexes["kind_1"]
+        self.assertEqual(len(index.lookup({"kind": "x"})), 2)
+        self.collection.update_one({"name": "b"}, {"$set": {"kind": "x"}})
+        self.assertEqual(len(index.lookup({"kind": "x"})), 3)
+        self.collection.delete_one({"name": "a"})
+        self.assertEqual(len(index.lookup({"kind": "x"})), 2)
+
+    def test_multikey_index(self):
+        self.collection.create_index("tags")
+        self.assertEqual([doc["name"] for doc in self.collection.find({"tags": "green"})], ["b"])
+
+    def test_unique_index(self):
+        self.collection.create_index("name", unique=True)
+        with self.assertRaises(DuplicateKeyError):
+            self.collection.insert_one({"name": "a"})
+        with self.assertRaises(DuplicateKeyError):
+            self.collection.update_one({"name": "b"}, {"$set": {"name": "a"}})
+
+    def test_or_query_uses_a_union_of_indexes(self):
+        self.collection.create_index("kind")
+        self.collection.create_index("rank")
+        query = {"$or": [{"kind": "y"}, {"rank": 2}]}
+        self.assertTrue(all(self.collection._lookup(clause) is not None for clause in query["$or"]))
+        self.assertEqual(sorted(doc["name"] for doc in self.collection.find(query)), ["b", "c"])
+        # A clause without an index falls back to a full scan
+        self.assertEqual(self.collection.count_documents({"$or": [{"kind": "y"}, {"name": "a"}]}), 2)
+
+    def test_indexed_lookup_is_fast(self):
+        collection = MemoryDatabase("engine_perf")["items"]
+        collection.create_index([("owner", 1), ("status", 1)])
+        collection.insert_many([{"owner": i % 500, "status": "pending"} for i in range(20000)])
+        start = time.perf_counter()
+        for owner in range(200):
+            collection.count_documents({"owner": owner, "status": "pending"})
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+class RepositoryTests(unittest.TestCase):
+    """Repository behaviour on the configured storage backend"""
+
+    def setUp(self):
+        self.db = make_test_database()
+        self.users = UserRepository(self.db)
+        self.consultations = ConsultationRepository(self.db)
+        self.lab_reports = LabReportRepository(self.db)
+        for repository in (self.users, self.consultations, self.lab_reports):
+            repository.ensure_indexes()
+
+    def tearDown(self):
+        drop_test_database(self.db)
+
+    def test_user_email_is_unique(self):
+        self.users.create({"name": "A", "email": "a@test.com", "user_type": "patient"})
+        with self.assertRaises(DuplicateKeyError):
+            self.users.create({"name": "B", "email": "a@test.com", "user_type": "patient"})
+
+    def test_list_doctors_by_specialization(self):
+        self.users.create({"name": "C", "email": "c@test.com", "user_type": "doctor", "specialization": "Cardiologist"})
+        self.users.create({"name": "D", "email": "d@test.com", "user_type": "doctor", "specialization": "Dermatologist"})
+        self.users.create({"name": "P", "email": "p@test.com", "user_type": "patient"})
+        self.assertEqual(len(self.users.list_doctors()), 2)
+        self.assertEqual([doc["name"] for doc in self.users.list_doctors("Cardiologist")], ["C"])
+        self.assertEqual(self.users.count("patient"), 1)
+
+    def test_consultations_newest_first_with_projection(self):
+        doctor_id, patient_id = ObjectId(), ObjectId()
+        now = datetime.utcnow()
+        for days in (3, 1, 2):
+            self.consultations.create({
+                "patient_id": patient_id,
+                "doctor_id": doctor_id,
+                "symptoms": "x" * 1000,
+                "status": "pending",
+                "created_at": now - timedelta(days=days)
+            })
+        history = self.consultations.list_for_patient(patient_id, {"created_at": 1, "status": 1})
+        self.assertEqual([doc["created_at"] for doc in history],
+                         sorted((doc["created_at"] for doc in history), reverse=True))
+        self.assertNotIn("symptoms", history[0])
+        self.assertEqual(len(self.consultations.list_for_doctor(doctor_id, status="pending")), 3)
+
+    def test_consultation_update_reports_change(self):
+        consultation_id = self.consultations.create({"status": "pending", "created_at": datetime.utcnow()})
+        self.assertTrue(self.consultations.update(consultation_id, {"status": "completed"}))
+        self.assertFalse(self.consultations.update(consultation_id, {"status": "completed"}))
+        self.assertEqual(self.consultations.get(consultation_id)["status"], "completed")
+
+    def test_create_once_deduplicates_resubmits(self):
+        data = {"patient_id": ObjectId(), "status": "pending", "created_at": datetime.utcnow()}
+        first_id, created = self.consultations.create_once(dict(data), "key-1")
+        self.assertTrue(created)
+        repeat_id, created = self.consultations.create_once(dict(data), "key-1")
+        self.assertFalse(created)
+        self.assertEqual(repeat_id, first_id)
+        _, created = self.consultations.create_once(dict(data), "key-2")
+        self.assertTrue(created)
+        # Legacy documents without a key are not constrained by the unique index
+        self.consultations.create(dict(data))
+        self.consultations.create(dict(data))
+        self.assertEqual(self.consultations.count(), 4)
+
+    def test_pending_count_follows_status_changes(self):
+        doctor_id = self.users.create({"name": "D", "email": "d@test.com", "user_type": "doctor"})
+        first = self.consultations.create({"doctor_id": doctor_id, "status": "pending"})
+        self.consultations.create({"doctor_id": doctor_id, "status": "pending"})
+        self.consultations.update(first, {"status": "completed"})
+        self.consultations.update(first, {"status": "completed"})
+        self.assertEqual(self.users.get_by_id(doctor_id)["pending_count"], 1)
+        self.consultations.update(first, {"status": "pending"})
+        self.assertEqual(self.users.get_by_id(doctor_id)["pending_count"], 2)
+        self.assertEqual(self.consultations.pending_counts_by_doctor(), {doctor_id: 2})
+
+    def test_claim_least_loaded_doctor(self):
+        busy = self.users.create({"name": "Busy", "email": "b@test.com", "user_type": "doctor",
+                                  "specialization": "Cardiologist", "pending_count": 3})
+        idle = self.users.create({"name": "Idle", "email": "i@test.com", "user_type": "doctor",
+                                  "specialization": "Cardiologist", "pending_count": 0})
+        self.users.create({"name": "Away", "email": "a@test.com", "user_type": "doctor",
+                           "specialization": "Cardiologist", "pending_count": 0, "is_available": False})
+        claimed = [self.users.claim_least_loaded_doctor("Cardiologist")["_id"] for _ in range(5)]
+        # Ties at three pending go to the doctor assigned least recently
+        self.assertEqual(claimed, [idle, idle, idle, busy, idle])
+        self.assertIsNone(self.users.claim_least_loaded_doctor("Dermatologist"))
+
+    def test_claimed_slot_is_released_on_duplicate_submit(self):
+        doctor_id = self.users.create({"name": "D", "email": "d@test.com", "user_type": "doctor",
+                                       "specialization": "Cardiologist"})
+        data = {"patient_id": ObjectId(), "status": "pending"}
+        for _ in range(2):
+            doctor = self.users.claim_least_loaded_doctor("Cardiologist")
+            self.consultations.create_once({**data, "doctor_id": doctor["_id"]}, "key-1", pending_claimed=True)
+        self.assertEqual(self.users.get_by_id(doctor_id)["pending_count"], 1)
+
+    def test_patient_record_merges_consultations(self):
+        patient_id = ObjectId()
+        for allergies, history in ((["Penicillin", " latex"], ["asthma"]), (["latex", ""], ["asthma", "diabetes"])):
+            self.consultations.create({"patient_id": patient_id, "allergies": allergies,
+                                       "medical_history": history, "status": "pending",
+                                       "created_at": datetime.utcnow()})
+        record = self.consultations.records.get(patient_id)
+        self.assertEqual(record["allergies"], ["penicillin", "latex"])
+        self.assertEqual(record["medical_history"], ["asthma", "diabetes"])
+        self.assertEqual(record["consultation_count"], 2)
+
+    def test_patient_record_follows_completions(self):
+        patient_id = ObjectId()
+        ids = [self.consultations.create({"patient_id": patient_id, "doctor_name": "Doc", "status": "pending",
+                                          "created_at": datetime.utcnow()})
+               for _ in range(RECORD_RECENT_DIAGNOSES + 1)]
+        # In progress is not an outcome yet
+        self.consultations.update(ids[0], {"status": "in_progress", "diagnosis": "Draft"})
+        self.assertNotIn("diagnoses", self.consultations.records.get(patient_id))
+        
+        for i, consultation_id in enumerate(ids):
+            self.consultations.update(consultation_id, {"status": "completed", "diagnosis": f"Diagnosis {i}",
+                                                        "prescription": f"Drug {i}"})
+        # Editing a completed consultation replaces its entries
+        self.consultations.update(ids[-1], {"diagnosis": "Revised", "prescription": "Drug revised"})
+        self.consultations.update(ids[-1], {"consultation_notes": "No record change"})
+        
+        record = self.consultations.records.get(patient_id)
+        diagnoses = [entry["diagnosis"] for entry in record["diagnoses"]]
+        self.assertEqual(len(diagnoses), RECORD_RECENT_DIAGNOSES)
+        self.assertEqual(diagnoses[-1], "Revised")
+        self.assertNotIn("Diagnosis 0", diagnoses)
+        self.assertEqual(len(record["prescriptions"]), len(ids))
+        self.assertEqual(sum(entry["prescription"] == "Drug revised" for entry in record["prescriptions"]), 1)
+        
+        later = datetime.utcnow() + timedelta(days=RECORD_PRESCRIPTION_ACTIVE_DAYS + 1)
+        self.assertEqual(self.consultations.records.get(patient_id, now=later)["prescriptions"], [])
+
+    def test_patient_record_rebuild_matches_incremental(self):
+        patient_id = ObjectId()
+        for i in range(3):
+            consultation_id = self.consultations.create({
+                "patient_id": patient_id, "allergies": [f"allergen {i}"], "status": "pending",
+                "created_at": datetime.utcnow() + timedelta(seconds=i)
+            })
+            self.consultations.update(consultation_id, {"status": "completed", "diagnosis": f"Diagnosis {i}",
+                                                        "updated_at": datetime.utcnow()})
+        incremental = self.consultations.records.get(patient_id)
+        self.consultations.records.rebuild(patient_id, self.consultations.find({"patient_id": patient_id},
+                                                                               newest_first=False))
+        rebuilt = self.consultations.records.get(patient_id)
+        for field in ("allergies", "consultation_count"):
+            self.assertEqual(rebuilt[field], incremental[field])
+        self.assertEqual([entry["diagnosis"] for entry in rebuilt["diagnoses"]],
+                         [entry["diagnosis"] for entry in incremental["diagnoses"]])
+
+    def test_follow_up_thread(self):
+        patient_id, doctor_id = ObjectId(), ObjectId()
+        start = datetime.utcnow()
+        root_id = self.consultations.create({"patient_id": patient_id, "doctor_id": doctor_id,
+                                             "symptoms": "Cough", "status": "completed", "created_at": start})
+        root = self.consultations.get(root_id)
+        first_id, _ = self.consultations.create_follow_up(root, {
+            "patient_id": patient_id, "doctor_id": doctor_id, "symptoms": "Still coughing",
+            "status": "pending", "created_at": start + timedelta(days=1)}, "key-1")
+        second_id, _ = self.consultations.create_follow_up(self.consultations.get(first_id), {
+            "patient_id": patient_id, "doctor_id": doctor_id, "symptoms": "Now a fever",
+            "status": "pending", "created_at": start + timedelta(days=2)}, "key-2")
+        self.consultations.create({"patient_id": patient_id, "symptoms": "Unrelated", "created_at": start})
+        
+        second = self.consultations.get(second_id)
+        self.assertEqual(second["parent_consultation_id"], first_id)
+        self.assertEqual(second["thread_root_id"], root_id)
+        self.assertNotIn("thread_root_id", root)
+        self.assertEqual([doc["symptoms"] for doc in self.consultations.thread(root_id)],
+                         ["Cough", "Still coughing", "Now a fever"])
+
+    def test_migration_splits_concatenated_follow_ups(self):
+        patient_id, doctor_id = ObjectId(), ObjectId()
+        start = datetime.utcnow()
+        
+        def consult(symptoms, days, doctor=doctor_id):
+            return self.consultations.create({"patient_id": patient_id, "doctor_id": doctor,
+                                              "symptoms": symptoms, "status": "completed",
+                                              "created_at": start + timedelta(days=days)})
+        root_id = consult("Cough", 0)
+        first_id = consult("Follow-up: Cough\nNew: Still coughing", 1)
+        second_id = consult("Follow-up: Follow-up: Cough\nNew: Still coughing\nNew: Fever\nNew: chills", 2)
+        orphan_id = consult("Follow-up: Deleted visit\nNew: Rash", 3)
+        other_doctor_id = consult("Follow-up: Cough\nNew: Second opinion", 4, doctor=ObjectId())
+        
+        self.assertEqual(migrate_follow_up_threads(dry_run=True, consultations=self.consultations),
+                         {"patients": 1, "split": 2, "unmatched": 2})
+        self.assertEqual(self.consultations.get(first_id)["symptoms"], "Follow-up: Cough\nNew: Still coughing")
+        
+        migrate_follow_up_threads(consultations=self.consultations)
+        self.assertEqual([(doc["_id"], doc["symptoms"]) for doc in self.consultations.thread(root_id)],
+                         [(root_id, "Cough"), (first_id, "Still coughing"), (second_id, "Fever\nNew: chills")])
+        self.assertEqual(self.consultations.get(second_id)["parent_consultation_id"], first_id)
+        for unmatched in (orphan_id, other_doctor_id):
+            self.assertNotIn("parent_consultation_id", self.consultations.get(unmatched))
+        
+        # Running again changes nothing
+        self.assertEqual(migrate_follow_up_threads(consultations=self.consultations),
+                         {"patients": 1, "split": 0, "unmatched": 2})
+
+    def test_clinical_terms_normalized_on_write(self):
+        consultation_id = self.consultations.create({
+            "doctor_id": ObjectId(), "patient_id": ObjectId(), "status": "pending",
+            "allergies": [" PCN", "Sulfa Drugs ", "penicillin", "", "Kiwi"],
+            "medical_history": ["High  Blood Pressure, T2DM", "asthma."], "created_at": datetime.utcnow()
+        })
+        consultation = self.consultations.get(consultation_id)
+        self.assertEqual(consultation["allergies"], ["penicillin", "sulfonamides", "kiwi"])
+        self.assertEqual(consultation["medical_history"], ["hypertension", "type 2 diabetes", "asthma"])
+        self.consultations.update(consultation_id, {"allergies": ["Latex Rubber"]})
+        self.assertEqual(self.consultations.get(consultation_id)["allergies"], ["latex"])
+
+    def test_find_by_terms(self):
+        doctor_id, other_doctor_id = ObjectId(), ObjectId()
+        patients = [ObjectId() for _ in range(3)]
+        for patient_id, doctor, allergies, history in (
+                (patients[0], doctor_id, ["Penicillin"], ["HTN"]),
+                (patients[1], doctor_id, ["penicillins", "latex"], []),
+                (patients[2], doctor_id, ["latex"], ["hypertension"]),
+                (ObjectId(), other_doctor_id, ["penicillin"], [])):
+            self.consultations.create({"doctor_id": doctor, "patient_id": patient_id, "status": "pending",
+                                       "allergies": allergies, "medical_history": history,
+                                       "created_at": datetime.utcnow()})
+        
+        def matching(**terms):
+            return {doc["patient_id"] for doc in self.consultations.find_by_terms(doctor_id, **terms)}
+        self.assertEqual(matching(allergies=["PCN"]), {patients[0], patients[1]})
+        self.assertEqual(matching(allergies=["penicillin", "latex"]), {patients[1]})
+        self.assertEqual(matching(medical_history=["high blood pressure"]), {patients[0], patients[2]})
+        self.assertEqual(len(matching()), 3)
+
+    def test_migration_normalizes_clinical_terms(self):
+        patient_id = ObjectId()
+        for allergies in ([" PCN", "Latex", ""], ["penicillin"], ["Penicillin "]):
+            self.consultations.collection.insert_one({
+                "patient_id": patient_id, "status": "completed", "allergies": allergies,
+                "medical_history": ["asthma"], "created_at": datetime.utcnow()
+            })
+        self.consultations.collection.insert_one({"status": "pending", "created_at": datetime.utcnow()})
+        
+        self.assertEqual(migrate_clinical_terms(dry_run=True, batch_size=2, consultations=self.consultations),
+                         {"scanned": 4, "normalized": 2, "batches": 2, "records_rebuilt": 1})
+        self.assertIsNone(self.consultations.records.get(patient_id))
+        
+        migrate_clinical_terms(batch_size=2, consultations=self.consultations)
+        self.assertEqual(self.consultations.collection.distinct("allergies"), ["penicillin", "latex"])
+        self.assertEqual(self.consultations.records.get(patient_id)["allergies"], ["penicillin", "latex"])
+        self.assertEqual(migrate_clinical_terms(consultations=self.consultations)["normalized"], 0)
+
+    def test_lab_request_lifecycle(self):
+        patient_id, doctor_id = ObjectId(), ObjectId()
+        start = datetime.utcnow()
+        consultation_id = self.consultations.create({"patient_id": patient_id, "doctor_id": doctor_id,
+                                                     "status": "pending", "created_at": start})
+        requests = self.consultations.lab_requests
+        self.consultations.update(consultation_id, {"lab_requests": ["CBC", "Lipid panel", "CBC"],
+                                                    "updated_at": start})
+        self.consultations.update(consultation_id, {"lab_requests": ["CBC", "Lipid panel", "HbA1c"],
+                                                    "updated_at": start + timedelta(minutes=1)})
+        queue = requests.queue()
+        # Oldest first; CBC and the lipid panel were requested together
+        self.assertEqual([request["test"] for request in queue][-1], "HbA1c")
+        self.assertEqual(requests.count_outstanding(doctor_id), 3)
+        
+        cbc, lipids, hba1c = sorted(queue, key=lambda request: ["CBC", "Lipid panel", "HbA1c"].index(request["test"]))
+        self.assertTrue(requests.advance(cbc["_id"], "collected"))
+        self.assertFalse(requests.advance(cbc["_id"], "collected"))
+        self.assertFalse(requests.advance(lipids["_id"], "resulted"))
+        self.assertEqual([request["test"] for request in requests.queue(["collected"])], ["CBC"])
+        
+        # Dropping tests removes only those the lab has not collected
+        self.consultations.update(consultation_id, {"lab_requests": ["HbA1c"]})
+        self.assertEqual({request["test"] for request in requests.list_for_consultation(consultation_id)},
+                         {"CBC", "HbA1c"})
+        self.assertIsNotNone(requests.get(cbc["_id"])["collected_at"])
+        self.assertEqual(requests.get(hba1c["_id"])["patient_id"], patient_id)
+
+    def test_lab_report_results_its_request(self):
+        consultation_id = self.consultations.create({"patient_id": ObjectId(), "doctor_id": ObjectId(),
+                                                     "status": "pending", "created_at": datetime.utcnow()})
+        self.consultations.update(consultation_id, {"lab_requests": ["CBC", "Urinalysis"]})
+        by_test = {request["test"]: request for request in self.consultations.lab_requests.list_for_consultation(consultation_id)}
+        cbc, urinalysis = by_test["CBC"], by_test["Urinalysis"]
+        report = {"consultation_id": consultation_id, "created_at": datetime.utcnow()}
+        
+        # Two outstanding requests: an unnamed report is not guessed
+        unlinked = self.lab_reports.create(dict(report))
+        self.assertIsNone(self.lab_reports.collection.find_one({"_id": unlinked}).get("lab_request_id"))
+        
+        named = self.lab_reports.create({**report, "lab_request_id": cbc["_id"]})
+        self.assertEqual(self.lab_reports.requests.get(cbc["_id"])["status"], "resulted")
+        self.assertEqual(self.lab_reports.requests.get(cbc["_id"])["report_ids"], [named])
+        
+        # One outstanding request left: linked automatically
+        inferred = self.lab_reports.create(dict(report))
+        self.assertEqual(self.lab_reports.collection.find_one({"_id": inferred})["lab_request_id"], urinalysis["_id"])
+        self.assertEqual(self.consultations.lab_requests.count_outstanding(), 0)
+
+    def test_migration_creates_lab_requests(self):
+        for tests in (["CBC", " Lipid panel"], [], ["X-ray"]):
+            self.consultations.collection.insert_one({"patient_id": ObjectId(), "doctor_id": ObjectId(),
+                                                      "lab_requests": tests, "created_at": datetime.utcnow()})
+        self.assertEqual(migrate_lab_requests(dry_run=True, batch_size=1, consultations=self.consultations),
+                         {"consultations": 2, "requests": 3, "batches": 2})
+        self.assertEqual(self.consultations.lab_requests.count_outstanding(), 0)
+        migrate_lab_requests(consultations=self.consultations)
+        self.assertEqual(sorted(request["test"] for request in self.consultations.lab_requests.queue()),
+                         ["CBC", "Lipid panel", "X-ray"])
+        self.assertEqual(migrate_lab_requests(consultations=self.consultations)["requests"], 0)
+
+    def test_lab_reports_by_consultation(self):
+        consultation_id = ObjectId()
+        self.lab_reports.create({"consultation_id": consultation_id, "patient_id": ObjectId(),
+                                 "created_at": datetime.utcnow()})
+        self.assertEqual(len(self.lab_reports.list_for_consultation(consultation_id)), 1)
+
+
+class VocabularyTests(unittest.TestCase):
+
+    def test_normalize_terms(self):
+        self.assertEqual(normalize_terms("Peanut, tree nuts;  PEANUTS\n", "allergies"), ["peanuts", "tree nuts"])
+        self.assertEqual(normalize_terms(["Afib", " heart   attack "], "medical_history"),
+                         ["atrial fibrillation", "myocardial infarction"])
+        # Unknown terms are kept, cleaned; unknown fields only clean
+        self.assertEqual(normalize_terms(["Mango "], "allergies"), ["mango"])
+        self.assertEqual(normalize_terms(["PCN"], "other"), ["pcn"])
+        self.assertEqual(normalize_terms(None, "allergies"), [])
+
+
+class AuthenticationTests(unittest.TestCase):
+    """register_user / authenticate_user on the shared repositories"""
+
+    def test_register_and_authenticate(self):
+        from utils import register_user, authenticate_user
+        
+        email = f"user_{ObjectId()}@test.com"
+        self.assertEqual(register_user("Test", email, "secret", "patient"),
+                         (True, "User registered successfully"))
+        self.assertEqual(register_user("Test", email, "secret", "patient"),
+                         (False, "User already exists"))
+        
+        success, user = authenticate_user(email, "secret")
+        self.assertTrue(success)
+        self.assertEqual(user["email"], email)
+        self.assertEqual(authenticate_user(email, "wrong"), (False, None))
+    
+    def test_lab_accounts_are_created_by_an_admin(self):
+        from database import users
+        
+        for page in ("mediconsult_app.py", os.path.join("pages", "admin_dashboard.py")):
+            at = AppTest.from_file(os.path.join(APP_DIR, page), default_timeout=60).run()
+            register_as = next(box for box in at.selectbox if box.label == "Register as")
+            self.assertNotIn("Lab", register_as.options)
+        
+        admin_id = users.create({"name": "Lab Admin", "email": f"admin_{ObjectId()}@test.com", "user_type": "admin"})
+        at = AppTest.from_file(os.path.join(APP_DIR, "mediconsult_app.py"), default_timeout=60)
+        at.session_state.logged_in = True
+        at.session_state.user_id = admin_id
+        at.session_state.user_type = "admin"
+        at.session_state.user_name = "Lab Admin"
+        at.run()
+        email = f"lab_{ObjectId()}@test.com"
+        next(field for field in at.text_input if field.label == "Lab Name").input("City Lab")
+        next(field for field in at.text_input if field.label == "Email").input(email)
+        next(field for field in at.text_input if field.label == "Password").input("secret")
+        next(button for button in at.button if button.label == "Create Lab Account").click().run()
+        deadline = time.monotonic() + 10
+        while not at.success and time.monotonic() < deadline:
+            time.sleep(0.05)
+            at.run()
+        self.assertEqual([success.value for success in at.success], ["Lab account created"])
+        self.assertEqual(users.get_by_email(email)["user_type"], "lab")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
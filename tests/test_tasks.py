@@ -0,0 +1,96 @@
+"""
+Background task executor tests for MediConsult
+
+Test Coverage:
+1. Task ids, status and progress for thread tasks
+2. Cooperative cancellation of running tasks and cancellation of queued ones
+3. Bounded queues
+4. Process pool tasks
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from tasks import TaskExecutor, QueueFull, report_progress, check_cancelled
+
+
+def wait_for(executor, task_id, timeout=10):
+    task = executor.get(task_id)
+    deadline = time.monotonic() + timeout
+    while not task.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return task
+
+
+class TaskExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = TaskExecutor(threads=1, processes=1, queue_limit=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_thread_task_reports_progress_and_result(self):
+        step = threading.Event()
+
+        def work(count):
+            for i in range(count):
+                report_progress(i / count, f"step {i}")
+                step.wait(5)
+            return count
+
+        task_id = self.executor.submit(work, 2, name="work")
+        task = self.executor.get(task_id)
+        self.assertEqual(task.name, "work")
+        while task.message != "step 0":
+            time.sleep(0.01)
+        self.assertEqual((task.status, task.progress), ("running", 0.0))
+        step.set()
+        task = wait_for(self.executor, task_id)
+        self.assertEqual((task.status, task.result, task.progress), ("done", 2, 1.0))
+
+    def test_failed_task_keeps_error(self):
+        task = wait_for(self.executor, self.executor.submit(lambda: 1 / 0))
+        self.assertEqual(task.status, "failed")
+        self.assertIsInstance(task.error, ZeroDivisionError)
+
+    def test_cancel_running_and_queued_tasks(self):
+        started = threading.Event()
+
+        def loop():
+            started.set()
+            while True:
+                check_cancelled()
+                time.sleep(0.01)
+
+        running = self.executor.submit(loop)
+        queued = self.executor.submit(loop)
+        started.wait(5)
+        self.assertTrue(self.executor.cancel(queued))
+        self.assertTrue(self.executor.cancel(running))
+        self.assertEqual(wait_for(self.executor, running).status, "cancelled")
+        self.assertEqual(wait_for(self.executor, queued).status, "cancelled")
+        self.assertFalse(self.executor.cancel(running))
+
+    def test_queue_is_bounded(self):
+        release = threading.Event()
+        first = self.executor.submit(release.wait, 5)
+        self.executor.submit(release.wait, 5)
+        with self.assertRaises(QueueFull):
+            self.executor.submit(release.wait, 5)
+        release.set()
+        wait_for(self.executor, first)
+        # A finished task frees its slot
+        self.assertEqual(wait_for(self.executor, self.executor.submit(len, "abc")).result, 3)
+
+    def test_process_task(self):
+        task = wait_for(self.executor, self.executor.submit(pow, 2, 10, kind="process"), timeout=60)
+        self.assertEqual((task.status, task.result), ("done", 1024))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
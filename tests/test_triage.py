@@ -0,0 +1,184 @@
+"""
+Triage priority tests for MediConsult
+
+Test Coverage:
+1. Score from red-flag phrases, age bands and re-consultation, capped
+2. Aging: a routine request that has waited long enough goes before a newer urgent one
+3. Consultations scored on create (encrypted symptoms included) and the queue read in index order
+   The age given on the consultation form is scored when the profile has none
+4. The migration scoring older consultations and dropping the old queue index
+5. The doctor's queue shows the most urgent request first
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("MEDICONSULT_STORAGE", "memory")
+
+from bson import ObjectId
+from streamlit.testing.v1 import AppTest
+
+from config import TRIAGE_MINUTES_PER_POINT
+from database import users, consultations, UserRepository, ConsultationRepository
+from database.memory import MemoryDatabase
+from encryption import FieldCipher, generate_master_key, is_encrypted
+from models import Consultation
+from migrations import migrate_triage_priority, LEGACY_QUEUE_INDEX
+from triage import TriageLexicon, triage_score, triage_due_at, red_flags, priority_label, MAX_SCORE
+
+LEXICON = {
+    "red_flags": {
+        "chest pain": {"points": 40, "phrases": ["chest tightness", "pain in my chest"]},
+        "breathing difficulty": {"points": 40, "phrases": ["short of breath", "can't breathe"]},
+        "high fever": {"points": 15, "phrases": []}
+    },
+    "re_consultation_points": 10,
+    "age_points": [{"below": 2, "points": 15}, {"from": 75, "points": 15}, {"from": 65, "points": 10}]
+}
+
+
+class TriageScoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lexicon = TriageLexicon(LEXICON)
+
+    def test_red_flags(self):
+        self.assertEqual(self.lexicon.red_flags("High fever, and a PAIN IN MY CHEST since this morning"),
+                         ["chest pain", "high fever"])
+        self.assertEqual(self.lexicon.score("Pain in my chest; high fever"), 45)
+        self.assertEqual(self.lexicon.score("Mild cough"), 0)
+        self.assertEqual(self.lexicon.score(None), 0)
+
+    def test_age_and_re_consultation(self):
+        self.assertEqual(self.lexicon.score("Mild cough", age=80), 15)
+        self.assertEqual(self.lexicon.score("Mild cough", age="70"), 10)
+        self.assertEqual(self.lexicon.score("Mild cough", age=1), 15)
+        self.assertEqual(self.lexicon.score("Mild cough", age=30, re_consultation=True), 10)
+        self.assertEqual(self.lexicon.score("Mild cough", age="unknown"), 0)
+        
+        self.assertEqual(self.lexicon.score("chest tightness, can't breathe, high fever", age=90,
+                                            re_consultation=True), 40 + 5 + 5 + 15 + 10)
+        severe = TriageLexicon({**LEXICON, "red_flags": {"collapse": {"points": 95}}})
+        self.assertEqual(severe.score("Collapse", age=90), MAX_SCORE)
+
+    def test_shipped_lexicon(self):
+        self.assertIn("breathing difficulty", red_flags("I have been short of breath all night"))
+        self.assertGreater(triage_score("Sudden slurred speech and face drooping"),
+                           triage_score("Sore throat for two days"))
+        self.assertEqual(priority_label(triage_score("crushing chest pain, fainted")), "🔴 Urgent")
+        self.assertEqual(priority_label(None), "🟢 Routine")
+
+    def test_aging(self):
+        now = datetime(2026, 1, 1, 12)
+        urgent = triage_due_at(now, 50)
+        self.assertEqual(now - urgent, timedelta(minutes=50 * TRIAGE_MINUTES_PER_POINT))
+        self.assertLess(urgent, triage_due_at(now - timedelta(hours=1), 0))
+        self.assertGreater(urgent, triage_due_at(now - timedelta(hours=6), 0))
+
+
+class TriageQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        db = MemoryDatabase()
+        self.users = UserRepository(db)
+        self.consultations = ConsultationRepository(db, FieldCipher(db, master_key=generate_master_key()))
+        self.consultations.ensure_indexes()
+        self.doctor_id = ObjectId()
+        self.patient_id = self.users.create({"name": "Elder", "email": "elder@example.com",
+                                             "user_type": "patient", "age": 80})
+
+    def create(self, symptoms, minutes_ago=0, **fields):
+        return self.consultations.create({"patient_id": self.patient_id, "doctor_id": self.doctor_id,
+                                          "symptoms": symptoms, "status": "pending",
+                                          "created_at": datetime.utcnow() - timedelta(minutes=minutes_ago),
+                                          **fields})
+
+    def test_scored_on_create(self):
+        consult_id = self.create("Crushing chest pain")
+        stored = self.consultations.collection.find_one({"_id": consult_id})
+        self.assertTrue(is_encrypted(stored["symptoms"]))
+        self.assertEqual(stored["triage_score"], triage_score("Crushing chest pain", age=80))
+        self.assertEqual(stored["triage_due_at"], triage_due_at(stored["created_at"], stored["triage_score"]))
+        
+        follow_up = self.create("Still coughing", parent_consultation_id=consult_id)
+        self.assertEqual(self.consultations.get(follow_up)["triage_score"],
+                         triage_score("Still coughing", age=80, re_consultation=True))
+
+    def test_age_from_the_form(self):
+        # Registration stores no age; the consultation form asks for it
+        patient_id = self.users.create({"name": "No Age", "email": "no-age@example.com", "user_type": "patient"})
+        form = Consultation(patient_id=patient_id, doctor_id=self.doctor_id, symptoms="Mild cough", patient_age=80)
+        consult_id = self.consultations.create(form.to_dict())
+        self.assertEqual(self.consultations.get(consult_id)["triage_score"], triage_score("Mild cough", age=80))
+        self.assertGreater(triage_score("Mild cough", age=80), triage_score("Mild cough"))
+        
+        parent = self.consultations.get(consult_id)
+        follow_up = Consultation(patient_id=patient_id, doctor_id=self.doctor_id, symptoms="Still coughing",
+                                 patient_age=parent.get("patient_age"))
+        follow_up_id, _ = self.consultations.create_follow_up(parent, follow_up.to_dict(), str(ObjectId()))
+        self.assertEqual(self.consultations.get(follow_up_id)["triage_score"],
+                         triage_score("Still coughing", age=80, re_consultation=True))
+    
+    def test_queue_order(self):
+        routine = self.create("Mild rash")
+        urgent = self.create("Slurred speech and face drooping")
+        waited = self.create("Mild rash", minutes_ago=24 * 60)
+        completed = self.create("Fainted twice", status="completed")
+        queue = self.consultations.pending_queue(self.doctor_id, {"_id": 1, "triage_score": 1})
+        self.assertEqual([consult["_id"] for consult in queue], [waited, urgent, routine])
+        self.assertNotIn(completed, [consult["_id"] for consult in queue])
+        self.assertEqual(len(self.consultations.pending_queue(self.doctor_id, {"_id": 1}, limit=2)), 2)
+        
+        index_keys = [info["key"] for info in self.consultations.collection.index_information().values()]
+        self.assertIn([("doctor_id", 1), ("status", 1), ("triage_due_at", 1)], index_keys)
+
+    def test_migration(self):
+        legacy = self.consultations.collection.insert_one(
+            self.consultations.encrypt_fields(self.patient_id, {
+                "patient_id": self.patient_id, "doctor_id": self.doctor_id, "symptoms": "Can't breathe",
+                "status": "pending", "created_at": datetime.utcnow()})).inserted_id
+        scored = self.create("Mild rash")
+        self.consultations.collection.create_index([("doctor_id", 1), ("status", 1)])
+        
+        self.assertEqual(migrate_triage_priority(dry_run=True, consultations=self.consultations),
+                         {"scored": 1, "batches": 1, "legacy_index_dropped": 1})
+        self.assertNotIn("triage_score", self.consultations.collection.find_one({"_id": legacy}))
+        migrate_triage_priority(batch_size=1, consultations=self.consultations)
+        queue = self.consultations.pending_queue(self.doctor_id, {"_id": 1})
+        self.assertEqual([consult["_id"] for consult in queue], [legacy, scored])
+        self.assertNotIn(LEGACY_QUEUE_INDEX, self.consultations.collection.index_information())
+        self.assertEqual(migrate_triage_priority(consultations=self.consultations),
+                         {"scored": 0, "batches": 0, "legacy_index_dropped": 0})
+
+
+class DoctorQueueTests(unittest.TestCase):
+
+    def test_most_urgent_first(self):
+        doctor_id = users.create({"name": "Triage Doctor", "email": f"triage-{ObjectId()}@example.com",
+                                  "user_type": "doctor"})
+        for name, symptoms in (("Routine Patient", "Itchy eyes"), ("Urgent Patient", "Chest pain and fainted")):
+            patient_id = users.create({"name": name, "email": f"{ObjectId()}@example.com", "user_type": "patient"})
+            urgent_id = consultations.create({"patient_id": patient_id, "doctor_id": doctor_id, "symptoms": symptoms,
+                                              "status": "pending", "created_at": datetime.utcnow()})
+        
+        at = AppTest.from_file(os.path.join(APP_DIR, "mediconsult_app.py"), default_timeout=60)
+        at.session_state.logged_in = True
+        at.session_state.user_id = doctor_id
+        at.session_state.user_type = "doctor"
+        at.session_state.user_name = "Triage Doctor"
+        # The labels come from the queue; the red flags show once the request is opened
+        at.session_state[f"response_{urgent_id}"] = True
+        at.run()
+        self.assertEqual(len(at.exception), 0)
+        self.assertEqual([expander.label for expander in at.expander],
+                         ["🔴 Urgent · Consultation from Urgent Patient", "🟢 Routine · Consultation from Routine Patient"])
+        self.assertTrue(any("red flags: loss of consciousness, chest pain" in markdown.value
+                            for markdown in at.markdown))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,86 @@
+# triage/__init__.py
+import json
+from datetime import timedelta
+from functools import lru_cache
+
+from config import TRIAGE_FILE, TRIAGE_MINUTES_PER_POINT
+from interactions import DrugTrie
+
+MAX_SCORE = 100
+
+# Each further red flag after the highest-scoring one adds this much
+EXTRA_FLAG_POINTS = 5
+
+# Shown on the doctor's queue: (lowest score, label), highest band first
+PRIORITY_BANDS = ((40, "🔴 Urgent"), (15, "🟠 Soon"), (0, "🟢 Routine"))
+
+class TriageLexicon:
+    """Scores a consultation request from its symptom text, the patient's age and whether it is a follow-up.
+    
+    Red-flag phrases are matched in one trie pass over the symptoms, tokenized
+    like prescriptions (case and punctuation ignored). Negations are not
+    understood: "no chest pain" still counts, which errs towards seeing the
+    patient sooner.
+    """
+
+    def __init__(self, data):
+        self.points = {}
+        self.trie = DrugTrie()
+        for flag, entry in data.get("red_flags", {}).items():
+            self.points[flag] = entry["points"]
+            for phrase in (flag, *entry.get("phrases", [])):
+                self.trie.add(phrase, flag)
+        self.age_bands = data.get("age_points", [])
+        self.re_consultation_points = data.get("re_consultation_points", 0)
+
+    def red_flags(self, symptoms):
+        """Red flags named in the symptoms, highest points first"""
+        return sorted(self.trie.find(symptoms or ""), key=lambda flag: -self.points[flag])
+
+    def age_points(self, age):
+        """Points of the first age band the age falls in; none when the age is unknown"""
+        try:
+            age = float(age)
+        except (TypeError, ValueError):
+            return 0
+        for band in self.age_bands:
+            if age < band.get("below", float("inf")) and age >= band.get("from", float("-inf")):
+                return band["points"]
+        return 0
+
+    def score(self, symptoms, age=None, re_consultation=False):
+        flags = self.red_flags(symptoms)
+        score = self.points[flags[0]] + EXTRA_FLAG_POINTS * (len(flags) - 1) if flags else 0
+        score += self.age_points(age)
+        if re_consultation:
+            score += self.re_consultation_points
+        return min(score, MAX_SCORE)
+
+@lru_cache(maxsize=None)
+def load_lexicon(path=TRIAGE_FILE):
+    """The triage lexicon from a JSON file, read once per process"""
+    with open(path, encoding='utf-8') as f:
+        return TriageLexicon(json.load(f))
+
+def triage_score(symptoms, age=None, re_consultation=False):
+    """0 (routine) to MAX_SCORE (most urgent)"""
+    return load_lexicon().score(symptoms, age, re_consultation)
+
+def red_flags(symptoms):
+    return load_lexicon().red_flags(symptoms)
+
+def triage_due_at(created_at, score):
+    """Queue position: the creation time moved earlier by TRIAGE_MINUTES_PER_POINT per point.
+    
+    The pending queue is read in triage_due_at order, so a higher score goes
+    first, but only by a fixed head start: a routine request that has waited
+    longer than that head start is seen before a newer urgent one. Aging needs
+    no periodic rescoring and the order comes straight from the index.
+    """
+    return created_at - timedelta(minutes=score * TRIAGE_MINUTES_PER_POINT)
+
+def priority_label(score):
+    for lowest, label in PRIORITY_BANDS:
+        if (score or 0) >= lowest:
+            return label
+    return PRIORITY_BANDS[-1][1]
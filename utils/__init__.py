@@ -1,21 +1,40 @@
 # utils/__init__.py
-import bcrypt
+import atexit
+import functools
+import hashlib
+import secrets
+import time
+import uuid
 import streamlit as st
-from database.connection import db
-from config import USERS_COLLECTION
-from bson import ObjectId
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from bson import ObjectId, Binary
+from pymongo.errors import DuplicateKeyError, ConnectionFailure
+from database import users, consultations, lab_reports, sessions, patient_records, audit_log, generations
+from database.connection import breaker
+from database.generations import DIRECTORY_SCOPE, doctor_scope, patient_scope
+from metrics import HASHING
+from interactions import check_prescription
+from triage import red_flags, priority_label
+from config import (USER_TYPE_PATIENT, SLOT_MINUTES, SESSION_TTL_MINUTES, QUERY_CACHE_TTL_SECONDS,
+                    QUERY_CACHE_MAX_ENTRIES, DB_BREAKER_RESET_SECONDS)
+
+# bcrypt, scheduling, tasks and models are imported where they are used, so a
+# new replica only loads what the first views need (startup.warm_up preloads them)
 
 def hash_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    import bcrypt
+    with HASHING.track():
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
 def verify_password(password, hashed):
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    import bcrypt
+    with HASHING.track():
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
 def register_user(name, email, password, user_type, **kwargs):
-    users_collection = db.get_collection(USERS_COLLECTION)
-    
     # Check if user already exists
-    if users_collection.find_one({"email": email}):
+    if users.get_by_email(email):
         return False, "User already exists"
     
     # Create new user
@@ -25,31 +44,483 @@ def register_user(name, email, password, user_type, **kwargs):
         "email": email,
         "password": hashed_password,
         "user_type": user_type,
-        **kwargs
+        **kwargs,
+        "created_at": datetime.utcnow()
     }
     
-    result = users_collection.insert_one(user_data)
+    try:
+        users.create(user_data)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        return False, "User already exists"
     return True, "User registered successfully"
 
 def authenticate_user(email, password):
-    users_collection = db.get_collection(USERS_COLLECTION)
-    user = users_collection.find_one({"email": email})
+    user = users.get_by_email(email)
     
     if user and verify_password(password, user["password"]):
         return True, user
     return False, None
 
-def get_user_by_id(user_id):
-    users_collection = db.get_collection(USERS_COLLECTION)
-    return users_collection.find_one({"_id": user_id})
+def get_user_profile(user_id):
+    """User document without the password hash, from the process-wide user cache.
+    
+    Sessions keep only the _id (st.session_state.user_id, selected_doctor_id)
+    and resolve names and details through this cache on each run.
+    """
+    return users.get_profile(user_id)
+
+# Password checks read the full document with users.get_by_email()
+get_user_by_id = get_user_profile
 
+def update_user_profile(user_id, **fields):
+    """Change profile fields (not the password) and drop the cached profile"""
+    if "password" in fields:
+        raise ValueError("Passwords are not changed through the profile")
+    return users.update_profile(user_id, fields)
+
+# Cached queries by name, for the one st.cache_data function that serves them all
+_GENERATIONAL = {}
+
+@st.cache_data(ttl=QUERY_CACHE_TTL_SECONDS, max_entries=QUERY_CACHE_MAX_ENTRIES, show_spinner=False,
+               hash_funcs={ObjectId: str})
+def _generational_result(name, generation, args):
+    return _GENERATIONAL[name](*args)
+
+def generational(scope):
+    """Cache a query across sessions until a write bumps the generation of scope(*args).
+    
+    Results are keyed by the generation they were read at, so unchanged views
+    are served from memory and the first call after a relevant write queries
+    again. scope returning None bypasses the cache.
+    """
+    def decorator(fn):
+        _GENERATIONAL[fn.__qualname__] = fn
+        
+        @functools.wraps(fn)
+        def cached(*args):
+            key = scope(*args)
+            if key is None:
+                return fn(*args)
+            return _generational_result(fn.__qualname__, generations.get(key), args)
+        return cached
+    return decorator
+
+@generational(lambda specialization=None: DIRECTORY_SCOPE)
 def get_doctors_by_specialization(specialization=None):
-    users_collection = db.get_collection(USERS_COLLECTION)
-    query = {"user_type": "doctor"}
-    if specialization:
-        query["specialization"] = specialization
-    return list(users_collection.find(query))
+    return users.list_doctors(specialization, {"password": 0})
+
+@generational(lambda: DIRECTORY_SCOPE)
+def get_all_doctors():
+    return users.list_doctors(projection={"password": 0})
 
 def get_all_patients():
-    users_collection = db.get_collection(USERS_COLLECTION)
-    return list(users_collection.find({"user_type": "patient"}))
\ No newline at end of file
+    return users.list_by_type(USER_TYPE_PATIENT)
+
+# Fields needed to render a collapsed history row
+CONSULTATION_SUMMARY_PROJECTION = {
+    "_id": 1,
+    "created_at": 1,
+    "status": 1,
+    "doctor_id": 1,
+    "doctor_name": 1,
+    "patient_id": 1,
+    "patient_name": 1,
+    "appointment_start": 1,
+    "parent_consultation_id": 1,
+    "thread_root_id": 1
+}
+
+def _consultations_scope(query):
+    if "doctor_id" in query:
+        return doctor_scope(query["doctor_id"])
+    if "patient_id" in query:
+        return patient_scope(query["patient_id"])
+    return None
+
+@generational(_consultations_scope)
+def get_consultation_summaries(query):
+    """List consultations matching query with only the summary fields, newest first"""
+    return consultations.find(query, CONSULTATION_SUMMARY_PROJECTION)
+
+@generational(doctor_scope)
+def get_pending_consultations(doctor_id):
+    """Ids, patient, triage score and creation time of the doctor's pending consultations, in triage order.
+    
+    Each is loaded by its own fragment, once its row is opened.
+    """
+    return consultations.pending_queue(doctor_id, {"_id": 1, "patient_id": 1, "triage_score": 1, "created_at": 1})
+
+@generational(doctor_scope)
+def count_pending_consultations(doctor_id):
+    return consultations.count({"doctor_id": doctor_id, "status": "pending"})
+
+@generational(lambda consultation_id, patient_id: patient_scope(patient_id) if patient_id is not None else None)
+def get_consultation_detail(consultation_id, patient_id):
+    """Full consultation document, loaded only when a row is expanded.
+    
+    Cached under its patient's generation, which every write to the
+    consultation bumps, so no replica serves it stale.
+    """
+    return consultations.get(consultation_id)
+
+def get_patient_record(patient_id):
+    """The patient's summary record: one document read, however many consultations they have"""
+    return patient_records.get(patient_id)
+
+def patient_record_summary(patient_id):
+    """Allergies, history, recent diagnoses and active prescriptions from the patient's record"""
+    audit_access("view_patient_record", patient_id)
+    record = get_patient_record(patient_id)
+    if not record:
+        st.write("No previous record.")
+        return
+    st.write(f"**Known Allergies:** {', '.join(record.get('allergies', [])) or 'None recorded'}")
+    st.write(f"**Medical History:** {', '.join(record.get('medical_history', [])) or 'None recorded'}")
+    if record.get("diagnoses"):
+        st.write("**Recent Diagnoses:**")
+        for entry in reversed(record["diagnoses"]):
+            st.write(f"- {entry['diagnosed_at'].strftime('%Y-%m-%d')}: {entry['diagnosis']} (Dr. {entry.get('doctor_name') or 'Unknown'})")
+    if record.get("prescriptions"):
+        st.write("**Active Prescriptions:**")
+        for entry in reversed(record["prescriptions"]):
+            st.write(f"- {entry['prescription']} (since {entry['prescribed_at'].strftime('%Y-%m-%d')})")
+
+def prescription_warnings(consult):
+    """Flag the draft prescription's conflicts with the patient's allergies and active prescriptions.
+    
+    Runs on every rerun of the doctor's response fragment, i.e. each time the
+    prescription field is edited; the check itself is a few hash lookups.
+    """
+    prescription = st.session_state.get(f"prescription_{consult['_id']}")
+    if not prescription:
+        return
+    record = get_patient_record(consult["patient_id"]) or {}
+    allergies = [*consult.get("allergies", []), *record.get("allergies", [])]
+    current = [entry["prescription"] for entry in record.get("prescriptions", [])
+               if entry.get("consultation_id") != consult["_id"]]
+    for conflict in check_prescription(prescription, allergies, current):
+        if conflict["kind"] == "allergy":
+            message = f"{conflict['drug']} conflicts with the recorded allergy to {conflict['conflicts_with']}"
+        else:
+            message = f"{conflict['drug']} interacts with {conflict['conflicts_with']}"
+        alert = st.error if conflict["severity"] == "high" else st.warning
+        alert(f"{message} ({conflict['reason']})", icon="⚠️")
+
+def get_consultation_thread(root_id):
+    """A thread's first consultation and its follow-ups, oldest first, from one indexed query"""
+    return consultations.thread(root_id)
+
+def triage_summary(consult):
+    """Priority band, score and the red flags found in the symptoms"""
+    if consult.get("triage_score") is None:
+        return
+    flags = red_flags(consult.get("symptoms"))
+    found = f" — red flags: {', '.join(flags)}" if flags else ""
+    st.write(f"**Triage:** {priority_label(consult['triage_score'])} (score {consult['triage_score']}){found}")
+
+def consultation_thread_summary(consult):
+    """Earlier messages of the thread a follow-up belongs to, each shown with its own text only"""
+    if not consult.get("thread_root_id"):
+        return
+    earlier = [entry for entry in get_consultation_thread(consult["thread_root_id"])
+               if entry["created_at"] < consult["created_at"]]
+    if not earlier:
+        return
+    st.write("**Earlier in this thread:**")
+    for entry in earlier:
+        diagnosis = f" — Diagnosis: {entry['diagnosis']}" if entry.get("diagnosis") else ""
+        st.write(f"- {entry['created_at'].strftime('%Y-%m-%d')}: {entry['symptoms']}{diagnosis}")
+
+@st.cache_resource(show_spinner=False)
+def get_audit_logger():
+    """Audit log buffer shared by every session of this server process, flushed at exit"""
+    from audit import AuditLogger
+    logger = AuditLogger(audit_log)
+    atexit.register(logger.close)
+    return logger
+
+def audit_access(action, patient_id, **details):
+    """Record that the logged-in user viewed patient_id's information; never blocks on the database"""
+    get_audit_logger().record(action, st.session_state.get("user_id"), patient_id,
+                              actor_type=st.session_state.get("user_type"), **details)
+
+def idempotency_key(form_name, *payload):
+    """Client key for one submission of a form instance.
+    
+    Double-clicks and reruns that resubmit the same content reuse the key, so
+    the write is not repeated; changing the content starts a new submission.
+    """
+    fingerprint = hashlib.sha256(repr(payload).encode('utf-8')).hexdigest()
+    form_keys = st.session_state.setdefault("idempotency_keys", {})
+    key, last_fingerprint = form_keys.get(form_name, (None, None))
+    if key is None or last_fingerprint != fingerprint:
+        key = uuid.uuid4().hex
+        form_keys[form_name] = (key, fingerprint)
+    return key
+
+@st.cache_resource(ttl=600, show_spinner=False)
+def _slot_index():
+    from scheduling import build_slot_index
+    generation = generations.get(DIRECTORY_SCOPE)
+    index = build_slot_index(users, consultations)
+    index.directory_generation = generation
+    return index
+
+def get_slot_index():
+    """Process-wide appointment availability index.
+    
+    Doctors are re-indexed as soon as a write on any replica bumps the
+    directory generation (a doctor created, or their availability changed);
+    bookings made on other replicas are picked up by the rebuild every 10
+    minutes, and caught by the unique slot index meanwhile.
+    """
+    index = _slot_index()
+    generation = generations.get(DIRECTORY_SCOPE)
+    if generation != index.directory_generation:
+        index.sync_doctors(users.list_doctors(), generation)
+    return index
+
+def book_consultation_slot(consultation_data, doctor_id, start, key):
+    """Create a consultation holding an appointment slot; return (_id, created).
+    
+    Returns (None, False) when the slot was taken by a booking the local index
+    had not seen yet (another session or pod).
+    """
+    slot_index = get_slot_index()
+    consultation_data = {
+        **consultation_data,
+        "appointment_start": start,
+        "appointment_end": start + timedelta(minutes=SLOT_MINUTES)
+    }
+    
+    try:
+        consultation_id, created = consultations.create_once(consultation_data, key)
+    except DuplicateKeyError:
+        slot_index.book(doctor_id, start)
+        return None, False
+    
+    slot_index.book(doctor_id, start)
+    return consultation_id, created
+
+@st.cache_resource(show_spinner=False)
+def get_task_executor():
+    """Thread and process pools shared by every session of this server process"""
+    from tasks import TaskExecutor
+    return TaskExecutor()
+
+def submit_task(name, fn, *args, kind="thread", **kwargs):
+    """Run fn in the background for this session under name; return False if the queue is full"""
+    from tasks import QueueFull
+    try:
+        task_id = get_task_executor().submit(fn, *args, kind=kind, name=name, **kwargs)
+    except QueueFull:
+        return False
+    st.session_state.setdefault("tasks", {})[name] = task_id
+    return True
+
+def get_task(name):
+    task_id = st.session_state.get("tasks", {}).get(name)
+    return get_task_executor().get(task_id) if task_id else None
+
+def cancel_task(name):
+    task_id = st.session_state.get("tasks", {}).get(name)
+    if task_id:
+        get_task_executor().cancel(task_id)
+
+@st.fragment(run_every=1)
+def task_progress(name, label):
+    """Poll this session's task once a second and rerun the page when it finishes"""
+    task = get_task(name)
+    if not task or task.finished:
+        st.rerun()
+    st.progress(task.progress, text=task.message or label)
+    st.button("Cancel", key=f"cancel_task_{name}", on_click=cancel_task, args=(name,),
+              disabled=task.cancel_requested)
+
+def task_outcome(name, label):
+    """The finished task submitted under name, or None while it runs (showing its progress).
+    
+    A finished task is returned once and then forgotten by the session.
+    """
+    task = get_task(name)
+    if task is None:
+        return None
+    if not task.finished:
+        task_progress(name, label)
+        return None
+    st.session_state["tasks"].pop(name, None)
+    return task
+
+def save_lab_reports(consultation_id, patient_id, doctor_id, files, lab_request_id=None):
+    """Store uploaded (filename, content_type, data) files against a consultation; run as a task.
+    
+    Each report results the lab request it answers (see LabReportRepository.create).
+    """
+    from models import LabReport
+    from tasks import report_progress, check_cancelled
+    for i, (filename, content_type, data) in enumerate(files):
+        check_cancelled()
+        report_progress(i / len(files), f"Uploading {filename}")
+        report = LabReport(consultation_id, patient_id, doctor_id, report_type=content_type,
+                           report_data=Binary(data), file_path=filename, lab_request_id=lab_request_id)
+        lab_reports.create(report.to_dict())
+    return len(files)
+
+# =============================================
+# SESSION CHECKPOINTS
+# =============================================
+
+# Session state a reconnecting client gets back on any replica: auth, navigation and the
+# keys of submitted forms, so a resubmission after the move is still not repeated...
+SESSION_CHECKPOINT_KEYS = ("logged_in", "user_id", "user_type", "user_name",
+                           "navigation", "selected_doctor_id", "selected_slot", "idempotency_keys")
+# ...and drafts of the doctor's response, by widget key prefix
+SESSION_DRAFT_PREFIXES = ("diagnosis_", "prescription_", "lab_requests_", "notes_", "status_")
+# Drafts of clinical text are checkpointed encrypted like the consultation field they become
+SESSION_ENCRYPTED_DRAFTS = {"diagnosis_": "diagnosis", "prescription_": "prescription", "notes_": "consultation_notes"}
+# The token travels in the URL, which the browser keeps when it reconnects. It resumes a
+# session once: restoring moves the checkpoint to a new token
+SESSION_QUERY_PARAM = "session"
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def start_session():
+    """Issue a session token after login and checkpoint the new session under it"""
+    token = secrets.token_urlsafe(24)
+    st.session_state.session_token = token
+    st.query_params[SESSION_QUERY_PARAM] = token
+    checkpoint_session()
+
+def keep_drafts(consult_id):
+    """Keep a consultation's response drafts through runs that do not render their widgets (row collapsed)"""
+    for prefix in SESSION_DRAFT_PREFIXES:
+        key = f"{prefix}{consult_id}"
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+
+def _checkpointed_user_valid(state):
+    """Whether the checkpoint's user still exists with the role it logged in with"""
+    if state.get("user_id") is None:
+        return False
+    user = users.get_by_id(state["user_id"], {"user_type": 1})
+    return user is not None and user.get("user_type") == state.get("user_type")
+
+def restore_session():
+    """Rehydrate a new session from the checkpoint named in the URL; return True if restored.
+    
+    The checkpoint moves to a new token, so the URL that resumed it (kept in
+    history, logs or a shared link) cannot resume it again.
+    """
+    token = st.query_params.get(SESSION_QUERY_PARAM)
+    if not token:
+        return False
+    # Taken atomically: of two requests with the same token only one gets the checkpoint
+    state = sessions.take(_token_hash(token))
+    if state is None or not _checkpointed_user_valid(state):
+        del st.query_params[SESSION_QUERY_PARAM]
+        return False
+    new_token = secrets.token_urlsafe(24)
+    sessions.save(_token_hash(new_token), state, timedelta(minutes=SESSION_TTL_MINUTES))
+    for key, value in _decrypt_drafts(state).items():
+        st.session_state[key] = value
+    st.session_state.session_token = new_token
+    st.query_params[SESSION_QUERY_PARAM] = new_token
+    return True
+
+def _draft_field(key):
+    """(prefix, consultation field) of a clinical text draft's widget key, else (None, None)"""
+    return next(((prefix, field) for prefix, field in SESSION_ENCRYPTED_DRAFTS.items() if key.startswith(prefix)),
+                (None, None))
+
+def _encrypt_drafts(state):
+    """state as checkpointed: clinical text drafts encrypted under their consultation's patient data key"""
+    cipher = consultations.cipher
+    if cipher is None:
+        return state
+    stored = dict(state)
+    for key, value in state.items():
+        prefix, field = _draft_field(key)
+        if field and value:
+            consult = consultations.get(ObjectId(key[len(prefix):]), {"patient_id": 1})
+            if consult and consult.get("patient_id") is not None:
+                stored[key] = cipher.encrypt(consult["patient_id"], field, value)
+            else:
+                # Nothing to encrypt it under, so it is not kept
+                del stored[key]
+    return stored
+
+def _decrypt_drafts(state):
+    """state as restored: the drafts _encrypt_drafts() encrypted back in plain text"""
+    cipher = consultations.cipher
+    if cipher is None:
+        return state
+    restored = dict(state)
+    for key, value in state.items():
+        field = _draft_field(key)[1]
+        if field:
+            restored[key] = cipher.decrypt(field, value)
+    return restored
+
+def checkpoint_session():
+    """Save the checkpointed keys if they changed, or to extend the TTL of an active session.
+    
+    Called at the end of each full run and as on_change of draft widgets,
+    which may only rerun their fragment.
+    """
+    token = st.session_state.get("session_token")
+    if not token:
+        return
+    state = {key: st.session_state[key] for key in SESSION_CHECKPOINT_KEYS if key in st.session_state}
+    state.update({key: value for key, value in st.session_state.to_dict().items()
+                  if key.startswith(SESSION_DRAFT_PREFIXES)})
+    fingerprint = hashlib.sha256(repr(sorted(state.items())).encode('utf-8')).hexdigest()
+    last_fingerprint, last_saved = st.session_state.get("session_checkpoint", (None, 0))
+    ttl = timedelta(minutes=SESSION_TTL_MINUTES)
+    if fingerprint == last_fingerprint and time.monotonic() - last_saved < ttl.total_seconds() / 3:
+        return
+    sessions.save(_token_hash(token), _encrypt_drafts(state), ttl)
+    st.session_state.session_checkpoint = (fingerprint, time.monotonic())
+
+def end_session():
+    """Forget the checkpoint on logout so the URL can no longer resume the session"""
+    token = st.session_state.pop("session_token", None)
+    if token:
+        sessions.delete(_token_hash(token))
+    st.session_state.pop("session_checkpoint", None)
+    if SESSION_QUERY_PARAM in st.query_params:
+        del st.query_params[SESSION_QUERY_PARAM]
+
+# =============================================
+# DATABASE OUTAGES
+# =============================================
+
+DEGRADED_MESSAGE = ("MediConsult cannot reach its database right now, so records are unavailable. "
+                    "This page will reload by itself once the connection is back.")
+
+@contextmanager
+def degraded_on_outage(recover=False):
+    """Show the degraded banner in place of the rest of a run when Mongo is unreachable.
+    
+    Wraps the app script (recover=True, which polls for recovery) and, as a
+    decorator, fragments and callbacks that run on their own. While the circuit
+    breaker is open, database calls fail at once, so the banner costs nothing.
+    """
+    try:
+        yield
+    except ConnectionFailure:
+        st.warning(DEGRADED_MESSAGE, icon="⚠️")
+        if recover:
+            outage_recovery()
+
+@st.fragment(run_every=DB_BREAKER_RESET_SECONDS)
+def outage_recovery():
+    """Rerun the page once the breaker lets database calls through again"""
+    if not st.session_state.get("outage_polling"):
+        # The first run is part of the page run that just failed
+        st.session_state.outage_polling = True
+        return
+    if breaker.state != breaker.OPEN:
+        st.session_state.outage_polling = False
+        st.rerun()
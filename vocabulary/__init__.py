@@ -0,0 +1,59 @@
+# vocabulary/__init__.py
+import json
+import re
+from functools import lru_cache
+
+from config import VOCABULARY_FILE
+
+# Consultation fields holding lists of clinical terms, normalized on write
+CLINICAL_TERM_FIELDS = ("allergies", "medical_history")
+
+# Entries are typed as free text, one per comma (or semicolon, or line)
+TERM_SEPARATORS = re.compile(r"[,;\n]")
+
+@lru_cache(maxsize=None)
+def load_vocabulary(path=VOCABULARY_FILE):
+    """{field: {term or synonym (casefolded): canonical term}} from a JSON vocabulary file.
+    
+    The file maps each field to {canonical term: [synonyms]}; it is read once per process.
+    """
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    vocabulary = {}
+    for field, terms in raw.items():
+        lookup = vocabulary.setdefault(field, {})
+        for canonical, synonyms in terms.items():
+            canonical = _clean(canonical)
+            for synonym in (canonical, *synonyms):
+                lookup[_clean(synonym)] = canonical
+    return vocabulary
+
+def canonical_terms(field):
+    """The vocabulary's canonical terms for a field, sorted"""
+    return sorted(set(load_vocabulary().get(field, {}).values()))
+
+def _clean(term):
+    """Trimmed, inner whitespace collapsed, casefolded"""
+    return " ".join(term.split()).strip(" .").casefold()
+
+def normalize_term(term, field):
+    """One entry in canonical form; terms not in the vocabulary are kept, cleaned"""
+    term = _clean(term)
+    return load_vocabulary().get(field, {}).get(term, term)
+
+def normalize_terms(values, field):
+    """Entries as typed (a string or a list of strings) as canonical terms, without blanks or repeats"""
+    if isinstance(values, str):
+        values = [values]
+    terms = []
+    for value in values or []:
+        for part in TERM_SEPARATORS.split(value or ""):
+            term = normalize_term(part, field)
+            if term and term not in terms:
+                terms.append(term)
+    return terms
+
+def normalize_clinical_fields(document):
+    """A copy of document with its clinical term lists normalized (fields it lacks stay absent)"""
+    return {**document, **{field: normalize_terms(document[field], field)
+                           for field in CLINICAL_TERM_FIELDS if field in document}}